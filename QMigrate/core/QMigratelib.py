@@ -7,36 +7,256 @@ of the QuakeMigrate package.
 
 import os
 import pathlib
+import warnings
 
 import numpy as np
 import numpy.ctypeslib as clib
 
 c_int = clib.ctypes.c_int
-c_int8 = clib.ctypes.c_int8
-c_int16 = clib.ctypes.c_int16
 c_int32 = clib.ctypes.c_int32
 c_int64 = clib.ctypes.c_int64
 c_dbl = clib.ctypes.c_double
+c_flt = clib.ctypes.c_float
 
 c_dPt = clib.ndpointer(dtype=np.float64, flags="C_CONTIGUOUS")
-c_i8Pt = clib.ndpointer(dtype=np.int8, flags="C_CONTIGUOUS")
-c_i16Pt = clib.ndpointer(dtype=np.int16, flags="C_CONTIGUOUS")
+c_fPt = clib.ndpointer(dtype=np.float32, flags="C_CONTIGUOUS")
+c_u8Pt = clib.ndpointer(dtype=np.uint8, flags="C_CONTIGUOUS")
+c_u16Pt = clib.ndpointer(dtype=np.uint16, flags="C_CONTIGUOUS")
 c_i32Pt = clib.ndpointer(dtype=np.int32, flags="C_CONTIGUOUS")
 c_i64Pt = clib.ndpointer(dtype=np.int64, flags="C_CONTIGUOUS")
 c_iPt = clib.ndpointer(dtype=np.int32, flags="C_CONTIGUOUS")
 
-p = pathlib.Path(__file__).parents[1] / "lib/QMigrate"
-if os.name == 'nt':
-    _qmigratelib = clib.load_library(str(p.with_suffix(".dll")), ".")
-else:  # posix
-    _qmigratelib = clib.load_library(str(p.with_suffix(".so")), ".")
+# Builds of the C-library, from most to least specialised: (variant name,
+# library suffix, CPU features required). See setup.py.
+KERNEL_VARIANTS = [("avx512", "_avx512", ["AVX512F", "AVX512DQ", "AVX2",
+                                          "FMA3"]),
+                   ("avx2", "_avx2", ["AVX2", "FMA3"]),
+                   ("sse42", "_sse42", ["SSE42"]),
+                   ("portable", "", [])]
 
 
-_qmigratelib.scan4d.argtypes = [c_dPt, c_i32Pt, c_dPt, c_int32, c_int32,
-                                c_int32, c_int32, c_int64, c_int64]
+def cpu_features():
+    """
+    Return the set of SIMD instruction set extensions supported by the CPU
+    of the running host, e.g. {"SSE42", "AVX2", "FMA3"}.
+
+    Uses the runtime CPU feature detection of numpy where available, and
+    /proc/cpuinfo otherwise.
+
+    """
+
+    try:
+        try:
+            from numpy._core._multiarray_umath import __cpu_features__
+        except ImportError:
+            from numpy.core._multiarray_umath import __cpu_features__
+        return set(k for k, v in __cpu_features__.items() if v)
+    except ImportError:
+        pass
+
+    # Map /proc/cpuinfo flag names onto the numpy feature names
+    names = {"sse4_2": "SSE42", "avx2": "AVX2", "fma": "FMA3",
+             "avx512f": "AVX512F", "avx512dq": "AVX512DQ"}
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    flags = line.split(":")[1].split()
+                    return set(names[f] for f in flags if f in names)
+    except IOError:
+        pass
+
+    return set()
+
+
+def _load_library():
+    """
+    Load the most specialised build of the C-library that the running CPU
+    supports. The QMIGRATE_KERNEL environment variable (e.g. "portable") can
+    be used to force a particular variant.
+
+    Returns
+    -------
+    lib : ctypes CDLL object
+        Loaded C-library
+
+    variant : str
+        Name of the loaded variant
+
+    """
+
+    p = pathlib.Path(__file__).parents[1] / "lib/QMigrate"
+    ext = ".dll" if os.name == "nt" else ".so"
+    features = cpu_features()
+    forced = os.environ.get("QMIGRATE_KERNEL")
+
+    for variant, suffix, required in KERNEL_VARIANTS:
+        if forced and variant != forced:
+            continue
+        if not set(required).issubset(features) and not forced:
+            continue
+        lib = p.parent / (p.name + suffix + ext)
+        if not lib.exists():
+            continue
+        try:
+            return clib.load_library(str(lib), "."), variant
+        except OSError:
+            continue
+
+    msg = "Unable to load the QMigrate C-library"
+    if forced:
+        msg += " variant {}".format(forced)
+    raise OSError(msg + " from {}".format(p.parent))
+
+
+try:
+    _qmigratelib, _kernel_variant = _load_library()
+except OSError as e:
+    msg = "{} - the C-compiled backend is unavailable"
+    warnings.warn(msg.format(e))
+    _qmigratelib, _kernel_variant = None, None
+
+
+def available():
+    """
+    Return True if the C-library was loaded, i.e. this backend can be used.
+
+    """
+
+    return _qmigratelib is not None
+
+
+def kernel_variant():
+    """
+    Return the name of the build of the C-library that is in use: "avx512",
+    "avx2", "sse42" or "portable" (None if the C-library is unavailable).
+
+    """
+
+    return _kernel_variant
+
+
+# Each kernel is compiled in double precision (e.g. scan4d) and single
+# precision (e.g. scan4d_f32); the wrappers select one from the dtype of the
+# onset functions / coalescence map they are given. The migration kernels are
+# also compiled to read a compact travel-time index (see
+# QMigrate.core.model.CompactIndex) with uint16 (e.g. scan4d_u16) or uint8
+# (e.g. scan4d_f32_u8) per-station offsets, and to compute analytic
+# (homogeneous velocity) travel times on the fly (e.g. scan4d_analytic; see
+# QMigrate.core.model.AnalyticIndex).
+for _sfx, _c_rPt, _c_real in [("", c_dPt, c_dbl),
+                               ("_f32", c_fPt, c_flt)]:
+    if _qmigratelib is None:
+        break
+    getattr(_qmigratelib, "detect4d" + _sfx).argtypes = \
+        [_c_rPt, _c_rPt, c_i64Pt, c_int32, c_int32, c_int32, c_int64,
+         c_int64]
+    getattr(_qmigratelib, "detect4d_cellmajor" + _sfx).argtypes = \
+        [_c_rPt, _c_rPt, c_i64Pt, c_int32, c_int32, c_int32, c_int64,
+         c_int64]
+    for _isfx, _c_iPts in [("", [c_i32Pt]), ("_u16", [c_i32Pt, c_u16Pt]),
+                           ("_u8", [c_i32Pt, c_u8Pt])]:
+        getattr(_qmigratelib, "scan4d" + _sfx + _isfx).argtypes = \
+            [_c_rPt] + _c_iPts + [_c_rPt, c_int32, c_int32, c_int32, c_int32,
+                                  c_int64, c_int64]
+        getattr(_qmigratelib, "scan4d_tiled" + _sfx + _isfx).argtypes = \
+            [_c_rPt] + _c_iPts + [_c_rPt, c_int32, c_int32, c_int32, c_int32,
+                                  c_int64, c_int64]
+        getattr(_qmigratelib, "scan4d_detect" + _sfx + _isfx).argtypes = \
+            [_c_rPt] + _c_iPts + [_c_rPt, c_i64Pt, c_dPt, c_int32, c_int32,
+                                  c_int32, c_int32, c_int64, c_int64]
+        getattr(_qmigratelib, "scan4d_detect_pruned" + _sfx + _isfx).argtypes \
+            = [_c_rPt] + _c_iPts + [_c_rPt, c_i64Pt, c_dPt, c_int32, c_int32,
+                                    c_int32, c_int32, c_int64, c_int64,
+                                    c_int64, _c_real, c_int64]
+    getattr(_qmigratelib, "scan4d" + _sfx + "_analytic").argtypes = \
+        [_c_rPt, c_dPt, c_dPt, c_dPt, c_dbl, _c_rPt, c_int32, c_int32,
+         c_int32, c_int32, c_int64, c_int64, c_int64, c_int64]
+    getattr(_qmigratelib, "scan4d_detect" + _sfx + "_analytic").argtypes = \
+        [_c_rPt, c_dPt, c_dPt, c_dPt, c_dbl, _c_rPt, c_i64Pt, c_dPt, c_int32,
+         c_int32, c_int32, c_int32, c_int64, c_int64, c_int64, c_int64]
+    getattr(_qmigratelib, "onset_classic" + _sfx).argtypes = \
+        [_c_rPt, c_dPt, c_int32, c_dPt, c_int32, c_int32, c_int32, _c_rPt,
+         _c_rPt, c_int32, c_int32, c_int32, c_int64]
+
+
+def _index_args(tt):
+    """
+    Return the kernel name suffix and arguments for a travel-time index
+    table: a full int32 array, or a CompactIndex object (duck-typed on its
+    base and delta arrays).
+
+    """
+
+    if hasattr(tt, "delta"):
+        if tt.delta.dtype == np.uint8:
+            return "_u8", [tt.base, tt.delta]
+        return "_u16", [tt.base, tt.delta]
+
+    return "", [tt]
+
+
+def _analytic_args(tt):
+    """
+    Return the grid, station and velocity arguments of the analytic
+    travel-time kernels for an AnalyticIndex object, followed by the cell
+    count along each axis.
+
+    """
+
+    nx, ny, nz = tt.shape[:-1]
+    return [tt.geometry, tt.stations, tt.velocity, c_dbl(tt.sampling_rate)], \
+        [c_int64(nx), c_int64(ny), c_int64(nz)]
+
+
+def _kernel(name, *arrays, index=""):
+    """
+    Select the double (float64) or single (float32) precision build of a
+    C-compiled kernel from the dtype of the floating point arrays passed to it.
+
+    Parameters
+    ----------
+    name : str
+        Name of the double precision kernel
+
+    arrays : array-like
+        Floating point arrays that will be passed to the kernel
+
+    index : str, optional
+        Suffix of the travel-time index variant of the kernel, "_u16" or "_u8"
+        for a compact index (see _index_args)
+
+    Raises
+    ------
+    ValueError
+        If the arrays do not share a single floating point dtype, or the dtype
+        is not float32 or float64
 
+    RuntimeError
+        If the C-library is not available
 
-def migrate(sig, tt, fsmp, lsmp, nsamp, map4d, threads):
+    """
+
+    if _qmigratelib is None:
+        raise RuntimeError("The QMigrate C-library is not available.")
+
+    dtypes = set(np.dtype(a.dtype) for a in arrays)
+    if len(dtypes) != 1:
+        msg = "Mismatch between precision of input and output arrays, {}"
+        msg = msg.format(", ".join(sorted(str(d) for d in dtypes)))
+        raise ValueError(msg)
+
+    dtype = dtypes.pop()
+    if dtype == np.float64:
+        return getattr(_qmigratelib, name + index)
+    elif dtype == np.float32:
+        return getattr(_qmigratelib, name + "_f32" + index)
+
+    msg = "Unsupported precision {} - must be float32 or float64".format(dtype)
+    raise ValueError(msg)
+
+
+def migrate(sig, tt, fsmp, lsmp, nsamp, map4d, threads, tiled=False):
     """
     Wrapper for the C-compiled scan4d function: computes 4-D coalescence map
     by back-migrating P and S onset functions.
@@ -45,10 +265,10 @@ def migrate(sig, tt, fsmp, lsmp, nsamp, map4d, threads):
 
     Parameters
     ----------
-    sig : array-like
+    sig : array-like, float64 or float32
         P and S onset functions
 
-    tt : array-like
+    tt : array-like, CompactIndex or AnalyticIndex object
         P and S travel-time lookup-tables
 
     fsmp : int
@@ -60,12 +280,23 @@ def migrate(sig, tt, fsmp, lsmp, nsamp, map4d, threads):
     nsamp : int
         Number of samples in array to scan over
 
-    map4d : array-like
+    map4d : array-like, same dtype as sig
         Empty array with shape of 4-D coalescence map that will be output
 
     threads : int
         Number of threads to perform the scan on
 
+    tiled : bool, optional
+        Use the cache-blocked scan4d_tiled kernel, which migrates tiles of
+        cells x time samples x stations so that the onset and coalescence
+        tiles stay in cache. Gives identical output to scan4d. It helps only
+        once a row of map4d no longer fits in L1 cache (roughly nsamp > 3000
+        in double precision, or half that in single precision) and with the
+        instruction-set specific builds of the C-library (see
+        kernel_variant()), where it is up to ~2x faster; otherwise it is no
+        faster than scan4d, hence off by default. See
+        benchmarks/bench_scan4d.py. Not used for an AnalyticIndex.
+
     Raises
     ------
     ValueError
@@ -78,6 +309,9 @@ def migrate(sig, tt, fsmp, lsmp, nsamp, map4d, threads):
     ValueError
         If the sig array is smaller than map4d[0, 0, 0, :]
 
+    ValueError
+        If sig and map4d do not have the same floating point precision
+
     """
 
     nstn, ssmp = sig.shape
@@ -98,16 +332,25 @@ def migrate(sig, tt, fsmp, lsmp, nsamp, map4d, threads):
         msg = "Data array smaller than coalescence array."
         raise ValueError(msg)
 
-    _qmigratelib.scan4d(sig, tt, map4d, c_int32(fsmp), c_int32(lsmp),
-                        c_int32(nsamp), c_int32(nstn),  c_int64(tcell),
-                        c_int64(threads))
+    if hasattr(tt, "velocity"):
+        index, cells = _analytic_args(tt)
+        scan = _kernel("scan4d", sig, map4d, index="_analytic")
+        scan(sig, *index, map4d, c_int32(fsmp), c_int32(lsmp), c_int32(nsamp),
+             c_int32(nstn), *cells, c_int64(threads))
+        return
 
+    isfx, index = _index_args(tt)
+    if tiled:
+        scan = _kernel("scan4d_tiled", sig, map4d, index=isfx)
+    else:
+        scan = _kernel("scan4d", sig, map4d, index=isfx)
 
-_qmigratelib.detect4d.argtypes = [c_dPt, c_dPt, c_i64Pt, c_int32,
-                                  c_int32, c_int32, c_int64, c_int64]
+    scan(sig, *index, map4d, c_int32(fsmp), c_int32(lsmp), c_int32(nsamp),
+         c_int32(nstn), c_int64(tcell), c_int64(threads))
 
 
-def find_max_coa(map4d, max_coa, grid_index, fsmp, lsmp, threads):
+def find_max_coa(map4d, max_coa, grid_index, fsmp, lsmp, threads,
+                 cell_major=True):
     """
     Wrapper for the C-compiled detect4d function: finds the maximum
     coalescence value in the 4-D coalesence grid at each time-step.
@@ -116,10 +359,10 @@ def find_max_coa(map4d, max_coa, grid_index, fsmp, lsmp, threads):
 
     Parameters
     ----------
-    map4d : array-like
+    map4d : array-like, float64 or float32
         4-D coalescence map
 
-    max_coa : array-like, double
+    max_coa : array-like, same dtype as map4d
         empty array with shape of max coa values that will be output
 
     grid_index : 
@@ -133,11 +376,21 @@ def find_max_coa(map4d, max_coa, grid_index, fsmp, lsmp, threads):
     threads : int
         Number of threads to perform the scan on
 
+    cell_major : bool, optional
+        Use the detect4d_cellmajor kernel (default), which parallelises over
+        blocks of cells and reads contiguous time rows of map4d into
+        per-thread running max/argmax arrays. If False, use detect4d, which
+        parallelises over time and reads map4d with a stride of nsamp. Both
+        give identical output.
+
     Raises
     ------
     ValueError
         If the output array size is too small
 
+    ValueError
+        If map4d and max_coa do not have the same floating point precision
+
     """
 
     nsamp = map4d.shape[-1]
@@ -148,6 +401,205 @@ def find_max_coa(map4d, max_coa, grid_index, fsmp, lsmp, threads):
         msg = msg.format(nsamp)
         raise ValueError(msg)
 
-    _qmigratelib.detect4d(map4d, max_coa, grid_index, c_int32(fsmp),
-                          c_int32(lsmp), c_int32(nsamp), c_int64(ncell),
-                          c_int64(threads))
+    if cell_major:
+        detect = _kernel("detect4d_cellmajor", map4d, max_coa)
+    else:
+        detect = _kernel("detect4d", map4d, max_coa)
+    detect(map4d, max_coa, grid_index, c_int32(fsmp), c_int32(lsmp),
+           c_int32(nsamp), c_int64(ncell), c_int64(threads))
+
+
+def migrate_max_coa(sig, tt, fsmp, lsmp, nsamp, max_coa, grid_index, sum_coa,
+                    threads, prune=False, threshold=None):
+    """
+    Wrapper for the C-compiled scan4d_detect function: back-migrates P and S
+    onset functions and reduces the coalescence over the grid at each
+    time-step in a single pass, without storing the 4-D coalescence map.
+
+    Equivalent to migrate() followed by find_max_coa() and a sum over the
+    grid axes of map4d, but uses only O(nsamp) working memory per thread.
+
+    With prune=True the scan4d_detect_pruned function is used instead: the
+    grid is split into blocks of cells, and blocks whose coalescence is
+    bounded (by the per-station onset maxima over their travel-time range)
+    below the running maximum are skipped. max_coa and grid_index are
+    identical to those from scan4d_detect; sum_coa is computed from the
+    travel-time histogram of each station and agrees to rounding error.
+
+    Returns output by populating max_coa, grid_index and sum_coa.
+
+    Parameters
+    ----------
+    sig : array-like, float64 or float32
+        P and S onset functions
+
+    tt : array-like, CompactIndex or AnalyticIndex object
+        P and S travel-time lookup-tables
+
+    fsmp : int
+        First sample in array to scan from
+
+    lsmp : int
+        Last sample in array to scan upto
+
+    nsamp : int
+        Number of samples in array to scan over
+
+    max_coa : array-like, same dtype as sig
+        Empty array with shape (nsamp,) for the maximum coalescence value
+
+    grid_index : array-like, int64
+        Empty array with shape (nsamp,) for the grid index of the maximum
+        coalescence value
+
+    sum_coa : array-like, float64
+        Empty array with shape (nsamp,) for the sum of the coalescence over
+        all grid cells (always accumulated in double precision)
+
+    threads : int
+        Number of threads to perform the scan on
+
+    prune : bool, optional
+        Skip blocks of cells that cannot contain the maximum coalescence (not
+        supported for an AnalyticIndex, for which it is ignored)
+
+    threshold : float, optional
+        With prune=True, also skip blocks of cells that cannot reach this
+        (raw) coalescence value. Where the maximum coalescence is below the
+        threshold, max_coa and grid_index are then only those of the cells
+        that were migrated.
+
+    Raises
+    ------
+    ValueError
+        If there is a mismatch between number of stations in sig and look-up
+        table
+
+    ValueError
+        If the output array size is too small
+
+    ValueError
+        If the sig array is smaller than the requested scan
+
+    ValueError
+        If sig and max_coa do not have the same floating point precision
+
+    """
+
+    nstn, ssmp = sig.shape
+
+    if not tt.shape[-1] == nstn:
+        msg = "Mismatch between number of stations for data and LUT, {} - {}"
+        msg = msg.format(nstn, tt.shape[-1])
+        raise ValueError(msg)
+
+    tcell = np.prod(tt.shape[:-1])
+
+    if max_coa.size < nsamp or grid_index.size < nsamp or \
+       sum_coa.size < nsamp:
+        msg = "Output array size too small, sample count = {}."
+        msg = msg.format(nsamp)
+        raise ValueError(msg)
+
+    if sig.size < nsamp + fsmp:
+        msg = "Data array smaller than coalescence array."
+        raise ValueError(msg)
+
+    if hasattr(tt, "velocity"):
+        index, cells = _analytic_args(tt)
+        scan = _kernel("scan4d_detect", sig, max_coa, index="_analytic")
+        scan(sig, *index, max_coa, grid_index, sum_coa, c_int32(fsmp),
+             c_int32(lsmp), c_int32(nsamp), c_int32(nstn), *cells,
+             c_int64(threads))
+        return
+
+    isfx, index = _index_args(tt)
+    if prune:
+        nx, ny, nz = tt.shape[:-1] if tt.ndim == 4 else (tcell, 1, 1)
+        thres = 0. if threshold is None else float(threshold)
+        scan = _kernel("scan4d_detect_pruned", sig, max_coa, index=isfx)
+        scan(sig, *index, max_coa, grid_index, sum_coa, c_int32(fsmp),
+             c_int32(lsmp), c_int32(nsamp), c_int32(nstn), c_int64(nx),
+             c_int64(ny), c_int64(nz), thres, c_int64(threads))
+    else:
+        scan = _kernel("scan4d_detect", sig, max_coa, index=isfx)
+        scan(sig, *index, max_coa, grid_index, sum_coa, c_int32(fsmp),
+             c_int32(lsmp), c_int32(nsamp), c_int32(nstn), c_int64(tcell),
+             c_int64(threads))
+
+
+def onset(sig, sos, taper, nsta, nlta, onset, onset_raw, threads,
+          detrend=False):
+    """
+    Wrapper for the C-compiled onset_classic function: band-pass filters
+    seismic data and computes its classic STA/LTA onset function, in a single
+    pass per channel, as QMigrate.signal.scan.filter() followed by
+    QMigrate.signal.scan.onset() (with centred=False).
+
+    Returns output by populating onset and onset_raw, which may be views
+    into a larger array (e.g. the rows of the onset functions passed to
+    migrate()).
+
+    Parameters
+    ----------
+    sig : array-like, float64 or float32
+        Data signal, shape (nchannels, nsamples), or (ncomponents, nchannels,
+        nsamples) to combine the onset functions of several components as
+        sqrt(mean(onset ** 2)) (e.g. the S onset from the E and N components)
+
+    sos : array-like
+        Band-pass filter, as second-order sections (scipy.signal.butter with
+        output="sos")
+
+    taper : array-like
+        Taper applied to each channel, shape (nsamples,)
+
+    nsta : int
+        Number of samples in short-term window
+
+    nlta : int
+        Number of samples in long-term window
+
+    onset : array-like, same dtype as sig
+        Empty array with shape (nchannels, nsamples) for the log-clipped
+        onset function
+
+    onset_raw : array-like, same dtype as sig
+        Empty array with shape (nchannels, nsamples) for the raw STA/LTA
+
+    threads : int
+        Number of threads over which to distribute the channels
+
+    detrend : bool, optional
+        Remove the least-squares line through each channel first, as
+        Archive.read_waveform_data() does on reading (i.e. for data read with
+        detrend=False)
+
+    Raises
+    ------
+    ValueError
+        If the output arrays do not match the shape of the channels of sig
+
+    ValueError
+        If sig and the output arrays do not have the same floating point
+        precision
+
+    """
+
+    sig = np.ascontiguousarray(sig)
+    if sig.ndim == 2:
+        sig = sig[np.newaxis]
+    ncomp, nchan, nsamp = sig.shape
+
+    for out in (onset, onset_raw):
+        if out.shape != (nchan, nsamp) or not out.flags.c_contiguous:
+            msg = "Output arrays must be contiguous with shape {}."
+            raise ValueError(msg.format((nchan, nsamp)))
+
+    sos = np.ascontiguousarray(sos, dtype=np.float64)
+    taper = np.ascontiguousarray(taper, dtype=np.float64)
+
+    func = _kernel("onset_classic", sig, onset, onset_raw)
+    func(sig, sos, c_int32(sos.shape[0]), taper, c_int32(bool(detrend)),
+         c_int32(nsta), c_int32(nlta), onset, onset_raw, c_int32(ncomp),
+         c_int32(nchan), c_int32(nsamp), c_int64(threads))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Module providing a registry of the engines (backends) that can run the
+migration and coalescence reduction at the core of the QuakeMigrate package.
+
+Each backend is a module (or any object) that provides the functions
+migrate(), find_max_coa() and migrate_max_coa(), with the signatures of those
+in QMigrate.core.QMigratelib. The backends shipped are:
+
+    "c"     : C-compiled kernels (QMigrate.core.QMigratelib) - registered if
+              the C-library could be loaded
+    "numba" : numba-compiled kernels (QMigrate.core.numbalib) - registered if
+              numba is installed
+    "numpy" : pure-numpy implementation (QMigrate.core.numpylib) - always
+              registered
+
+"""
+
+import QMigrate.core.QMigratelib as ilib
+import QMigrate.core.numpylib as nplib
+
+# Order of preference when no backend is requested
+DEFAULT_ORDER = ["c", "numba", "numpy"]
+
+_backends = {}
+
+
+def register_backend(name, backend):
+    """
+    Register an engine for the migration and coalescence reduction.
+
+    Parameters
+    ----------
+    name : str
+        Name under which to register the backend (replaces any backend
+        already registered with that name)
+
+    backend : module or object
+        Provides migrate(), find_max_coa() and migrate_max_coa()
+
+    Raises
+    ------
+    ValueError
+        If the backend does not provide the required functions
+
+    """
+
+    for func in ["migrate", "find_max_coa", "migrate_max_coa"]:
+        if not callable(getattr(backend, func, None)):
+            msg = "Backend {} does not provide {}()".format(name, func)
+            raise ValueError(msg)
+
+    _backends[name] = backend
+
+
+def available_backends():
+    """
+    Return the names of the registered backends.
+
+    """
+
+    return list(_backends.keys())
+
+
+def get_backend(name=None):
+    """
+    Return a registered backend.
+
+    Parameters
+    ----------
+    name : str, optional
+        Name of the backend. If None, the first available backend in
+        DEFAULT_ORDER is returned.
+
+    Returns
+    -------
+    backend : module or object
+        Provides migrate(), find_max_coa() and migrate_max_coa()
+
+    Raises
+    ------
+    ValueError
+        If the requested backend is not registered
+
+    """
+
+    if name is None:
+        for name in DEFAULT_ORDER:
+            if name in _backends:
+                return _backends[name]
+
+    try:
+        return _backends[name]
+    except KeyError:
+        msg = "Backend {} not available - choose from {}"
+        msg = msg.format(name, ", ".join(available_backends()))
+        raise ValueError(msg)
+
+
+if ilib.available():
+    register_backend("c", ilib)
+
+try:
+    import QMigrate.core.numbalib as nblib
+    register_backend("numba", nblib)
+except ImportError:
+    pass
+
+register_backend("numpy", nplib)
@@ -4,18 +4,46 @@ Module to produce cartesian gridded traveltime look-up tables.
 
 """
 
+import hashlib
 import math
 import warnings
 import pickle
+import shutil
 import struct
+import tempfile
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from copy import copy
 import os
+from subprocess import check_output, STDOUT
 
 import skfmm
 import pyproj
 import numpy as np
 import pandas as pd
-from scipy.interpolate import RegularGridInterpolator, griddata, interp1d
+from scipy.interpolate import RegularGridInterpolator, interp1d
+from scipy.ndimage import map_coordinates
+
+# Native LUT file format (see LUT.save): magic string, header length (uint64),
+# pickled header (LUT attributes, array table and statistics), then each
+# travel-time map as a raw little-endian array, stations first, starting at a
+# multiple of LUT_ALIGN bytes so that it can be memory-mapped
+LUT_MAGIC = b"QMLUT\x00v1"
+LUT_ALIGN = 4096
+
+
+def _map_digest(map_, dtype):
+    """
+    MD5 digest of a travel-time map as stored in a native LUT file: the table
+    of each station in turn, as a raw array of dtype.
+
+    """
+
+    md5 = hashlib.md5()
+    for st in range(map_.shape[-1]):
+        md5.update(np.ascontiguousarray(map_[..., st], dtype=dtype).data)
+
+    return md5.hexdigest()
 
 
 def _cart2sph_np_array(xyz):
@@ -117,53 +145,61 @@ def _utm_zone(longitude):
 def bilinear_interp(pos, gridspec, grid):
     """
     Do bi-linear interpolation between 4 data points on the input 2-D LUT to
-    calculate the traveltime to nodes on the 3-D grid. 
+    calculate the traveltime to nodes on the 3-D grid. Vectorised over any
+    number of positions; positions beyond the edge of the 2-D LUT are
+    extrapolated from its edge cells.
+
+    Parameters
+    ----------
+    pos : array-like
+        (x, z) position, or array of positions with shape (n, 2)
+
+    gridspec : array-like
+        Node count, origin and spacing of the 2-D LUT:
+        [[nx, nz], [x0, z0], [dx, dz]]
+
+    grid : array-like
+        2-D LUT, shape (nx, nz)
+
+    Returns
+    -------
+    c : float or array-like
+        Interpolated value at each position
 
     """
-    if len(pos) == 2:
-        x = pos[0]
-        z = pos[1]
-    else:
-        x = pos[:, 0]
-        z = pos[:, 1]
-    _, _ = gridspec[0]
+
+    pos = np.asarray(pos, dtype=float)
+    x = pos[..., 0]
+    z = pos[..., 1]
     x0, z0 = gridspec[1]
     dx, dz = gridspec[2]
-    # nzy = nx * nz
+    nx, nz = grid.shape
 
-    # get the position of the nearest node
-    i = np.floor((x - x0)/dx).astype(np.int)
-    k = np.floor((z - z0)/dz).astype(np.int)
+    # get the position of the nearest node (keeping the surrounding square
+    # within the grid)
+    xf = (x - x0) / dx
+    zf = (z - z0) / dz
+    i = np.clip(np.floor(xf).astype(int), 0, max(nx - 2, 0))
+    k = np.clip(np.floor(zf).astype(int), 0, max(nz - 2, 0))
 
     # get fractional distance of earthquake along each axis
-    xd = (x / dx) - np.floor(x / dx)
-    zd = (z / dz) - np.floor(z / dz)
-
-    if np.all(zd == 0):
-        # there is no interpolation in Z
-        c0 = grid[i, k]
-        c1 = grid[i+1, k]
-
-        # do the interpolation along x
-        c = c0*(1 - xd) + c1 * xd
-    else:
-
-        # Do bi-linear interpolation
-        # get the 4 data points of the surrounding square
-        c00 = grid[i, k]
-        c10 = grid[i + 1, k]
-        # k[(k==nz-1) & (zd==0.)] -=1
-        c11 = grid[i + 1, k + 1]
-        c01 = grid[i, k + 1]
+    xd = xf - i
+    zd = zf - k
 
-        # do the interpolation along y
-        c0 = c00 * (1 - xd) + c10 * xd
-        c1 = c01 * (1 - xd) + c11 * xd
+    # get the 4 data points of the surrounding square
+    i1 = np.minimum(i + 1, nx - 1)
+    k1 = np.minimum(k + 1, nz - 1)
+    c00 = grid[i, k]
+    c10 = grid[i1, k]
+    c11 = grid[i1, k1]
+    c01 = grid[i, k1]
 
-        # do the interpolation along z
-        c = c0*(1 - zd) + c1 * zd
+    # do the interpolation along x
+    c0 = c00 * (1 - xd) + c10 * xd
+    c1 = c01 * (1 - xd) + c11 * xd
 
-    return c
+    # do the interpolation along z
+    return c0 * (1 - zd) + c1 * zd
 
 
 def read_2d_nlloc(froot):
@@ -193,12 +229,7 @@ def read_2d_nlloc(froot):
         st_y = float(line[2])
         st_z = float(line[3])
 
-    npts = nx * ny * nz
-    with open(froot + ".buf", "rb") as fid:
-        buf = fid.read(npts * 4)
-        data = struct.unpack("f" * npts, buf)
-
-    data = np.reshape(data, (nx, ny, nz), order="C")
+    data = read_nlloc_buf(froot, (nx, ny, nz), dtype=np.float64)
 
     distance_x = x0 + (np.linspace(0, nx - 1, nx) * dx)
     distance_y = y0 + (np.linspace(0, ny - 1, ny) * dy)
@@ -212,6 +243,132 @@ def read_2d_nlloc(froot):
         [[nx, ny, nz], [x0, y0, z0], [dx, dy, dz]]
 
 
+def read_nlloc_buf(froot, shape, dtype=np.float32, mmap=False):
+    """
+    Read a NonLinLoc grid from a .buf file, which holds the grid values as
+    4-byte floats in C order.
+
+    Parameters
+    ----------
+    froot : str
+        File name (not including extension)
+
+    shape : array-like of ints
+        Grid dimensions (nx, ny, nz), from the .hdr file
+
+    dtype : data-type, optional
+        Data type of the returned array (default: float32, as stored)
+
+    mmap : bool, optional
+        Memory-map the file rather than reading it into memory. If dtype is
+        float32 the returned array is a read-only view of the file.
+
+    Returns
+    -------
+    data : array-like
+        Grid values, shape (nx, ny, nz)
+
+    Raises
+    ------
+    ValueError
+        If the file holds fewer values than the grid
+
+    """
+
+    shape = tuple(int(n) for n in shape)
+    npts = int(np.prod(shape))
+    fname = "{}.buf".format(froot)
+
+    if os.path.getsize(fname) < npts * 4:
+        msg = "{} holds fewer than {} grid values.".format(fname, npts)
+        raise ValueError(msg)
+
+    if mmap:
+        data = np.memmap(fname, dtype=np.float32, mode="r", shape=shape)
+    else:
+        data = np.fromfile(fname, dtype=np.float32, count=npts)
+        data = data.reshape(shape)
+
+    return data.astype(dtype, copy=False)
+
+
+# Index maps of resample_grid(), keyed by the geometry of the source and
+# target grids and the interpolation method
+_resample_cache = {}
+RESAMPLE_CACHE_SIZE = 4
+
+
+def _grid_key(grid):
+    return (tuple(grid.cell_count), tuple(grid.cell_size),
+            tuple(np.asarray(grid.grid_centre, dtype=float)),
+            float(grid.azimuth), float(grid.dip))
+
+
+def resample_grid(data, source, target, method="nearest"):
+    """
+    Resample values from one regular grid onto another.
+
+    The position of each target cell is mapped to a (fractional) cell index
+    in the source grid - an affine mapping - and the source values are
+    sampled there. Positions outside the source grid take the value at the
+    nearest edge. The index map depends only on the geometry of the two
+    grids, so it is computed once and reused for every grid resampled
+    between them (e.g. the tables of every station and phase).
+
+    Parameters
+    ----------
+    data : array-like
+        Values on the source grid, shape source.cell_count
+
+    source : Grid3D object
+        Grid on which data is defined
+
+    target : Grid3D object
+        Grid to resample onto
+
+    method : {"nearest", "linear"}, optional
+        Take the value of the nearest source cell, or interpolate trilinearly
+        between the eight surrounding cells (default: "nearest")
+
+    Returns
+    -------
+    resampled : array-like
+        Values on the target grid, shape target.cell_count
+
+    Raises
+    ------
+    ValueError
+        If method is not "nearest" or "linear"
+
+    """
+
+    if method not in ("nearest", "linear"):
+        msg = "Resampling method must be 'nearest' or 'linear', not {}"
+        raise ValueError(msg.format(method))
+
+    key = (_grid_key(source), _grid_key(target), method)
+    index = _resample_cache.get(key)
+    if index is None:
+        xyz = np.stack([c.ravel() for c in target.grid_xyz], axis=1)
+        loc = np.clip(source.xyz2loc(xyz), 0, source.cell_count - 1)
+        if method == "nearest":
+            index = np.ravel_multi_index(np.rint(loc).astype(int).T,
+                                         tuple(source.cell_count))
+        else:
+            index = np.ascontiguousarray(loc.T)
+        if len(_resample_cache) >= RESAMPLE_CACHE_SIZE:
+            _resample_cache.clear()
+        _resample_cache[key] = index
+
+    data = np.asarray(data).reshape(tuple(source.cell_count))
+    if method == "nearest":
+        resampled = np.take(data.ravel(), index)
+    else:
+        resampled = map_coordinates(data, index, order=1, mode="nearest")
+
+    return resampled.reshape(tuple(target.cell_count))
+
+
 def grid_string(max_dist, max_depth, min_depth, dx):
     max_x = int(np.ceil(max_dist / dx)) + 5
     max_z = int(np.ceil((max_depth - min_depth) / dx)) + 5
@@ -256,7 +413,7 @@ def vmodel_string(vmodel, block):
 
 def write_control_file(x, y, z, name, max_dist,
                        vmodel, depth_limits, phase="P",
-                       dx=0.2, block_model=True):
+                       dx=0.2, block_model=True, path="."):
     control_string = """CONTROL 0 54321
 TRANS NONE
 #TRANS LAMBERT WGS-84 8.0 38.0 8.2 8.4 0.0
@@ -292,7 +449,7 @@ GT_PLFD 1.0E-3 0
                                                            block_model),
                                       name=name, y=y, x=x, z=z)
 
-    with open("./control.in", "w") as fid:
+    with open(os.path.join(path, "control.in"), "w") as fid:
         fid.write(outstring)
 
     # print(outstring)
@@ -352,6 +509,244 @@ def eikonal(ix, iy, iz, dxi, dyi, dzi, V, S):
     return t
 
 
+def radial_eikonal(speed, elevation, rmax, zlim, dr, dz):
+    """
+    Travel-time formulation for a velocity model that varies only with
+    elevation: the travel time from a station then depends only on the
+    horizontal distance and elevation, and is computed (with the fast-marching
+    method, as in eikonal) on a 2-D (distance, elevation) grid.
+
+    Parameters
+    ----------
+    speed : function
+        Velocity as a function of elevation (units: m)
+
+    elevation : float
+        Elevation of the station (units: m)
+
+    rmax : float
+        Largest horizontal distance required (units: m)
+
+    zlim : array-like
+        Smallest and largest elevation required (units: m)
+
+    dr : float
+        Distance spacing of the 2-D grid (units: m)
+
+    dz : float
+        Elevation spacing of the 2-D grid (units: m)
+
+    Returns
+    -------
+    t : array-like
+        Travel time at each node of the 2-D grid, shape (nr, nz)
+
+    gridspec : list
+        Node count, origin and spacing of the 2-D grid, as used by
+        bilinear_interp
+
+    """
+
+    # The station is on a node; one node of padding beyond the grid
+    k0 = int(np.floor((zlim[0] - elevation) / dz)) - 1
+    k1 = int(np.ceil((zlim[1] - elevation) / dz)) + 1
+    z = elevation + dz * np.arange(min(k0, 0), max(k1, 0) + 1)
+    nr = int(np.ceil(rmax / dr)) + 2
+
+    phi = -np.ones((nr, len(z)))
+    phi[0, -min(k0, 0)] = 1.0
+    V = np.tile(speed(z), (nr, 1))
+
+    t = skfmm.travel_time(phi, V, dx=[dr, dz])
+    return np.asarray(t), [[nr, len(z)], [0., z[0]], [dr, dz]]
+
+
+def _read_1d_vmodel(vmod_file, header=False, delimiter=","):
+    """
+    Read a 1-D velocity model file (see LUT.compute_1d_vmodel_skfmm) and
+    return functions giving the P- and S-wave velocity (units: m / s) at any
+    elevation (units: m), extended from the top and bottom layers.
+
+    """
+
+    if header:
+        vmod = pd.read_csv(vmod_file, delimiter=delimiter).values
+    else:
+        vmod = pd.read_csv(vmod_file, header=None, delimiter=delimiter).values
+    z, vp, vs = vmod[:, 0], vmod[:, 1] * 1000, vmod[:, 2] * 1000
+
+    z = np.insert(np.append(z, np.finfo(float).min), 0, np.finfo(float).max)
+    vp = np.insert(np.append(vp, vp[-1]), 0, vp[0])
+    vs = np.insert(np.append(vs, vs[-1]), 0, vs[0])
+
+    return interp1d(z, vp), interp1d(z, vs)
+
+
+# State shared by the tasks of a LUT build, set once in each worker process
+# by _init_lut_worker (see _station_maps)
+_lut_worker = {}
+
+
+def _init_lut_worker(state, scratch_root=None):
+    _lut_worker.clear()
+    _lut_worker.update(state)
+
+    # Each worker runs NonLinLoc in its own scratch directory
+    if scratch_root is not None:
+        scratch = tempfile.mkdtemp(dir=scratch_root)
+        os.makedirs(os.path.join(scratch, "model"))
+        os.makedirs(os.path.join(scratch, "time"))
+        _lut_worker["scratch"] = scratch
+
+
+def _station_maps(func, tasks, state, n_cores=1, scratch=False,
+                  threads=False):
+    """
+    Compute the travel-time tables of each station, fanning the stations out
+    to a pool of worker processes.
+
+    Parameters
+    ----------
+    func : function
+        Module-level function computing the tables of one station from its
+        task, reading the shared state from _lut_worker
+
+    tasks : list
+        One task per station
+
+    state : dict
+        State shared by all tasks (e.g. the grid), sent once to each worker
+
+    n_cores : int, optional
+        Number of worker processes. If 1 the tasks are run in this process.
+
+    scratch : bool, optional
+        Create a scratch directory for each worker (removed afterwards)
+
+    threads : bool, optional
+        Run the tasks in a pool of threads of this process, sharing the
+        state, rather than in worker processes. func must be thread-safe.
+
+    Yields
+    ------
+    result : object
+        Output of func for each task, in order
+
+    """
+
+    scratch_root = tempfile.mkdtemp(prefix="qmigrate_lut_") if scratch \
+        else None
+    try:
+        if n_cores > 1 and len(tasks) > 1 and threads:
+            _init_lut_worker(state, scratch_root)
+            with ThreadPoolExecutor(max_workers=min(n_cores,
+                                                    len(tasks))) as pool:
+                for result in pool.map(func, tasks):
+                    yield result
+        elif n_cores > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=min(n_cores, len(tasks)),
+                                     initializer=_init_lut_worker,
+                                     initargs=(state, scratch_root)) as pool:
+                for result in pool.map(func, tasks):
+                    yield result
+        else:
+            _init_lut_worker(state, scratch_root)
+            for task in tasks:
+                yield func(task)
+    finally:
+        _lut_worker.clear()
+        if scratch_root is not None:
+            shutil.rmtree(scratch_root, ignore_errors=True)
+
+
+def _homogeneous_station(loc):
+    gx, gy, gz = _lut_worker["grid_xyz"]
+    dx = gx - float(loc[0])
+    dy = gy - float(loc[1])
+    dz = gz - float(loc[2])
+    dist = np.sqrt(dx**2 + dy**2 + dz**2)
+
+    return dist / _lut_worker["vp"], dist / _lut_worker["vs"]
+
+
+def _eikonal_station(loc):
+    ix, iy, iz = _lut_worker["grid_xyz"]
+    dx, dy, dz = _lut_worker["cell_size"]
+
+    return [eikonal(ix, iy, iz, dx, dy, dz, _lut_worker[v],
+                    loc[np.newaxis, :]) for v in ["vp", "vs"]]
+
+
+def _nlloc_2d_table(task):
+    name, (st_x, st_y, st_z), max_dist = task
+    z0, z1 = _lut_worker["depth_limits"]
+    scratch = _lut_worker["scratch"]
+    nlloc_path = _lut_worker["nlloc_path"]
+
+    # NLLOC needs the station to lie within the 2D section,
+    # therefore we pick the depth extent of the 2D grid from
+    # the maximum possible extent of the station and the grid
+    min_z = np.min([z0, st_z])
+    max_z = np.max([z1, st_z])
+    depth_extent = np.asarray([min_z, max_z])
+
+    tables = []
+    for phase in ["P", "S"]:
+        # Allow 2 nodes on depth extent as a computational buffer
+        write_control_file(st_x / 1000., st_y / 1000., st_z / 1000., name,
+                           max_dist, _lut_worker["vmodel"],
+                           depth_extent / 1000., phase=phase,
+                           dx=_lut_worker["nlloc_dx"],
+                           block_model=_lut_worker["block_model"],
+                           path=scratch)
+
+        out = check_output([os.path.join(nlloc_path, "Vel2Grid"),
+                            "control.in"], stderr=STDOUT, cwd=scratch)
+        if b"ERROR" in out:
+            raise Exception("Vel2Grid Error", out)
+
+        out = check_output([os.path.join(nlloc_path, "Grid2Time"),
+                            "control.in"], stderr=STDOUT, cwd=scratch)
+        if b"ERROR" in out:
+            raise Exception("Grid2Time Error", out)
+
+        to_read = os.path.join(scratch, "time",
+                               "layer.{}.{}.time".format(phase, name))
+        data, _, _, nll_gridspec = read_2d_nlloc(to_read)
+
+        tables.append((data[0, :, :], [nll_gridspec[0][1:],
+                                       nll_gridspec[1][1:],
+                                       nll_gridspec[2][1:]]))
+
+    return tables
+
+
+def _nlloc_3d_station(task):
+    st, name = task
+    path = _lut_worker["path"]
+    maps = _lut_worker.get("maps")
+
+    # When filling the maps, each task reads into its own (shallow) copy of
+    # the LUT so that the tasks can share a thread pool
+    lut = _lut_worker["lut"] if maps is None else copy(_lut_worker["lut"])
+
+    travel_times = []
+    for phase in ["P", "S"]:
+        lut.nlloc_load_file("{}.{}.{}.time".format(path, phase, name),
+                            dtype=_lut_worker["dtype"], mmap=True)
+        if not _lut_worker["regrid"]:
+            lut.nlloc_project_grid()
+        else:
+            lut.nlloc_regrid(_lut_worker["decimate"])
+        if maps is None:
+            travel_times.append(np.array(lut.NLLoc_data))
+        else:
+            maps["TIME_{}".format(phase)][..., st] = lut.NLLoc_data
+        lut.NLLoc_data = None
+
+    return travel_times
+
+
 class Grid3D(object):
     """
     3D grid class
@@ -820,7 +1215,7 @@ class NonLinLoc:
         self.NLLoc_MapOrg = [0.0, 0.0, 0.0, "SIMPLE", 0.0, 0.0]
         self.NLLoc_data = None
 
-    def nlloc_load_file(self, filename):
+    def nlloc_load_file(self, filename, dtype=np.float32, mmap=False):
         """
         Parse information from .hdr and .buf files into NonLinLoc variables
 
@@ -829,10 +1224,27 @@ class NonLinLoc:
         filename : str
             File name (not including extension)
 
+        dtype : data-type, optional
+            Data type of the grid values (default: float32, as stored)
+
+        mmap : bool, optional
+            Memory-map the .buf file rather than reading it into memory
+
         """
 
         # Read the .hdr file
-        f = open("{}.hdr".format(filename), "r")
+        with open("{}.hdr".format(filename), "r") as f:
+            self._nlloc_read_header(f)
+
+        # Reading the .buf file
+        self.NLLoc_data = read_nlloc_buf(filename, self.NLLoc_n, dtype=dtype,
+                                         mmap=mmap)
+
+    def _nlloc_read_header(self, f):
+        """
+        Parse the grid, station and transform lines of an open .hdr file
+
+        """
 
         # Defining the grid dimensions
         params = f.readline().split()
@@ -868,25 +1280,19 @@ class NonLinLoc:
             self.NLLoc_MapOrg = [trans[7], trans[5], trans[9],
                                  trans[3], "0.0", "0.0"]
 
-        # Reading the .buf file
-        fid = open("{}.buf".format(filename), "rb")
-        data = struct.unpack("{}f".format(self.NLLoc_n[0]
-                                          * self.NLLoc_n[1]
-                                          * self.NLLoc_n[2]),
-                             fid.read(self.NLLoc_n[0]
-                                      * self.NLLoc_n[1]
-                                      * self.NLLoc_n[2] * 4))
-        self.NLLoc_data = np.array(data).reshape(self.NLLoc_n[0],
-                                                 self.NLLoc_n[1],
-                                                 self.NLLoc_n[2])
-
-    def nlloc_project_grid(self):
+    def nlloc_project_grid(self, method="nearest"):
         """
         Projecting the grid to the new coordinate system.
 
         This function also determines the 3D grid from the 2D grids from
         NonLinLoc
 
+        Parameters
+        ----------
+        method : {"nearest", "linear"}, optional
+            Interpolation method used to resample the grid (see
+            resample_grid)
+
         """
 
         # Generating the correct NonLinLoc Formatted Grid
@@ -911,15 +1317,8 @@ class NonLinLoc:
         if self.NLLoc_proj == "TRANS_MERC":
             GRID_NLLOC.projections(grid_proj_type=self.NLLoc_MapOrg[3])
 
-        OrgX, OrgY, OrgZ = GRID_NLLOC.grid_xyz
-        NewX, NewY, NewZ = self.grid_xyz
-
-        self.NLLoc_data = griddata((OrgX.flatten(),
-                                    OrgY.flatten(),
-                                    OrgZ.flatten()),
-                                   self.NLLoc_data.flatten(),
-                                   (NewX, NewY, NewZ),
-                                   method="nearest")
+        self.NLLoc_data = resample_grid(self.NLLoc_data, GRID_NLLOC, self,
+                                        method=method)
 
     def nlloc_regrid(self, decimate):
         """
@@ -987,7 +1386,6 @@ class LUT(Grid3D, NonLinLoc):
     -----
     Weighting of the stations with distance (allow the user to define their own
     tables or define a fixed weighting for the problem)
-    Move maps from being stored in RAM (use JSON or HDF5)
 
 
         _select_station - Selecting the stations to be used in the LUT
@@ -1025,8 +1423,15 @@ class LUT(Grid3D, NonLinLoc):
         NonLinLoc.__init__(self)
 
         self.velocity_model = None
+        self.vpvs = None
         self.station_data = stations
         self._maps = {}
+        self._index_cache = {}
+        self._interp_cache = {}
+        self._filename = None
+        self._file_maps = False
+        self._stats = {}
+        self._pyramid = {}
         self.data = None
 
     def __str__(self):
@@ -1074,12 +1479,83 @@ class LUT(Grid3D, NonLinLoc):
 
     @property
     def maps(self):
-        """Get and set the traveltime tables"""
-        return self._maps
+        """
+        Get and set the traveltime tables. If the S-wave table is derived
+        from the P-wave table (see set_vpvs), it is computed on access and
+        the tables are read-only.
+
+        """
+
+        if self.vpvs is None:
+            return self._maps
+        return _DerivedMaps(self)
 
     @maps.setter
     def maps(self, value):
         self._maps = value
+        self._file_maps = False
+        self.vpvs = None
+        self._index_cache = {}
+        self._interp_cache = {}
+        self._stats = {}
+        self._pyramid = {}
+
+    def set_vpvs(self, vpvs):
+        """
+        Define the S-wave travel-time table as the P-wave table scaled by a
+        constant Vp/Vs ratio. Any stored S-wave table is dropped, halving the
+        memory and file size of the LUT; TIME_S is computed from TIME_P when
+        it is needed (e.g. by fetch_index).
+
+        Parameters
+        ----------
+        vpvs : float
+            Vp/Vs ratio
+
+        Raises
+        ------
+        ValueError
+            If vpvs is not positive
+
+        """
+
+        if not vpvs > 0:
+            msg = "Vp/Vs ratio must be positive, not {}".format(vpvs)
+            raise ValueError(msg)
+
+        self._maps.pop("TIME_S", None)
+        self.vpvs = float(vpvs)
+        self._index_cache = {}
+        self._interp_cache = {}
+        self._stats = {}
+        self._pyramid = {}
+
+    def max_traveltime(self, map_="TIME_S"):
+        """
+        Return the maximum travel time in a travel-time table. Read from the
+        header of a native LUT file where available, otherwise computed once
+        and memoised.
+
+        Parameters
+        ----------
+        map_ : str, optional
+            Name of the travel-time table (default: "TIME_S")
+
+        Returns
+        -------
+        ttmax : float
+            Maximum travel time (units: s)
+
+        """
+
+        if map_ == "TIME_S" and self.vpvs is not None:
+            return self.vpvs * self.max_traveltime("TIME_P")
+
+        stats = self._stats.setdefault(map_, {})
+        if "max" not in stats:
+            stats["max"] = float(np.max(self.maps[map_]))
+
+        return stats["max"]
 
     def _select_station(self, station_data):
         if self.station_data is None:
@@ -1095,7 +1571,9 @@ class LUT(Grid3D, NonLinLoc):
 
     def decimate(self, ds, inplace=False):
         """
-        Up- or down-sample the travel-time tables by some factor
+        Up- or down-sample the travel-time tables by some factor. If the
+        level has been precomputed (see build_pyramid), the stored tables are
+        used without copying them.
 
         Parameters
         ----------
@@ -1111,11 +1589,17 @@ class LUT(Grid3D, NonLinLoc):
 
         """
 
+        level = self._pyramid.get(self._level_key(ds))
+
         if not inplace:
             self = copy(self)
-            self.maps = copy(self.maps)
+            self._maps = copy(self._maps)
         else:
             self = self
+        self._index_cache = {}
+        self._interp_cache = {}
+        self._stats = {}
+        self._pyramid = {}
 
         ds = np.array(ds, dtype=np.int)
         cell_count = 1 + (self.cell_count - 1) // ds
@@ -1127,15 +1611,53 @@ class LUT(Grid3D, NonLinLoc):
         self.cell_size = self.cell_size * ds
         self.centre = centre
 
-        maps = self.maps
-        if maps is not None:
+        maps = self._maps
+        if level is not None:
+            # Stored level of the pyramid (see build_pyramid) - no copy
+            maps.clear()
+            maps.update(level)
+        elif maps is not None:
             for id_, map_ in maps.items():
-                maps[id_] = np.ascontiguousarray(map_[c1[0]::ds[0],
-                                                      c1[1]::ds[1],
-                                                      c1[2]::ds[2], :])
+                map_ = map_[c1[0]::ds[0], c1[1]::ds[1], c1[2]::ds[2], :]
+                # Memory-mapped maps (native LUT file) are left as views, so
+                # only the decimated cells are ever read from disk
+                if not isinstance(map_, np.memmap):
+                    map_ = np.ascontiguousarray(map_)
+                maps[id_] = map_
         if not inplace:
             return self
 
+    def build_pyramid(self, levels):
+        """
+        Precompute the travel-time tables decimated by each of a set of
+        factors. decimate() then returns the stored tables of a level
+        without copying them, and save() writes them to the LUT file.
+
+        Parameters
+        ----------
+        levels : list of array-like, ints
+            Decimation factors [x, y, z] of each level, e.g.
+            [[2, 2, 2], [4, 4, 4]]
+
+        """
+
+        pyramid = {}
+        for ds in levels:
+            maps = self.decimate(ds)._maps
+            pyramid[self._level_key(ds)] = {id_: np.ascontiguousarray(map_)
+                                            for id_, map_ in maps.items()}
+        self._pyramid = pyramid
+
+    @property
+    def pyramid_levels(self):
+        """Decimation factors of the stored levels of the pyramid"""
+
+        return sorted(self._pyramid.keys())
+
+    @staticmethod
+    def _level_key(ds):
+        return tuple(int(d) for d in np.broadcast_to(ds, 3))
+
     def decimate_array(self, data, ds):
         self = self
         ds = np.array(ds, dtype=np.int)
@@ -1153,9 +1675,33 @@ class LUT(Grid3D, NonLinLoc):
                                           c1[2]::ds[2]])
         return array
 
-    def get_values_at(self, loc, station=None):
+    def get_values_at(self, loc, station=None, maps=None):
+        """
+        Interpolate several travel-time tables at a batch of grid locations.
+
+        Parameters
+        ----------
+        loc : array-like
+            Grid locations (in cell units), shape (3,) or (npoints, 3)
+
+        station : list of str, optional
+            Stations to return values for (default: all)
+
+        maps : list of str, optional
+            Travel-time tables to interpolate (default: all)
+
+        Returns
+        -------
+        val : dict
+            Interpolated values for each map, shape (npoints, nstation)
+
+        """
+
+        if maps is None:
+            maps = self.maps.keys()
+
         val = {}
-        for map_ in self.maps.keys():
+        for map_ in maps:
             val[map_] = self.get_value_at(map_, loc, station)
         return val
 
@@ -1166,32 +1712,172 @@ class LUT(Grid3D, NonLinLoc):
         loc = self.xyz2loc(xyz)
         return self.interpolate(map_, loc, station)
 
-    def values_at(self, xyz, station=None):
+    def values_at(self, xyz, station=None, maps=None):
         loc = self.xyz2loc(xyz)
-        return self.get_values_at(loc, station)
+        return self.get_values_at(loc, station, maps)
 
     def interpolator(self, map_, station=None):
-        maps = self.fetch_map(map_, station)
-        nc = self.cell_count
-        cc = (np.arange(nc[0]), np.arange(nc[1]), np.arange(nc[2]))
-        return RegularGridInterpolator(cc, maps, bounds_error=False)
+        """
+        Return a linear interpolator over a travel-time table. Interpolators
+        are cached by map and station selection, and the cache is cleared
+        whenever the tables change.
+
+        """
+
+        key = (map_, None if station is None
+               else tuple(np.atleast_1d(self._select_station(station))))
+        interp_fcn = self._interp_cache.get(key)
+        if interp_fcn is None:
+            maps = self.fetch_map(map_, station)
+            nc = self.cell_count
+            cc = (np.arange(nc[0]), np.arange(nc[1]), np.arange(nc[2]))
+            interp_fcn = RegularGridInterpolator(cc, maps, bounds_error=False)
+            self._interp_cache[key] = interp_fcn
+        return interp_fcn
 
     def interpolate(self, map_, loc, station=None):
         interp_fcn = self.interpolator(map_, station)
         return interp_fcn(loc)
 
     def fetch_map(self, map_, station=None):
+        if map_ == "TIME_S" and self.vpvs is not None:
+            return self.vpvs * self.fetch_map("TIME_P", station)
+
         if station is None:
-            return self.maps[map_]
+            return self._maps[map_]
         else:
             station = self._select_station(station)
             return self.maps[map_][..., station]
 
     def fetch_index(self, map_, sampling_rate, station=None):
+        # Tables may be stored in single precision; the index is formed in
+        # double precision either way
         maps = self.fetch_map(map_, station)
-        return np.rint(sampling_rate * maps).astype(np.int32)
+        return np.rint(np.multiply(sampling_rate, maps,
+                                   dtype=np.float64)).astype(np.int32)
+
+    def fetch_ps_index(self, sampling_rate, station=None, compact=False,
+                       persist=False):
+        """
+        Return the combined P and S travel-time index table, i.e.
+        np.c_[fetch_index("TIME_P", ...), fetch_index("TIME_S", ...)], as a
+        single C-contiguous int32 array.
+
+        The table is memoised on the LUT, keyed by the sampling rate, the
+        grid (i.e. the decimation), the station selection and the Vp/Vs
+        ratio (see set_vpvs), so it is only computed once per scan. The cache is cleared when the maps are
+        replaced or the LUT is decimated; the returned arrays are read-only.
+
+        Parameters
+        ----------
+        sampling_rate : float
+            Sampling rate of the onset functions (units: Hz)
+
+        station : array-like of str, optional
+            Names of the stations to include (default: all)
+
+        compact : bool, optional
+            Return the table as a CompactIndex object
+
+        persist : bool, optional
+            Save the table next to the file the LUT was loaded from, and reuse
+            it when the LUT is next loaded (if it is newer than the LUT file
+            and the travel-time tables have not been replaced since)
+
+        Returns
+        -------
+        ttime : array-like, int32, or CompactIndex object
+            Travel-time index table, shape (nx, ny, nz, 2 * nstation)
+
+        """
+
+        stations = None if station is None else tuple(np.ravel(station))
+        key = (float(sampling_rate), tuple(self.cell_count),
+               tuple(self.cell_size), stations, self.vpvs)
+
+        cache = self._index_cache
+        if (key, compact) in cache:
+            return cache[(key, compact)]
+
+        ttime = cache.get((key, False))
+        if ttime is None:
+            ttime = self._load_ps_index(key) if persist else None
+        if ttime is None:
+            ttime = np.ascontiguousarray(
+                np.c_[self.fetch_index("TIME_P", sampling_rate, station),
+                      self.fetch_index("TIME_S", sampling_rate, station)])
+            if persist:
+                self._save_ps_index(key, ttime)
+        ttime.flags.writeable = False
+        cache[(key, False)] = ttime
+
+        if compact:
+            ttime = CompactIndex(ttime)
+            ttime.base.flags.writeable = False
+            ttime.delta.flags.writeable = False
+            cache[(key, True)] = ttime
+
+        return ttime
+
+    def _maps_fingerprint(self):
+        """
+        Identity of the travel-time tables: the MD5 digests of the tables
+        stored in the header of a native LUT file (see _save_native), or
+        else the name, modification time and size of the file the LUT was
+        loaded from. None if the tables have been replaced since. The tables
+        themselves are never read.
+
+        """
+
+        if not self._file_maps:
+            return None
+
+        digests = [self._stats.get(map_, {}).get("md5")
+                   for map_ in sorted(self._maps)]
+        if all(digests):
+            return repr(list(zip(sorted(self._maps), digests)))
+
+        stat = os.stat(self._filename)
+        return repr((self._filename, stat.st_mtime_ns, stat.st_size))
+
+    def _ps_index_file(self, key):
+        """
+        Path of the file holding a persisted index table (see fetch_ps_index),
+        or None if the LUT was not loaded from a file or its travel-time
+        tables have been replaced since.
+
+        """
+
+        if self._filename is None:
+            return None
+
+        fingerprint = self._maps_fingerprint()
+        if fingerprint is None:
+            return None
+
+        tag = hashlib.md5((repr(key) + fingerprint).encode()).hexdigest()[:16]
+        return "{}.{}.idx.npy".format(self._filename, tag)
+
+    def _load_ps_index(self, key):
+        fname = self._ps_index_file(key)
+        if fname is None or not os.path.isfile(fname) or \
+           os.path.getmtime(fname) < os.path.getmtime(self._filename):
+            return None
+
+        return np.load(fname, mmap_mode="r")
 
-    def compute_homogeneous_vmodel(self, vp, vs):
+    def _save_ps_index(self, key, ttime):
+        fname = self._ps_index_file(key)
+        if fname is None:
+            return
+
+        try:
+            np.save(fname, ttime)
+        except OSError as e:
+            msg = "Unable to save travel-time index table - {}".format(e)
+            warnings.warn(msg)
+
+    def compute_homogeneous_vmodel(self, vp, vs, n_cores=1):
         """
         Calculate the travel-time tables for each station in a uniform velocity
         model
@@ -1199,38 +1885,43 @@ class LUT(Grid3D, NonLinLoc):
         Parameters
         ----------
         vp : float
-            P-wave velocity (units: km / s)
+            P-wave velocity (units: m / s, as the grid and station positions
+            are in metres)
 
         vs : float
-            S-wave velocity (units: km / s)
+            S-wave velocity (units: m / s)
+
+        n_cores : int, optional
+            Number of processes over which to distribute the stations
+            (default: 1)
 
         """
 
         rloc = self.station_xyz()
         nstn = rloc.shape[0]
-        gx, gy, gz = self.grid_xyz
         ncell = self.cell_count
         p_map = np.zeros(np.r_[ncell, nstn])
         s_map = np.zeros(np.r_[ncell, nstn])
-        for stn in range(nstn):
-            dx = gx - float(rloc[stn, 0])
-            dy = gy - float(rloc[stn, 1])
-            dz = gz - float(rloc[stn, 2])
-            dist = np.sqrt(dx**2 + dy**2 + dz**2)
-            p_map[..., stn] = (dist / vp)
-            s_map[..., stn] = (dist / vs)
+
+        state = {"grid_xyz": self.grid_xyz, "vp": vp, "vs": vs}
+        for stn, (p, s) in enumerate(_station_maps(_homogeneous_station,
+                                                   list(rloc), state,
+                                                   n_cores)):
+            p_map[..., stn] = p
+            s_map[..., stn] = s
         self.maps = {"TIME_P": p_map,
                      "TIME_S": s_map}
 
     def compute_1d_vmodel(self, p0, p1, gridspec, vmod_file, 
                           delimiter=",", nlloc_dx=0.1, nlloc_path="",
-                          block_model=False):
+                          block_model=False, n_cores=1):
         """
         Calculate 3D travel time lookup-tables from a 1D velocity model.
 
         NonLinLoc Grid2Time is used to generate a 2D lookup-table which is then
         swept across a 3D distance from station grid to populate a 3D travel
-        time grid. The location of the stations should already have been added
+        time grid. One 2D lookup-table is generated for each distinct station
+        elevation. The location of the stations should already have been added
         to the LUT using the function set_station().
 
         Parameters
@@ -1262,9 +1953,12 @@ class LUT(Grid3D, NonLinLoc):
         block_model : bool
             Interpret velocity model with constant velocity blocks
 
-        """
+        n_cores : int, optional
+            Number of processes over which to distribute the 2D
+            lookup-tables, each running NonLinLoc in its own scratch directory
+            (default: 1)
 
-        from subprocess import call, check_output, STDOUT
+        """
 
         vmodel = pd.read_csv(vmod_file, delimiter=",")
         self.velocity_model = vmodel
@@ -1301,83 +1995,54 @@ class LUT(Grid3D, NonLinLoc):
 
         X, Y, Z = np.meshgrid(xvec, yvec, zvec, indexing="ij")
 
-        # make a folder structure to run nonlinloc in
-        os.makedirs("time", exist_ok=True)
-        os.makedirs("model", exist_ok=True)
-
         nstation = len(self.station_data["Name"])
 
-        p_travel_times = np.empty((nx, ny, nz, nstation))
-        s_travel_times = np.empty_like(p_travel_times)
-        i = 0
-        while i < nstation:
+        names, st_locs = [], []
+        for i in range(nstation):
             p0_st_y = self.station_data["Latitude"][i]
             p0_st_x = self.station_data["Longitude"][i]
             p0_st_z = -self.station_data["Elevation"][i]
-            name = self.station_data["Name"][i]
-
-            print("Calculating travel-times for station", name)
+            names.append(self.station_data["Name"][i])
+
+            st_locs.append(_coord_transform_np(p0, p1,
+                                               np.asarray([p0_st_x,
+                                                           p0_st_y,
+                                                           p0_st_z])))
+
+        # The 2-D NonLinLoc tables depend only on the elevation of the
+        # station, so one is computed for each distinct elevation, out to the
+        # largest distance (in km) from any of its stations to the grid
+        max_dists = {}
+        for st_x, st_y, st_z in st_locs:
+            max_dist = np.sqrt(np.square(xvec[[0, -1], None] - st_x) +
+                               np.square(yvec[None, [0, -1]] - st_y)).max()
+            max_dists[st_z] = max(max_dists.get(st_z, 0.), max_dist / 1000.)
+        tasks = []
+        for st_z, max_dist in max_dists.items():
+            i = [loc[2] for loc in st_locs].index(st_z)
+            tasks.append((names[i], st_locs[i], max_dist))
+
+        state = {"depth_limits": (p1_z0, p1_z1),
+                 "vmodel": self.velocity_model, "nlloc_dx": nlloc_dx,
+                 "nlloc_path": nlloc_path, "block_model": block_model}
+        tables = dict(zip(max_dists.keys(),
+                          _station_maps(_nlloc_2d_table, tasks, state,
+                                        n_cores, scratch=True)))
 
-            # get the maximum distance from station to corner of grid
-            p1_st_loc = _coord_transform_np(p0, p1,
-                                            np.asarray([p0_st_x,
-                                                        p0_st_y,
-                                                        p0_st_z]))
-            p1_st_x, p1_st_y, p1_st_z = p1_st_loc
+        p_travel_times = np.empty((nx, ny, nz, nstation))
+        s_travel_times = np.empty_like(p_travel_times)
+        depth = Z.flatten() / 1000.
+        for i, (st_x, st_y, st_z) in enumerate(st_locs):
+            print("Calculating travel-times for station", names[i])
 
             # for nonlinloc the distances must be in km
-            distance_grid = np.sqrt(np.square(X - p1_st_x) +
-                                    np.square(Y - p1_st_y))
-            distance_grid /= 1000.
-            max_dist = np.max(distance_grid)
-
-            # NLLOC needs the station to lie within the 2D section,
-            # therefore we pick the depth extent of the 2D grid from
-            # the maximum possible extent of the station and the grid
-            min_z = np.min([p1_z0, p1_st_z])
-            max_z = np.max([p1_z1, p1_st_z])
-            depth_extent = np.asarray([min_z, max_z])
-
-            for phase in ["P", "S"]:
-                # Allow 2 nodes on depth extent as a computational buffer
-                write_control_file(p1_st_x / 1000., p1_st_y / 1000.,
-                                   p1_st_z / 1000., name,
-                                   max_dist, self.velocity_model,
-                                   depth_extent / 1000.,
-                                   phase=phase, dx=nlloc_dx,
-                                   block_model=block_model)
-
-                print("\tRunning NonLinLoc phase =", phase)
-                out = check_output([os.path.join(nlloc_path, "Vel2Grid"),
-                                   "control.in"], stderr=STDOUT)
-                if b"ERROR" in out:
-                    raise Exception("Vel2Grid Error", out)
-
-                out = check_output([os.path.join(nlloc_path, "Grid2Time"),
-                                    "control.in"], stderr=STDOUT)
-                if b"ERROR" in out:
-                    raise Exception("Grid2Time Error", out)
-
-                to_read = "./time/layer.{}.{}.time".format(phase, name)
-                data, _, _, nll_gridspec = read_2d_nlloc(to_read)
-
-                distance = distance_grid.flatten()
-                depth = Z.flatten() / 1000.
-                travel_time = bilinear_interp(np.vstack((distance, depth)).T,
-                                              [nll_gridspec[0][1:],
-                                               nll_gridspec[1][1:],
-                                               nll_gridspec[2][1:]],
-                                              data[0, :, :])
-
-                travel_time = np.reshape(travel_time, (nx, ny, nz))
-                if phase == "P":
-                    p_travel_times[..., i] = travel_time
-                elif phase == "S":
-                    s_travel_times[..., i] = travel_time
-                else:
-                    raise Exception("HELP")
-
-            i += 1
+            distance = np.sqrt(np.square(X - st_x) + np.square(Y - st_y))
+            distance = distance.flatten() / 1000.
+            for travel_times, (data, nll_gridspec) in \
+                    zip([p_travel_times, s_travel_times], tables[st_z]):
+                travel_time = bilinear_interp(np.c_[distance, depth],
+                                              nll_gridspec, data)
+                travel_times[..., i] = np.reshape(travel_time, (nx, ny, nz))
 
         # Define rest of the LUT parameters
         x = p1_x0 + dx * ((nx - 1) / 2.)
@@ -1397,9 +2062,8 @@ class LUT(Grid3D, NonLinLoc):
 
         self.maps = {"TIME_P": p_travel_times, "TIME_S": s_travel_times}
 
-        call(["rm", "-rf", "control.in", "time", "model"])
-
-    def compute_1d_vmodel_skfmm(self, vmod_file, header=False, delimiter=","):
+    def compute_1d_vmodel_skfmm(self, vmod_file, header=False, delimiter=",",
+                                n_cores=1):
         """
         Calculate the travel-time tables for each station in a velocity model
         that varies with depth
@@ -1417,13 +2081,13 @@ class LUT(Grid3D, NonLinLoc):
             Does the vmod_file supplied have a header line? If so set header
             to True. Default: False
 
+        n_cores : int, optional
+            Number of processes over which to distribute the stations
+            (default: 1)
+
         """
 
-        if header:
-            vmod = pd.read_csv(vmod_file, delimiter=delimiter).values
-        else:
-            vmod = pd.read_csv(vmod_file, header=None, delimiter=delimiter).values
-        z, vp, vs = vmod[:, 0], vmod[:, 1] * 1000, vmod[:, 2] * 1000
+        fvp, fvs = _read_1d_vmodel(vmod_file, header, delimiter)
 
         rloc = self.station_xyz()
         nstn = rloc.shape[0]
@@ -1431,30 +2095,86 @@ class LUT(Grid3D, NonLinLoc):
         p_map = np.zeros(ix.shape + (rloc.shape[0],))
         s_map = np.zeros(ix.shape + (rloc.shape[0],))
 
-        z = np.insert(np.append(z, np.finfo(float).min), 0, np.finfo(float).max)
-        vp = np.insert(np.append(vp, vp[-1]), 0, vp[0])
-        vs = np.insert(np.append(vs, vs[-1]), 0, vs[0])
-
-        f = interp1d(z, vp)
-        gvp = f(iz)
-        f = interp1d(z, vs)
-        gvs = f(iz)
+        gvp = fvp(iz)
+        gvs = fvs(iz)
 
-        for stn in range(nstn):
-            msg = "Generating 1D Travel-Time Table - {} of {}"
+        state = {"grid_xyz": (ix, iy, iz), "cell_size": self.cell_size,
+                 "vp": gvp, "vs": gvs}
+        for stn, (p, s) in enumerate(_station_maps(_eikonal_station,
+                                                   list(rloc), state,
+                                                   n_cores)):
+            msg = "Generated 1D Travel-Time Table - {} of {}"
             msg = msg.format(stn + 1, nstn)
             print(msg)
 
-            p_map[..., stn] = eikonal(ix, iy, iz,
-                                      self.cell_size[0],
-                                      self.cell_size[1],
-                                      self.cell_size[2],
-                                      gvp, rloc[stn][np.newaxis, :])
-            s_map[..., stn] = eikonal(ix, iy, iz,
-                                      self.cell_size[0],
-                                      self.cell_size[1],
-                                      self.cell_size[2],
-                                      gvs, rloc[stn][np.newaxis, :])
+            p_map[..., stn] = p
+            s_map[..., stn] = s
+
+        self.maps = {"TIME_P": p_map,
+                     "TIME_S": s_map}
+
+    def compute_1d_vmodel_radial(self, vmod_file, header=False,
+                                 delimiter=",", dr=None):
+        """
+        Calculate the travel-time tables for each station in a velocity model
+        that varies with depth, from 2-D (distance, elevation) tables.
+
+        In a 1-D velocity model the travel time from a station depends only
+        on the horizontal distance from, and the elevation of, each grid cell.
+        One 2-D table is computed (see radial_eikonal) for each distinct
+        station elevation and phase, and swept around each station with
+        bilinear interpolation - much faster than compute_1d_vmodel_skfmm,
+        which solves in 3-D for each station.
+
+        Parameters
+        ----------
+        vmod_file : str
+            File containing the velocity model, as for
+            compute_1d_vmodel_skfmm
+
+        header : bool, optional
+            Does the vmod_file supplied have a header line? If so set header
+            to True. Default: False
+
+        delimiter : char, optional
+            Delimiter for vmod_file: default = ","
+
+        dr : float, optional
+            Distance spacing of the 2-D tables (units: m). Default: the
+            smaller horizontal cell size.
+
+        """
+
+        fvp, fvs = _read_1d_vmodel(vmod_file, header, delimiter)
+
+        rloc = self.station_xyz()
+        nstn = rloc.shape[0]
+        gx, gy, gz = self.grid_xyz
+        dz = self.cell_size[2]
+        if dr is None:
+            dr = min(self.cell_size[0], self.cell_size[1])
+        zlim = (gz.min(), gz.max())
+
+        # Largest horizontal distance from each station elevation to the
+        # grid, found at its corners
+        corners = np.ix_([0, -1], [0, -1], [0, -1])
+        rmax = {}
+        for sx, sy, sz in rloc:
+            r = np.sqrt((gx[corners] - sx)**2 + (gy[corners] - sy)**2).max()
+            rmax[sz] = max(rmax.get(sz, 0.), r)
+
+        tables = {}
+        for sz, r in rmax.items():
+            tables[sz] = [radial_eikonal(f, sz, r, zlim, dr, dz)
+                          for f in [fvp, fvs]]
+
+        p_map = np.zeros(gx.shape + (nstn,))
+        s_map = np.zeros(gx.shape + (nstn,))
+        for stn, (sx, sy, sz) in enumerate(rloc):
+            pos = np.stack([np.sqrt((gx - sx)**2 + (gy - sy)**2), gz], -1)
+            (p_tt, p_spec), (s_tt, s_spec) = tables[sz]
+            p_map[..., stn] = bilinear_interp(pos, p_spec, p_tt)
+            s_map[..., stn] = bilinear_interp(pos, s_spec, s_tt)
 
         self.maps = {"TIME_P": p_map,
                      "TIME_S": s_map}
@@ -1465,7 +2185,8 @@ class LUT(Grid3D, NonLinLoc):
         """
         raise NotImplementedError
 
-    def read_3d_nlloc_lut(self, path, regrid=True, decimate=[1, 1, 1]):
+    def read_3d_nlloc_lut(self, path, regrid=True, decimate=[1, 1, 1],
+                          n_cores=1, dtype=np.float32):
         """
         Calculate the travel-time tables for each station in a velocity model
         that varies over all dimensions.
@@ -1481,6 +2202,15 @@ class LUT(Grid3D, NonLinLoc):
             Currently this has to be set to True for this function to work.
             *** TO BE FIXED ***
 
+        n_cores : int, optional
+            Number of threads over which to distribute the stations, each
+            reading its grids straight into the travel-time tables
+            (default: 1)
+
+        dtype : data-type, optional
+            Data type of the travel-time tables. NonLinLoc grids are stored
+            as float32, so the default loses no precision.
+
         Raises
         ------
         MemoryError
@@ -1488,71 +2218,182 @@ class LUT(Grid3D, NonLinLoc):
 
         """
 
-        nstn = len(self.station_data["Name"])
-        for st in range(nstn):
-            name = self.station_data["Name"][st]
-            msg = "Loading P- and S- traveltime maps for {}"
-            msg = msg.format(name)
-            print(msg)
+        names = list(self.station_data["Name"])
+        nstn = len(names)
 
-            # Reading in P-wave
-            self.nlloc_load_file("{}.P.{}.time".format(path, name))
-            if not regrid:
-                self.nlloc_project_grid()
-            else:
-                self.nlloc_regrid(decimate)
-
-            if ("p_map" not in locals()) and ("s_map" not in locals()):
-                ncell = self.NLLoc_data.shape
-                try:
-                    p_map = np.zeros(np.r_[ncell, nstn])
-                    s_map = np.zeros(np.r_[ncell, nstn])
-                except MemoryError:
-                    msg = "P- and S-traveltime maps exceed available memory."
-                    raise MemoryError(msg)
-
-            p_map[..., st] = self.NLLoc_data
-
-            self.nlloc_load_file("{}.S.{}.time".format(path, name))
-            if not regrid:
-                self.nlloc_project_grid()
-            else:
-                self.nlloc_regrid(decimate)
+        # Read the first station here: this sets the grid of the LUT from
+        # that of the NonLinLoc files (if regrid), and the size of the maps
+        state = {"lut": self, "path": path, "regrid": regrid,
+                 "decimate": decimate, "dtype": dtype}
+        for p, s in _station_maps(_nlloc_3d_station, [(0, names[0])], state):
+            msg = "Loaded P- and S- traveltime maps for {}"
+            msg = msg.format(names[0])
+            print(msg)
 
-            s_map[..., st] = self.NLLoc_data
+            ncell = p.shape
+            try:
+                p_map = np.empty(np.r_[ncell, nstn], dtype=dtype)
+                s_map = np.empty(np.r_[ncell, nstn], dtype=dtype)
+            except MemoryError:
+                msg = "P- and S-traveltime maps exceed available memory."
+                raise MemoryError(msg)
+            p_map[..., 0] = p
+            s_map[..., 0] = s
+
+        # The tables are allocated once; each task fills the slices of its
+        # station in place
+        state["maps"] = {"TIME_P": p_map, "TIME_S": s_map}
+        tasks = list(enumerate(names))[1:]
+        for st, _ in zip(range(1, nstn),
+                         _station_maps(_nlloc_3d_station, tasks, state,
+                                       n_cores, threads=True)):
+            msg = "Loaded P- and S- traveltime maps for {}"
+            msg = msg.format(names[st])
+            print(msg)
 
         self.maps = {"TIME_P": p_map,
                      "TIME_S": s_map}
 
-    def save(self, filename):
+    def save(self, filename, fmt="pickle"):
         """
-        Create a pickle file containing the look-up table
+        Save the look-up table to file
 
         Parameters
         ----------
         filename : str
-            Path to location to save pickle file
+            Path to location to save file
+
+        fmt : str, optional
+            "pickle" (default) to pickle the look-up table, or "native" to
+            write the travel-time maps as raw arrays that load() memory-maps,
+            so that a look-up table loads near-instantly, the maps are only
+            read from disk as they are used (per station / decimated cell),
+            and several processes can share them in the page cache
+
+        Raises
+        ------
+        ValueError
+            If fmt is not a supported format
+
+        """
+
+        # The index tables and interpolators are cached in memory (see
+        # fetch_ps_index and interpolator) but are not part of the look-up
+        # table itself
+        lut_dict = {k: v for k, v in self.__dict__.items()
+                    if k not in ("_index_cache", "_interp_cache",
+                                 "_filename", "_file_maps")}
+        lut_dict["_lut_class"] = type(self).__name__
+
+        if fmt == "pickle":
+            lut_dict["_maps"] = {k: np.asarray(v)
+                                 for k, v in self._maps.items()}
+            lut_dict["_pyramid"] = {ds: {k: np.asarray(v)
+                                         for k, v in maps.items()}
+                                    for ds, maps in self._pyramid.items()}
+            with open(filename, "wb") as f:
+                pickle.dump(lut_dict, f, 2)
+        elif fmt == "native":
+            del lut_dict["_maps"], lut_dict["_pyramid"]
+            self._save_native(filename, lut_dict)
+        else:
+            msg = "Unsupported LUT file format {} - must be pickle or native"
+            raise ValueError(msg.format(fmt))
+
+    def _save_native(self, filename, lut_dict):
+        """
+        Write the look-up table in the native format (see LUT_MAGIC).
 
         """
 
+        # Each map is stored stations first, i.e. as (nstation, nx, ny, nz),
+        # so that the table of a single station is contiguous on disk
+        arrays = [(None, id_, map_) for id_, map_ in self._maps.items()]
+        for ds, maps in self._pyramid.items():
+            arrays += [(ds, id_, map_) for id_, map_ in maps.items()]
+
+        table, pyramid, stats, offset = {}, {}, {}, 0
+        for ds, id_, map_ in arrays:
+            dtype = map_.dtype.newbyteorder("<")
+            shape = (map_.shape[-1],) + map_.shape[:-1]
+            entry = (offset, dtype.str, shape)
+            if ds is None:
+                table[id_] = entry
+                stats[id_] = {"max": float(np.max(map_)),
+                              "min": float(np.min(map_)),
+                              "md5": _map_digest(map_, dtype)}
+            else:
+                pyramid.setdefault(ds, {})[id_] = entry
+            offset += -(-map_.nbytes // LUT_ALIGN) * LUT_ALIGN
+
+        header = pickle.dumps({"attributes": lut_dict, "maps": table,
+                               "pyramid": pyramid, "stats": stats}, 2)
+        start = -(-(16 + len(header)) // LUT_ALIGN) * LUT_ALIGN
+
         with open(filename, "wb") as f:
-            pickle.dump(self.__dict__, f, 2)
+            f.write(LUT_MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for ds, id_, map_ in arrays:
+                entry = table[id_] if ds is None else pyramid[ds][id_]
+                f.seek(start + entry[0])
+                dtype = np.dtype(entry[1])
+                for st in range(map_.shape[-1]):
+                    f.write(np.ascontiguousarray(map_[..., st],
+                                                 dtype=dtype).tobytes())
+            f.truncate(start + offset)
 
     def load(self, filename):
         """
-        Read the contents of a pickle file to __dict__
+        Read a look-up table file (of either format, see save). Travel-time
+        maps in native format files are memory-mapped (read-only). The object
+        takes the class of the saved look-up table (e.g. AnalyticLUT).
 
         Parameters
         ----------
         filename : str
-            Path to pickle file to load
+            Path to look-up table file to load
 
         """
 
         with open(filename, "rb") as f:
-            tmp_dict = pickle.load(f)
+            magic = f.read(len(LUT_MAGIC))
+            if magic == LUT_MAGIC:
+                size, = struct.unpack("<Q", f.read(8))
+                header = pickle.loads(f.read(size))
+            else:
+                f.seek(0)
+                header = None
+                tmp_dict = pickle.load(f)
 
-        self.__dict__.update(tmp_dict)
+        if header is None:
+            attributes = tmp_dict
+        else:
+            attributes = header["attributes"]
+        lut_class = attributes.pop("_lut_class", "LUT")
+        if lut_class != type(self).__name__:
+            self.__class__ = globals()[lut_class]
+        self.__dict__.update(attributes)
+
+        if header is not None:
+            start = -(-(16 + size) // LUT_ALIGN) * LUT_ALIGN
+
+            def _memmap(offset, dtype, shape):
+                map_ = np.memmap(filename, dtype=dtype, mode="r",
+                                 offset=start + offset, shape=shape)
+                return np.moveaxis(map_, 0, -1)
+
+            self._maps = {id_: _memmap(*entry)
+                          for id_, entry in header["maps"].items()}
+            self._pyramid = {ds: {id_: _memmap(*entry)
+                                  for id_, entry in table.items()}
+                             for ds, table in header["pyramid"].items()}
+            self._stats = header["stats"]
+
+        self._index_cache = {}
+        self._interp_cache = {}
+        self._filename = os.path.abspath(filename)
+        self._file_maps = True
 
     def plot_3d(self, map_, station, output_file=None):
         """
@@ -1569,3 +2410,489 @@ class LUT(Grid3D, NonLinLoc):
             Location to save file to
         """
         raise NotImplementedError
+
+
+class _DerivedMaps(Mapping):
+    """
+    Read-only mapping of the travel-time tables of a LUT whose S-wave table
+    is derived from its P-wave table (see LUT.set_vpvs).
+
+    """
+
+    def __init__(self, lut):
+        self._lut = lut
+
+    def __getitem__(self, map_):
+        if map_ not in self._lut._maps and map_ != "TIME_S":
+            raise KeyError(map_)
+        return self._lut.fetch_map(map_)
+
+    def __iter__(self):
+        yield from self._lut._maps
+        if "TIME_S" not in self._lut._maps:
+            yield "TIME_S"
+
+    def __len__(self):
+        return len(self._lut._maps) + ("TIME_S" not in self._lut._maps)
+
+
+class CompactIndex(object):
+    """
+    Compact travel-time index table: one int32 base offset per grid cell plus
+    a uint8 or uint16 offset per station (and phase), in place of the full
+    int32 table returned by LUT.fetch_index(). Negative travel-time indices
+    are clamped to 0, as the C-compiled kernels do, so migrating with either
+    table gives identical results.
+
+    Attributes
+    ----------
+    base : array-like, int32
+        Smallest travel-time index in each cell, shape (ncell,)
+
+    delta : array-like, uint8 or uint16
+        Travel-time index of each station in each cell relative to base,
+        shape (ncell, nstation)
+
+    shape : tuple
+        Shape of the full index table, e.g. (nx, ny, nz, nstation)
+
+    Methods
+    -------
+    expand()
+        Return the full int32 index table
+
+    take(cells)
+        Return the compact index table for a subset of (flattened) cells
+
+    """
+
+    def __init__(self, index):
+        """
+        Class initialisation method.
+
+        Parameters
+        ----------
+        index : array-like, int
+            Travel-time index table, e.g. np.c_[P, S] from LUT.fetch_index(),
+            with stations on the last axis
+
+        Raises
+        ------
+        ValueError
+            If the travel-time indices within a cell span more than 65535
+            samples
+
+        """
+
+        index = np.asarray(index)
+        self.shape = index.shape
+        nstation = index.shape[-1]
+
+        index = np.maximum(index.reshape(-1, nstation), 0)
+        base = index.min(axis=1) if index.size else np.zeros(0, np.int32)
+        delta = index - base[:, None]
+        span = delta.max(initial=0)
+
+        if span > np.iinfo(np.uint16).max:
+            msg = "Travel-time indices within a cell span {} samples - too "
+            msg += "many for a compact index table."
+            raise ValueError(msg.format(span))
+        dtype = np.uint8 if span <= np.iinfo(np.uint8).max else np.uint16
+
+        self.base = np.ascontiguousarray(base, dtype=np.int32)
+        self.delta = np.ascontiguousarray(delta, dtype=dtype)
+
+    @property
+    def ndim(self):
+        """Number of dimensions of the full index table"""
+
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        """Memory footprint of the compact index table"""
+
+        return self.base.nbytes + self.delta.nbytes
+
+    def expand(self):
+        """
+        Return the full (clamped) int32 index table.
+
+        """
+
+        index = self.base[:, None] + self.delta.astype(np.int32)
+        return index.reshape(self.shape)
+
+    def take(self, cells):
+        """
+        Return the compact index table for a subset of cells.
+
+        Parameters
+        ----------
+        cells : array-like, int
+            Flattened indices of the cells to keep
+
+        Returns
+        -------
+        index : CompactIndex object
+            Compact index table with shape (len(cells), nstation)
+
+        """
+
+        index = copy(self)
+        index.base = np.ascontiguousarray(self.base[cells])
+        index.delta = np.ascontiguousarray(self.delta[cells])
+        index.shape = (len(index.base), self.shape[-1])
+
+        return index
+
+
+class AnalyticIndex(object):
+    """
+    Travel-time index table for a homogeneous velocity model (see
+    AnalyticLUT), computed on the fly from the position of each cell and
+    station rather than stored: its memory footprint is O(nstation). The
+    C-compiled kernels compute the index of each cell as they migrate it;
+    the other backends use expand().
+
+    Attributes
+    ----------
+    geometry : array-like, float64
+        Position of cell (0, 0, 0), followed by the steps in position along
+        the x, y and z cell axes, shape (12,)
+
+    stations : array-like, float64
+        Position of the station of each column of the table, shape
+        (nstation, 3)
+
+    velocity : array-like, float64
+        Velocity (units: m / s) for each column of the table, shape
+        (nstation,)
+
+    sampling_rate : float
+        Sampling rate of the onset functions (units: Hz)
+
+    shape : tuple
+        Shape of the full index table, e.g. (nx, ny, nz, nstation)
+
+    Methods
+    -------
+    expand()
+        Return the full int32 index table
+
+    take(cells)
+        Return the full int32 index table for a subset of (flattened) cells
+
+    """
+
+    def __init__(self, geometry, stations, velocity, sampling_rate,
+                 cell_count):
+        """
+        Class initialisation method.
+
+        Parameters
+        ----------
+        geometry : array-like
+            Position of cell (0, 0, 0) and the steps in position along the
+            cell axes, shape (4, 3)
+
+        stations : array-like
+            Position of the station of each column, shape (nstation, 3)
+
+        velocity : array-like
+            Velocity for each column, shape (nstation,)
+
+        sampling_rate : float
+            Sampling rate of the onset functions (units: Hz)
+
+        cell_count : array-like
+            Number of cells in each dimension of the grid
+
+        """
+
+        self.geometry = np.ascontiguousarray(geometry, np.float64).ravel()
+        self.stations = np.ascontiguousarray(stations, np.float64)
+        self.velocity = np.ascontiguousarray(velocity, np.float64)
+        self.sampling_rate = float(sampling_rate)
+        self.shape = tuple(int(n) for n in cell_count) + (len(velocity),)
+
+    @property
+    def ndim(self):
+        """Number of dimensions of the full index table"""
+
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        """Memory footprint of the index table"""
+
+        return self.geometry.nbytes + self.stations.nbytes \
+            + self.velocity.nbytes
+
+    def expand(self):
+        """
+        Return the full int32 index table.
+
+        """
+
+        return self.take(np.arange(np.prod(self.shape[:-1]))).reshape(
+            self.shape)
+
+    def take(self, cells):
+        """
+        Return the index table for a subset of cells, computed as the
+        C-compiled kernels do.
+
+        Parameters
+        ----------
+        cells : array-like, int
+            Flattened indices of the cells to keep
+
+        Returns
+        -------
+        index : array-like, int32
+            Index table with shape (len(cells), nstation)
+
+        """
+
+        ijk = np.unravel_index(np.asarray(cells, dtype=np.int64),
+                               self.shape[:-1])
+        g = self.geometry
+
+        dist = 0.
+        for ax in range(3):
+            pos = g[ax] + ijk[0] * g[3 + ax] + ijk[1] * g[6 + ax] \
+                + ijk[2] * g[9 + ax]
+            d = pos[:, None] - self.stations[:, ax]
+            dist = dist + d * d
+
+        index = np.rint(self.sampling_rate * (np.sqrt(dist) / self.velocity))
+        return np.ascontiguousarray(np.maximum(index, 0), dtype=np.int32)
+
+
+class AnalyticLUT(LUT):
+    """
+    Look-up table for a homogeneous velocity model, whose travel times are
+    computed from the positions of the cells and stations when they are
+    needed, rather than stored. The migration kernels are passed an
+    AnalyticIndex in place of the travel-time index table, so a scan needs
+    O(nstation) memory for travel times, whatever the size of the grid.
+
+    Set the velocities with compute_homogeneous_vmodel(). maps and
+    fetch_map() compute the full travel-time tables on demand; interpolate()
+    (and so value_at() etc.) computes the travel times to any location.
+
+    Attributes
+    ----------
+    velocity : dict
+        Velocity for each travel-time table, {"TIME_P": vp, "TIME_S": vs}
+        (units: m / s)
+
+    """
+
+    # Cell geometry of a decimated grid (see decimate) - a class attribute,
+    # as LUT.load() does not call __init__
+    _geometry = None
+
+    def __init__(self, stations=None, cell_count=[51, 51, 31],
+                 cell_size=[30.0, 30.0, 30.0], azimuth=0.0, dip=0.0):
+        """
+        Class initialisation method - see LUT.
+
+        """
+
+        LUT.__init__(self, stations, cell_count, cell_size, azimuth, dip)
+        self.velocity = {}
+
+    @property
+    def maps(self):
+        """Travel-time tables, computed on demand (read-only)"""
+        return _AnalyticMaps(self)
+
+    @maps.setter
+    def maps(self, value):
+        msg = "The travel-time tables of an AnalyticLUT are computed from "
+        msg += "its velocities - see compute_homogeneous_vmodel()"
+        raise AttributeError(msg)
+
+    def compute_homogeneous_vmodel(self, vp, vs, n_cores=1):
+        """
+        Set the velocities of the uniform velocity model.
+
+        Parameters
+        ----------
+        vp : float
+            P-wave velocity (units: m / s, as LUT.compute_homogeneous_vmodel)
+
+        vs : float
+            S-wave velocity (units: m / s)
+
+        n_cores : int, optional
+            Unused - included for compatibility with LUT
+
+        """
+
+        self.velocity = {"TIME_P": vp, "TIME_S": vs}
+        self._index_cache = {}
+        self._interp_cache = {}
+        self._stats = {}
+        self._pyramid = {}
+
+    def decimate(self, ds, inplace=False):
+        """
+        Decimate the grid by some factor (see LUT.decimate). As for the
+        stored tables of a LUT, each cell of the decimated grid is a cell of
+        this grid.
+
+        """
+
+        geometry = self._grid_geometry()
+        ds = np.broadcast_to(np.array(ds, dtype=int), 3)
+        cell_count = 1 + (self.cell_count - 1) // ds
+        c1 = (self.cell_count - ds * (cell_count - 1) - 1) // 2
+
+        lut = LUT.decimate(self, ds, inplace)
+        if inplace:
+            lut = self
+        lut._geometry = np.vstack([geometry[0] + c1 @ geometry[1:],
+                                   geometry[1:] * ds[:, None]])
+        if not inplace:
+            return lut
+
+    def _grid_geometry(self):
+        """
+        Position of cell (0, 0, 0) and the steps in position along the cell
+        axes, shape (4, 3).
+
+        Raises
+        ------
+        NotImplementedError
+            If the grid is dipping
+
+        """
+
+        if self._geometry is not None:
+            return self._geometry
+
+        if self.dip != 0:
+            msg = "Analytic travel times are not implemented for a dipping "
+            msg += "grid."
+            raise NotImplementedError(msg)
+
+        origin = self.xyz2loc(np.zeros(3), inverse=True)
+        steps = [self.xyz2loc(e, inverse=True) - origin for e in np.eye(3)]
+
+        return np.vstack([origin] + steps)
+
+    def _loc2xyz(self, loc):
+        """
+        Position of (fractional) cell locations loc, shape (..., 3).
+
+        """
+
+        geometry = self._grid_geometry()
+        return geometry[0] + np.asarray(loc, dtype=float) @ geometry[1:]
+
+    def _traveltime(self, map_, xyz, station=None):
+        """
+        Travel times from each station to positions xyz, shape
+        xyz.shape[:-1] + (nstation,).
+
+        """
+
+        rloc = self.station_xyz(station)
+        xyz = np.asarray(xyz, dtype=float)
+        dx = xyz[..., None, 0] - rloc[:, 0]
+        dy = xyz[..., None, 1] - rloc[:, 1]
+        dz = xyz[..., None, 2] - rloc[:, 2]
+        dist = np.sqrt(dx**2 + dy**2 + dz**2)
+
+        return dist / self.velocity[map_]
+
+    def fetch_map(self, map_, station=None):
+        if self._geometry is None:
+            xyz = np.stack(self.grid_xyz, -1)
+        else:
+            nc = self.cell_count
+            xyz = self._loc2xyz(np.stack(np.meshgrid(np.arange(nc[0]),
+                                                     np.arange(nc[1]),
+                                                     np.arange(nc[2]),
+                                                     indexing="ij"), -1))
+        return self._traveltime(map_, xyz, station)
+
+    def fetch_ps_index(self, sampling_rate, station=None, compact=False,
+                       persist=False):
+        """
+        Return the combined P and S travel-time index table as an
+        AnalyticIndex object (see LUT.fetch_ps_index).
+
+        Parameters
+        ----------
+        sampling_rate : float
+            Sampling rate of the onset functions (units: Hz)
+
+        station : array-like of str, optional
+            Names of the stations to include (default: all)
+
+        compact : bool, optional
+            Unused - the index table is not stored
+
+        persist : bool, optional
+            Unused - the index table is not stored
+
+        Returns
+        -------
+        ttime : AnalyticIndex object
+            Travel-time index table, shape (nx, ny, nz, 2 * nstation)
+
+        """
+
+        rloc = self.station_xyz(station)
+        nstn = len(rloc)
+        velocity = np.r_[np.full(nstn, float(self.velocity["TIME_P"])),
+                         np.full(nstn, float(self.velocity["TIME_S"]))]
+
+        return AnalyticIndex(self._grid_geometry(), np.r_[rloc, rloc],
+                             velocity, sampling_rate, self.cell_count)
+
+    def max_traveltime(self, map_="TIME_S"):
+        """
+        Return the maximum travel time in a travel-time table, found at a
+        corner of the grid.
+
+        """
+
+        lc = self.cell_count - 1
+        corners = np.stack(np.meshgrid([0, lc[0]], [0, lc[1]], [0, lc[2]],
+                                       indexing="ij"), -1).reshape(-1, 3)
+
+        return float(self._traveltime(map_, self._loc2xyz(corners)).max())
+
+    def interpolate(self, map_, loc, station=None):
+        if self._geometry is None:
+            xyz = self.xyz2loc(loc, inverse=True)
+        else:
+            xyz = self._loc2xyz(loc)
+        return self._traveltime(map_, xyz, station)
+
+
+class _AnalyticMaps(Mapping):
+    """
+    Read-only mapping of the travel-time tables of an AnalyticLUT, each
+    computed when it is accessed.
+
+    """
+
+    def __init__(self, lut):
+        self._lut = lut
+
+    def __getitem__(self, map_):
+        if map_ not in self._lut.velocity:
+            raise KeyError(map_)
+        return self._lut.fetch_map(map_)
+
+    def __iter__(self):
+        return iter(self._lut.velocity)
+
+    def __len__(self):
+        return len(self._lut.velocity)
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+Module providing numba-compiled implementations of the C-compiled functions
+that make up the core of the QuakeMigrate package. Requires numba; the
+functions have the same signatures as those in QMigrate.core.QMigratelib and
+give identical output (migrate_max_coa() matches the C-compiled kernel run on
+a single thread).
+
+"""
+
+import numba
+import numpy as np
+
+from QMigrate.core.numpylib import _check_dtype, _sample_index
+
+# Number of time samples reduced by each task in migrate_max_coa()
+TIME_BLOCK = 512
+
+# Number of grid cells whose sample offsets are computed at a time from a
+# CompactIndex or AnalyticIndex, so that the full index table is never built
+CELL_CHUNK = 4096
+
+# Block sizes for migrate_max_coa() with prune=True, as in the C-compiled
+# scan4d_detect_pruned: cubes of PRUNE_BLOCK^3 cells, each bounded and pruned
+# as a whole over a tile of PRUNE_TIME samples
+PRUNE_BLOCK = 4
+PRUNE_TIME = 64
+
+
+@numba.njit(parallel=True, cache=True)
+def _scan4d(sig, index, stk):
+    nsamp = stk.shape[1]
+    for cell in numba.prange(stk.shape[0]):
+        for st in range(index.shape[1]):
+            i0 = index[cell, st]
+            for tm in range(nsamp):
+                stk[cell, tm] += sig[i0 + tm]
+
+
+@numba.njit(parallel=True, cache=True)
+def _detect4d(coa, max_coa, grid_index, fsmp, lsmp):
+    for tm in numba.prange(fsmp, lsmp):
+        mv = coa.dtype.type(0)
+        ix = 0
+        for cell in range(coa.shape[0]):
+            if coa[cell, tm] > mv:
+                mv = coa[cell, tm]
+                ix = cell
+        max_coa[tm] = mv
+        grid_index[tm] = ix
+
+
+@numba.njit(parallel=True, cache=True)
+def _scan4d_detect(sig, index, cell0, nsamp, max_coa, grid_index, sum_coa):
+    # Each task owns a block of time samples and visits the cells in order,
+    # so the running max, argmax and sum are formed as on a single C thread.
+    # The reduction continues from the output arrays, for cells cell0 on
+    nblock = (nsamp + TIME_BLOCK - 1) // TIME_BLOCK
+    for b in numba.prange(nblock):
+        t0 = b * TIME_BLOCK
+        tn = min(t0 + TIME_BLOCK, nsamp)
+        stk = np.empty(tn - t0, dtype=max_coa.dtype)
+        for cell in range(index.shape[0]):
+            stk[:] = 0
+            for st in range(index.shape[1]):
+                i0 = index[cell, st]
+                for tm in range(t0, tn):
+                    stk[tm - t0] += sig[i0 + tm]
+            for tm in range(t0, tn):
+                cv = stk[tm - t0]
+                sum_coa[tm] += cv
+                if cv > max_coa[tm]:
+                    max_coa[tm] = cv
+                    grid_index[tm] = cell0 + cell
+
+
+@numba.njit(cache=True)
+def _block_ranges(index, order, start):
+    # Range of sample offsets read by the cells of each block from each
+    # station
+    nblock = start.shape[0] - 1
+    lo = np.empty((nblock, index.shape[1]), dtype=np.int64)
+    hi = np.empty((nblock, index.shape[1]), dtype=np.int64)
+    for b in range(nblock):
+        for st in range(index.shape[1]):
+            lo[b, st] = index[order[start[b]], st]
+            hi[b, st] = lo[b, st]
+        for c in range(start[b] + 1, start[b + 1]):
+            for st in range(index.shape[1]):
+                lo[b, st] = min(lo[b, st], index[order[c], st])
+                hi[b, st] = max(hi[b, st], index[order[c], st])
+    return lo, hi
+
+
+@numba.njit(parallel=True, cache=True)
+def _scan4d_detect_pruned(sig, index, nsamp, order, start, lo, hi, hist,
+                          hbase, thres, max_coa, grid_index, sum_coa):
+    # Each task owns a tile of PRUNE_TIME samples, and visits the blocks of
+    # cells best-bound-first as the C-compiled kernel does, so that the same
+    # blocks are skipped and the same max and argmax are found
+    nblock = start.shape[0] - 1
+    nstn = index.shape[1]
+    ntile = (nsamp + PRUNE_TIME - 1) // PRUNE_TIME
+    for tile in numba.prange(ntile):
+        t0 = tile * PRUNE_TIME
+        ntm = min(t0 + PRUNE_TIME, nsamp) - t0
+
+        # Bound the coalescence of each block over the tile
+        bound = np.zeros(nblock, dtype=max_coa.dtype)
+        for b in range(nblock):
+            for st in range(nstn):
+                mv = sig[lo[b, st] + t0]
+                for k in range(lo[b, st] + t0 + 1, hi[b, st] + t0 + ntm):
+                    mv = max(mv, sig[k])
+                bound[b] += mv
+        rank = np.argsort(-bound, kind="mergesort")
+
+        mx = np.zeros(ntm, dtype=max_coa.dtype)
+        ix = np.zeros(ntm, dtype=np.int64)
+        stk = np.empty(ntm, dtype=max_coa.dtype)
+        lim = max(thres, 0.0)
+        for r in range(nblock):
+            b = rank[r]
+            if bound[b] < lim:
+                break
+            for c in range(start[b], start[b + 1]):
+                cell = order[c]
+                stk[:] = 0
+                for st in range(nstn):
+                    i0 = index[cell, st] + t0
+                    for tm in range(ntm):
+                        stk[tm] += sig[i0 + tm]
+                for tm in range(ntm):
+                    if stk[tm] > mx[tm] or (stk[tm] == mx[tm] and
+                                            cell < ix[tm]):
+                        mx[tm] = stk[tm]
+                        ix[tm] = cell
+
+            # Lowest running max in the tile
+            lim = max(mx.min(), thres)
+
+        # Sum over all cells, from the histogram of the sample offsets
+        for tm in range(ntm):
+            sum_coa[t0 + tm] = 0.0
+        for st in range(nstn):
+            for k in range(hist.shape[1]):
+                if hist[st, k] == 0:
+                    continue
+                i0 = hbase[st] + k + t0
+                for tm in range(ntm):
+                    sum_coa[t0 + tm] += hist[st, k] * np.float64(sig[i0 + tm])
+
+        for tm in range(ntm):
+            max_coa[t0 + tm] = mx[tm]
+            grid_index[t0 + tm] = ix[tm]
+
+
+def _prune_blocks(shape):
+    """
+    Split a grid of cells into cubes of PRUNE_BLOCK^3 cells.
+
+    Returns
+    -------
+    order : array-like
+        Cell indices, grouped by block and in ascending order within a block
+
+    start : array-like
+        Position in order of the first cell of each block (plus the total)
+
+    """
+
+    nx, ny, nz = shape
+    nby = (ny + PRUNE_BLOCK - 1) // PRUNE_BLOCK
+    nbz = (nz + PRUNE_BLOCK - 1) // PRUNE_BLOCK
+    i, j, k = np.indices(shape).reshape(3, -1) // PRUNE_BLOCK
+    block = (i * nby + j) * nbz + k
+    order = np.argsort(block, kind="stable")
+    start = np.r_[0, np.cumsum(np.bincount(block))].astype(np.int64)
+
+    return order, start
+
+
+def _set_threads(threads):
+    numba.set_num_threads(max(1, min(int(threads),
+                                     numba.config.NUMBA_NUM_THREADS)))
+
+
+def migrate(sig, tt, fsmp, lsmp, nsamp, map4d, threads, tiled=False):
+    """
+    Computes 4-D coalescence map by back-migrating P and S onset functions.
+    numba equivalent of QMigratelib.migrate().
+
+    Returns output by populating map4d.
+
+    Parameters
+    ----------
+    sig : array-like, float64 or float32
+        P and S onset functions
+
+    tt : array-like, CompactIndex or AnalyticIndex object
+        P and S travel-time lookup-tables
+
+    fsmp : int
+        First sample in array to scan from
+
+    lsmp : int
+        Last sample in array to scan upto
+
+    nsamp : int
+        Number of samples in array to scan over
+
+    map4d : array-like, same dtype as sig
+        Empty array with shape of 4-D coalescence map that will be output
+
+    threads : int
+        Number of threads to perform the scan on
+
+    tiled : bool, optional
+        Unused - included for compatibility with QMigratelib.migrate()
+
+    Raises
+    ------
+    ValueError
+        If there is a mismatch between number of stations in sig and look-up
+        table
+
+    ValueError
+        If the 4-D array is too small
+
+    ValueError
+        If the sig array is smaller than map4d[0, 0, 0, :]
+
+    ValueError
+        If sig and map4d do not have the same floating point precision
+
+    """
+
+    nstn, ssmp = sig.shape
+
+    if not tt.shape[-1] == nstn:
+        msg = "Mismatch between number of stations for data and LUT, {} - {}"
+        msg = msg.format(nstn, tt.shape[-1])
+        raise ValueError(msg)
+
+    tcell = np.prod(tt.shape[:-1])
+
+    if map4d.size < nsamp*tcell:
+        msg = "4D-array is too small."
+        raise ValueError(msg)
+
+    if sig.size < nsamp + fsmp:
+        msg = "Data array smaller than coalescence array."
+        raise ValueError(msg)
+
+    _check_dtype(sig, map4d)
+    _set_threads(threads)
+
+    stk = map4d.reshape(-1)[:tcell*nsamp].reshape(tcell, nsamp)
+    chunk = tcell if isinstance(tt, np.ndarray) else CELL_CHUNK
+    for c0 in range(0, tcell, chunk):
+        c1 = min(c0 + chunk, tcell)
+        _scan4d(sig.ravel(), _sample_index(tt, fsmp, lsmp, nsamp, c0, c1),
+                stk[c0:c1])
+
+
+def find_max_coa(map4d, max_coa, grid_index, fsmp, lsmp, threads,
+                 cell_major=True):
+    """
+    Finds the maximum coalescence value in the 4-D coalesence grid at each
+    time-step. numba equivalent of QMigratelib.find_max_coa().
+
+    Returns output by populating max_coa and grid_index.
+
+    Parameters
+    ----------
+    map4d : array-like, float64 or float32
+        4-D coalescence map
+
+    max_coa : array-like, same dtype as map4d
+        empty array with shape of max coa values that will be output
+
+    grid_index : array-like, int64
+        empty array with shape of grid index of max coa values that will be
+        output
+
+    fsmp : int
+        First sample in array to scan from
+
+    lsmp : int
+        Last sample in array to scan upto
+
+    threads : int
+        Number of threads to perform the scan on
+
+    cell_major : bool, optional
+        Unused - included for compatibility with QMigratelib.find_max_coa()
+
+    Raises
+    ------
+    ValueError
+        If the output array size is too small
+
+    ValueError
+        If map4d and max_coa do not have the same floating point precision
+
+    """
+
+    nsamp = map4d.shape[-1]
+
+    if max_coa.size < nsamp or grid_index.size < nsamp:
+        msg = "Output array size too small, sample count = {}."
+        msg = msg.format(nsamp)
+        raise ValueError(msg)
+
+    _check_dtype(map4d, max_coa)
+    _set_threads(threads)
+
+    _detect4d(map4d.reshape(-1, nsamp), max_coa, grid_index, fsmp, lsmp)
+
+
+def migrate_max_coa(sig, tt, fsmp, lsmp, nsamp, max_coa, grid_index, sum_coa,
+                    threads, prune=False, threshold=None):
+    """
+    Back-migrates P and S onset functions and reduces the coalescence over the
+    grid at each time-step, without storing the 4-D coalescence map. numba
+    equivalent of QMigratelib.migrate_max_coa().
+
+    Returns output by populating max_coa, grid_index and sum_coa.
+
+    Parameters
+    ----------
+    sig : array-like, float64 or float32
+        P and S onset functions
+
+    tt : array-like, CompactIndex or AnalyticIndex object
+        P and S travel-time lookup-tables
+
+    fsmp : int
+        First sample in array to scan from
+
+    lsmp : int
+        Last sample in array to scan upto
+
+    nsamp : int
+        Number of samples in array to scan over
+
+    max_coa : array-like, same dtype as sig
+        Empty array with shape (nsamp,) for the maximum coalescence value
+
+    grid_index : array-like, int64
+        Empty array with shape (nsamp,) for the grid index of the maximum
+        coalescence value
+
+    sum_coa : array-like, float64
+        Empty array with shape (nsamp,) for the sum of the coalescence over
+        all grid cells
+
+    threads : int
+        Number of threads to perform the scan on
+
+    prune : bool, optional
+        Skip blocks of cells that cannot contain the maximum coalescence, as
+        QMigratelib.migrate_max_coa() (not supported for an AnalyticIndex,
+        for which it is ignored)
+
+    threshold : float, optional
+        With prune=True, also skip blocks of cells that cannot reach this
+        (raw) coalescence value, as QMigratelib.migrate_max_coa()
+
+    Raises
+    ------
+    ValueError
+        If there is a mismatch between number of stations in sig and look-up
+        table
+
+    ValueError
+        If the output array size is too small
+
+    ValueError
+        If the sig array is smaller than the requested scan
+
+    ValueError
+        If sig and max_coa do not have the same floating point precision
+
+    """
+
+    nstn, ssmp = sig.shape
+
+    if not tt.shape[-1] == nstn:
+        msg = "Mismatch between number of stations for data and LUT, {} - {}"
+        msg = msg.format(nstn, tt.shape[-1])
+        raise ValueError(msg)
+
+    if max_coa.size < nsamp or grid_index.size < nsamp or \
+       sum_coa.size < nsamp:
+        msg = "Output array size too small, sample count = {}."
+        msg = msg.format(nsamp)
+        raise ValueError(msg)
+
+    if sig.size < nsamp + fsmp:
+        msg = "Data array smaller than coalescence array."
+        raise ValueError(msg)
+
+    _check_dtype(sig, max_coa)
+    _set_threads(threads)
+
+    if not prune or hasattr(tt, "velocity"):
+        max_coa[:nsamp] = 0
+        grid_index[:nsamp] = 0
+        sum_coa[:nsamp] = 0
+        tcell = int(np.prod(tt.shape[:-1]))
+        chunk = tcell if isinstance(tt, np.ndarray) else CELL_CHUNK
+        for c0 in range(0, tcell, chunk):
+            c1 = min(c0 + chunk, tcell)
+            _scan4d_detect(sig.ravel(),
+                           _sample_index(tt, fsmp, lsmp, nsamp, c0, c1), c0,
+                           nsamp, max_coa, grid_index, sum_coa)
+        return
+
+    index = _sample_index(tt, fsmp, lsmp, nsamp)
+
+    order, start = _prune_blocks(tt.shape[:-1] if tt.ndim == 4
+                                 else (len(index), 1, 1))
+    lo, hi = _block_ranges(index, order, start)
+
+    # Histogram of the sample offsets from each station, for the sum
+    hbase = index.min(axis=0)
+    hist = np.zeros((index.shape[1], (index.max(axis=0) - hbase).max() + 1),
+                    dtype=np.int64)
+    for st in range(index.shape[1]):
+        counts = np.bincount(index[:, st] - hbase[st])
+        hist[st, :len(counts)] = counts
+
+    # The threshold is compared in the precision of the coalescence, as in
+    # the C-compiled kernel
+    thres = float(max_coa.dtype.type(0. if threshold is None else threshold))
+    _scan4d_detect_pruned(sig.ravel(), index, nsamp, order, start, lo, hi,
+                          hist, hbase, thres, max_coa, grid_index, sum_coa)
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Module providing pure-numpy implementations of the C-compiled functions that
+make up the core of the QuakeMigrate package, for use where the C-library
+cannot be built or loaded. The functions have the same signatures as those in
+QMigrate.core.QMigratelib and populate their output arrays in the same way.
+
+migrate() and find_max_coa() give output identical to the C-compiled kernels;
+the sum_coa output of migrate_max_coa() agrees to rounding error.
+
+"""
+
+import numpy as np
+
+# Number of grid cells migrated at a time - bounds the size of the temporary
+# arrays to CELL_CHUNK x nsamp
+CELL_CHUNK = 256
+
+
+def _check_dtype(*arrays):
+    """
+    Check that the floating point arrays share a single supported dtype.
+
+    Raises
+    ------
+    ValueError
+        If the arrays do not share a single floating point dtype, or the dtype
+        is not float32 or float64
+
+    """
+
+    dtypes = set(np.dtype(a.dtype) for a in arrays)
+    if len(dtypes) != 1:
+        msg = "Mismatch between precision of input and output arrays, {}"
+        msg = msg.format(", ".join(sorted(str(d) for d in dtypes)))
+        raise ValueError(msg)
+
+    dtype = dtypes.pop()
+    if dtype not in (np.float32, np.float64):
+        msg = "Unsupported precision {} - must be float32 or float64"
+        raise ValueError(msg.format(dtype))
+
+
+def _sample_index(tt, fsmp, lsmp, nsamp, c0=0, c1=None):
+    """
+    Return the offset of the first sample to stack into cells c0 to c1 from
+    each station, as an index into the flattened onset array. tt may be a
+    full index table, or a CompactIndex or AnalyticIndex object, for which
+    only the requested cells are computed (so that the full table is never
+    built).
+
+    """
+
+    nstn = tt.shape[-1]
+    if c1 is None:
+        c1 = int(np.prod(tt.shape[:-1]))
+
+    if isinstance(tt, np.ndarray):
+        index = tt.reshape(-1, nstn)[c0:c1]
+    else:
+        index = tt.take(np.arange(c0, c1))
+
+    offset = np.arange(nstn, dtype=np.int64) * (fsmp + lsmp + nsamp) + fsmp
+    return np.maximum(index, 0).astype(np.int64) + offset
+
+
+def migrate(sig, tt, fsmp, lsmp, nsamp, map4d, threads, tiled=False):
+    """
+    Computes 4-D coalescence map by back-migrating P and S onset functions.
+    numpy equivalent of QMigratelib.migrate().
+
+    Returns output by populating map4d.
+
+    Parameters
+    ----------
+    sig : array-like, float64 or float32
+        P and S onset functions
+
+    tt : array-like, CompactIndex or AnalyticIndex object
+        P and S travel-time lookup-tables
+
+    fsmp : int
+        First sample in array to scan from
+
+    lsmp : int
+        Last sample in array to scan upto
+
+    nsamp : int
+        Number of samples in array to scan over
+
+    map4d : array-like, same dtype as sig
+        Empty array with shape of 4-D coalescence map that will be output
+
+    threads : int
+        Unused - included for compatibility with QMigratelib.migrate()
+
+    tiled : bool, optional
+        Unused - included for compatibility with QMigratelib.migrate()
+
+    Raises
+    ------
+    ValueError
+        If there is a mismatch between number of stations in sig and look-up
+        table
+
+    ValueError
+        If the 4-D array is too small
+
+    ValueError
+        If the sig array is smaller than map4d[0, 0, 0, :]
+
+    ValueError
+        If sig and map4d do not have the same floating point precision
+
+    """
+
+    nstn, ssmp = sig.shape
+
+    if not tt.shape[-1] == nstn:
+        msg = "Mismatch between number of stations for data and LUT, {} - {}"
+        msg = msg.format(nstn, tt.shape[-1])
+        raise ValueError(msg)
+
+    tcell = np.prod(tt.shape[:-1])
+
+    if map4d.size < nsamp*tcell:
+        msg = "4D-array is too small."
+        raise ValueError(msg)
+
+    if sig.size < nsamp + fsmp:
+        msg = "Data array smaller than coalescence array."
+        raise ValueError(msg)
+
+    _check_dtype(sig, map4d)
+
+    sig = sig.ravel()
+    stk = map4d.reshape(-1)[:tcell*nsamp].reshape(tcell, nsamp)
+    tm = np.arange(nsamp, dtype=np.int64)
+
+    # Stack the stations in order, as the C-compiled kernel does, so that
+    # the floating point sums are identical
+    for c0 in range(0, tcell, CELL_CHUNK):
+        c1 = min(c0 + CELL_CHUNK, tcell)
+        index = _sample_index(tt, fsmp, lsmp, nsamp, c0, c1)
+        for st in range(nstn):
+            stk[c0:c1] += sig[index[:, st, None] + tm]
+
+
+def find_max_coa(map4d, max_coa, grid_index, fsmp, lsmp, threads,
+                 cell_major=True):
+    """
+    Finds the maximum coalescence value in the 4-D coalesence grid at each
+    time-step. numpy equivalent of QMigratelib.find_max_coa().
+
+    Returns output by populating max_coa and grid_index.
+
+    Parameters
+    ----------
+    map4d : array-like, float64 or float32
+        4-D coalescence map
+
+    max_coa : array-like, same dtype as map4d
+        empty array with shape of max coa values that will be output
+
+    grid_index : array-like, int64
+        empty array with shape of grid index of max coa values that will be
+        output
+
+    fsmp : int
+        First sample in array to scan from
+
+    lsmp : int
+        Last sample in array to scan upto
+
+    threads : int
+        Unused - included for compatibility with QMigratelib.find_max_coa()
+
+    cell_major : bool, optional
+        Unused - included for compatibility with QMigratelib.find_max_coa()
+
+    Raises
+    ------
+    ValueError
+        If the output array size is too small
+
+    ValueError
+        If map4d and max_coa do not have the same floating point precision
+
+    """
+
+    nsamp = map4d.shape[-1]
+
+    if max_coa.size < nsamp or grid_index.size < nsamp:
+        msg = "Output array size too small, sample count = {}."
+        msg = msg.format(nsamp)
+        raise ValueError(msg)
+
+    _check_dtype(map4d, max_coa)
+
+    coa = map4d.reshape(-1, nsamp)[:, fsmp:lsmp]
+
+    # argmax returns the first (lowest) cell index for ties, as the C-compiled
+    # kernel does; values that do not exceed 0 are reported as 0 at cell 0
+    ix = np.argmax(coa, axis=0)
+    mv = coa[ix, np.arange(coa.shape[1])]
+    pos = mv > 0
+    max_coa[fsmp:lsmp] = np.where(pos, mv, 0)
+    grid_index[fsmp:lsmp] = np.where(pos, ix, 0)
+
+
+def migrate_max_coa(sig, tt, fsmp, lsmp, nsamp, max_coa, grid_index, sum_coa,
+                    threads, prune=False, threshold=None):
+    """
+    Back-migrates P and S onset functions and reduces the coalescence over the
+    grid at each time-step, without storing the 4-D coalescence map. numpy
+    equivalent of QMigratelib.migrate_max_coa().
+
+    Returns output by populating max_coa, grid_index and sum_coa.
+
+    Parameters
+    ----------
+    sig : array-like, float64 or float32
+        P and S onset functions
+
+    tt : array-like, CompactIndex or AnalyticIndex object
+        P and S travel-time lookup-tables
+
+    fsmp : int
+        First sample in array to scan from
+
+    lsmp : int
+        Last sample in array to scan upto
+
+    nsamp : int
+        Number of samples in array to scan over
+
+    max_coa : array-like, same dtype as sig
+        Empty array with shape (nsamp,) for the maximum coalescence value
+
+    grid_index : array-like, int64
+        Empty array with shape (nsamp,) for the grid index of the maximum
+        coalescence value
+
+    sum_coa : array-like, float64
+        Empty array with shape (nsamp,) for the sum of the coalescence over
+        all grid cells
+
+    threads : int
+        Unused - included for compatibility with
+        QMigratelib.migrate_max_coa()
+
+    prune : bool, optional
+        Unused - pruning only skips work, so the output is that of the
+        unpruned reduction (as for an AnalyticIndex in QMigratelib)
+
+    threshold : float, optional
+        Unused - only applies with prune=True
+
+    Raises
+    ------
+    ValueError
+        If there is a mismatch between number of stations in sig and look-up
+        table
+
+    ValueError
+        If the output array size is too small
+
+    ValueError
+        If the sig array is smaller than the requested scan
+
+    ValueError
+        If sig and max_coa do not have the same floating point precision
+
+    """
+
+    nstn, ssmp = sig.shape
+
+    if not tt.shape[-1] == nstn:
+        msg = "Mismatch between number of stations for data and LUT, {} - {}"
+        msg = msg.format(nstn, tt.shape[-1])
+        raise ValueError(msg)
+
+    tcell = np.prod(tt.shape[:-1])
+
+    if max_coa.size < nsamp or grid_index.size < nsamp or \
+       sum_coa.size < nsamp:
+        msg = "Output array size too small, sample count = {}."
+        msg = msg.format(nsamp)
+        raise ValueError(msg)
+
+    if sig.size < nsamp + fsmp:
+        msg = "Data array smaller than coalescence array."
+        raise ValueError(msg)
+
+    _check_dtype(sig, max_coa)
+
+    max_coa[:nsamp] = 0
+    grid_index[:nsamp] = 0
+    sum_coa[:nsamp] = 0
+
+    sig = sig.ravel()
+    tm = np.arange(nsamp, dtype=np.int64)
+    stk = np.empty((CELL_CHUNK, nsamp), dtype=max_coa.dtype)
+
+    for c0 in range(0, tcell, CELL_CHUNK):
+        c1 = min(c0 + CELL_CHUNK, tcell)
+        index = _sample_index(tt, fsmp, lsmp, nsamp, c0, c1)
+        chunk = stk[:c1 - c0]
+        chunk[:] = 0
+        for st in range(nstn):
+            chunk += sig[index[:, st, None] + tm]
+
+        sum_coa[:nsamp] += chunk.sum(axis=0, dtype=np.float64)
+
+        # Chunks are visited in cell order, so a strictly greater value is
+        # needed to replace the running maximum (ties go to the lowest cell)
+        ix = np.argmax(chunk, axis=0)
+        mv = chunk[ix, tm]
+        new = mv > max_coa[:nsamp]
+        max_coa[:nsamp][new] = mv[new]
+        grid_index[:nsamp][new] = ix[new] + c0
@@ -30,6 +30,9 @@ class Archive(object):
     format : str
         File naming format of data archive
 
+    station_file : pathlib Path object
+        Location of the QMigrate station file the stations were read from
+
     raw_waveforms : obspy Stream object
         All raw seismic data found and read in from the archive in the
         specified time period
@@ -56,6 +59,14 @@ class Archive(object):
         If True, read all stations in archive for that time period. Else,
         only read specified stations.
 
+    carry_over : bool, optional
+        If True, keep the raw data read for one time period and, when the next
+        requested period overlaps it (as consecutive detect() time steps do),
+        read only the data that follows it from the archive. Only the raw
+        (undetrended, unresampled) data is carried over: it is re-sliced to
+        the new period, then detrended and resampled over that period as
+        usual, so the output is identical to reading the whole period.
+
     stations : pandas Series object
         Series object containing station names
 
@@ -102,6 +113,12 @@ class Archive(object):
 
         self.read_all_stations = False
 
+        # Raw data carried over between overlapping reads: (start time, end
+        # time, merged obspy Stream)
+        self.carry_over = False
+        self._carried = None
+
+        self.station_file = pathlib.Path(station_file)
         self.stations = qio.stations(station_file, delimiter=delimiter)["Name"]
         self.st = None
 
@@ -155,7 +172,8 @@ class Archive(object):
             self.format = "{year}_{jday}/{station}_*"
 
     def read_waveform_data(self, start_time, end_time, sampling_rate,
-                           pre_pad=None, post_pad=None):
+                           pre_pad=None, post_pad=None, dtype=np.float64,
+                           detrend=True):
         """
         Read in the waveform data for all stations in the archive between two
         times and return station availability of the stations specified in the
@@ -189,6 +207,17 @@ class Archive(object):
             parameter. Defaults to none: post_pad calculated in QuakeScan will
             be used (included in end_time).
 
+        dtype : numpy dtype, optional
+            Floating point precision of the processed signal array: float64
+            (default) or float32. Single precision halves the memory footprint
+            of the signal and everything computed from it.
+
+        detrend : bool, optional
+            Remove the linear trend and mean of each trace (default: True).
+            If False, the samples do not depend on the period they were read
+            with, so consecutive periods can be processed as one continuous
+            stream.
+
         """
 
         self.sampling_rate = sampling_rate
@@ -201,17 +230,27 @@ class Archive(object):
             post_pad = 0.
 
         samples = int(round((end_time - start_time) * sampling_rate + 1))
-        files = self._load_from_path(start_time - pre_pad, end_time + post_pad)
+        read_start = start_time - pre_pad
+        read_end = end_time + post_pad
+        files = self._load_from_path(read_start, read_end)
 
+        # Re-use the overlapping part of the data read for the previous
+        # period, and read only the data that follows it
         st = Stream()
+        new_start = read_start
+        if self.carry_over and self._carried is not None:
+            carried_start, carried_end, carried = self._carried
+            if carried_start <= read_start <= carried_end <= read_end:
+                st = self._slice(carried, read_start)
+                new_start = carried_end
+
         try:
             first = next(files)
             files = chain([first], files)
             for file in files:
                 file = str(file)
                 try:
-                    st += read(file, starttime=start_time - pre_pad,
-                               endtime=end_time + post_pad)
+                    st += read(file, starttime=new_start, endtime=read_end)
                 except TypeError:
                     msg = "File not compatible with obspy - {}"
                     print(msg.format(file))
@@ -220,6 +259,11 @@ class Archive(object):
             # Remove all stations with data gaps
             st.merge(method=-1)
 
+            # Keep the raw data, before it is trimmed, detrended or resampled
+            # for this period
+            self._carried = (read_start, read_end, st) \
+                if self.carry_over else None
+
             # Make copy of raw waveforms to output if requested, delete st
             st_raw = st.copy()
             st_selected = Stream()
@@ -247,12 +291,14 @@ class Archive(object):
                 raise util.DataGapException
 
             # Detrend and downsample / resample stream if required
-            st.detrend("linear")
-            st.detrend("demean")
+            if detrend:
+                st.detrend("linear")
+                st.detrend("demean")
             st = self._downsample(st, sampling_rate, self.upfactor)
 
             # Combining the data and determining station availability
-            signal, availability = self._station_availability(st, samples)
+            signal, availability = self._station_availability(st, samples,
+                                                              dtype)
 
         except StopIteration:
             self.availability = np.zeros(len(self.stations))
@@ -260,11 +306,47 @@ class Archive(object):
 
         self.raw_waveforms = st_raw
         self.signal = signal
-        self.filtered_signal = np.empty((self.signal.shape))
+        self.filtered_signal = np.empty((self.signal.shape),
+                                        dtype=self.signal.dtype)
         self.filtered_signal[:] = np.nan
         self.availability = availability
 
-    def _station_availability(self, stream, samples):
+    @staticmethod
+    def _slice(stream, start_time):
+        """
+        Return the data in a stream from the sample nearest a given time
+        onwards, as views of the data (equivalent to Stream.slice(), without
+        the overhead of recording the processing in the trace headers).
+
+        Parameters
+        ----------
+        stream : obspy Stream object
+            Stream to slice
+
+        start_time : UTCDateTime object
+            Time of first sample to keep
+
+        Returns
+        -------
+        sliced : obspy Stream object
+            Traces that have data after start_time
+
+        """
+
+        sliced = Stream()
+        for tr in stream:
+            i0 = max(0, int(round((start_time - tr.stats.starttime)
+                                  * tr.stats.sampling_rate)))
+            if i0 >= tr.stats.npts:
+                continue
+            stats = tr.stats.copy()
+            stats.starttime = tr.stats.starttime + i0 * tr.stats.delta
+            stats.npts = tr.stats.npts - i0
+            sliced += Trace(data=tr.data[i0:], header=stats)
+
+        return sliced
+
+    def _station_availability(self, stream, samples, dtype=np.float64):
         """
         Determine whether continuous data exists between two times for a given
         station.
@@ -277,6 +359,9 @@ class Archive(object):
         samples : int
             Number of samples expected in the signal
 
+        dtype : numpy dtype, optional
+            Floating point precision of the signal array
+
         Returns
         -------
         signal : array-like
@@ -289,7 +374,7 @@ class Archive(object):
         """
 
         availability = np.zeros(len(self.stations))
-        signal = np.zeros((3, len(self.stations), int(samples)))
+        signal = np.zeros((3, len(self.stations), int(samples)), dtype=dtype)
 
         for i, station in enumerate(self.stations):
             tmp_st = stream.select(station=station)
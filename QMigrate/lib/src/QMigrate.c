@@ -1,5 +1,9 @@
 
+#include <float.h>
+#include <math.h>
 #include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
 
 #ifndef _OPENMP
     #define STRING2(x) #x
@@ -28,58 +32,85 @@
 #define MIN(a,b) (((a)<(b))?(a):(b))
 #define MAX(a,b) (((a)>(b))?(a):(b))
 
-EXPORT void scan4d(double *sigPt, int32_t *indPt, double *mapPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int32_t nstation, int64_t ncell, int64_t threads)
-{
-    double  *stnPt, *stkPt;
-    int32_t *ttpPt;
-    int32_t ttp, tend;
-    int32_t to, tm, st;
-    int64_t cell;
+/* Tile sizes for scan4d_tiled: a CELL_BLOCK x TIME_BLOCK tile of the
+   coalescence map (64 kB of doubles, 32 kB of floats) stays in L2 while STN_BLOCK stations
+   are stacked into it, and each TIME_BLOCK row (4 kB) stays in L1. */
+#define CELL_BLOCK 16
+#define TIME_BLOCK 512
+#define STN_BLOCK 16
 
-    /* omp_set_num_threads(threads); */
+/* Block sizes for scan4d_detect_pruned: the grid is split into cubes of
+   PRUNE_BLOCK^3 cells, each bounded and pruned as a whole over a tile of
+   PRUNE_TIME samples. */
+#define PRUNE_BLOCK 4
+#define PRUNE_TIME 64
 
-    /* shared(mapPt) */
-    #pragma omp parallel for private(cell,tm,st,stnPt,stkPt,ttpPt,ttp,tend) num_threads(threads)
-    for (cell=0; cell<ncell; cell++)
-    {
-        stkPt = &mapPt[cell * (int64_t) nsamp];
-        ttpPt = &indPt[cell * (int64_t) nstation];
-        for(st=0; st<nstation; st++)
-        {
-            ttp   = MAX(0,ttpPt[st]);
-            stnPt = &sigPt[st*(fsmp + lsmp + nsamp) + ttp + fsmp];
-            for(tm=0; tm<nsamp; tm++)
-                stkPt[tm] += stnPt[tm];
-        }
-    }
-}
+/* Double precision kernels: scan4d, scan4d_tiled, detect4d,
+   detect4d_cellmajor, scan4d_detect, scan4d_detect_pruned */
+#define REAL double
+#define KERNEL(name) name
+#include "QMigrate_kernels.h"
+#undef REAL
+#undef KERNEL
 
+/* Single precision kernels: scan4d_f32, scan4d_tiled_f32, detect4d_f32,
+   detect4d_cellmajor_f32, scan4d_detect_f32, scan4d_detect_pruned_f32 */
+#define REAL float
+#define KERNEL(name) name##_f32
+#include "QMigrate_kernels.h"
+#undef REAL
+#undef KERNEL
 
-EXPORT void detect4d(double *mapPt, double *snrPt, int64_t *indPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int64_t ncell, int64_t threads)
-{
-    double  mv, cv;
-    int32_t tm;
-    int64_t cell, ix;
+/* Migration kernels reading a compact travel-time index with uint16 and
+   uint8 per-station offsets, e.g. scan4d_u16, scan4d_f32_u8 */
+#define DELTA uint16_t
+#define REAL double
+#define KERNEL(name) name##_u16
+#include "QMigrate_kernels.h"
+#undef REAL
+#undef KERNEL
+#define REAL float
+#define KERNEL(name) name##_f32_u16
+#include "QMigrate_kernels.h"
+#undef REAL
+#undef KERNEL
+#undef DELTA
 
-    /* omp_set_num_threads(threads); */
+#define DELTA uint8_t
+#define REAL double
+#define KERNEL(name) name##_u8
+#include "QMigrate_kernels.h"
+#undef REAL
+#undef KERNEL
+#define REAL float
+#define KERNEL(name) name##_f32_u8
+#include "QMigrate_kernels.h"
+#undef REAL
+#undef KERNEL
+#undef DELTA
 
-    /* stack data.... */
-    /* shared(mapPt) */
-    #pragma omp parallel for private(cell,tm,mv,ix,cv) num_threads(threads)
-    for (tm=fsmp; tm<lsmp; tm++)
-    {
-        mv = 0.0;
-        ix = 0;
-        for (cell=0; cell<ncell; cell++)
-        {
-            cv = mapPt[cell * (int64_t) nsamp + (int64_t) tm];
-            if (cv > mv)
-            {
-                mv = cv;
-                ix = cell;
-            }
-        }
-        snrPt[tm] = mv;
-        indPt[tm] = ix;
-    }
-}
+/* Migration kernels computing analytic (homogeneous velocity) travel times
+   on the fly: scan4d_analytic, scan4d_detect_analytic, scan4d_f32_analytic,
+   scan4d_detect_f32_analytic */
+#define REAL double
+#define KERNEL(name) name##_analytic
+#include "QMigrate_analytic.h"
+#undef REAL
+#undef KERNEL
+#define REAL float
+#define KERNEL(name) name##_f32_analytic
+#include "QMigrate_analytic.h"
+#undef REAL
+#undef KERNEL
+
+/* Onset function kernels: onset_classic, onset_classic_f32 */
+#define REAL double
+#define KERNEL(name) name
+#include "QMigrate_onset.h"
+#undef REAL
+#undef KERNEL
+#define REAL float
+#define KERNEL(name) name##_f32
+#include "QMigrate_onset.h"
+#undef REAL
+#undef KERNEL
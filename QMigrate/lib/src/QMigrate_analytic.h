@@ -0,0 +1,138 @@
+/*
+ * Migration kernels for analytic (homogeneous velocity) travel times, written
+ * once for both precisions (see QMigrate_kernels.h for REAL and KERNEL).
+ *
+ * Rather than reading a travel-time index table, the sample offset of each
+ * station (and phase) is computed for each cell as
+ *
+ *     rint(srate * (distance / velocity))
+ *
+ * from the position of the cell, the position of the station and the
+ * velocity of the phase, as LUT.fetch_index() does for the travel-time
+ * tables of LUT.compute_homogeneous_vmodel(). The grid is described by
+ * geoPt: the position of cell (0, 0, 0) followed by the steps in position
+ * along the x, y and z cell axes (12 values). stnPt holds the position of
+ * each station (nstation x 3) and velPt the velocity for each station.
+ */
+
+static void KERNEL(analytic_index)(int32_t *ttPt, int64_t cell, double *geoPt, double *stnPt, double *velPt, double srate, int32_t nstation, int64_t ny, int64_t nz)
+{
+    double  pos[3], d, dist;
+    int64_t i, j, k;
+    int32_t st, ax;
+
+    i = cell / (ny * nz);
+    j = (cell / nz) % ny;
+    k = cell % nz;
+    for (ax=0; ax<3; ax++)
+        pos[ax] = geoPt[ax] + i * geoPt[3 + ax] + j * geoPt[6 + ax]
+                  + k * geoPt[9 + ax];
+
+    for (st=0; st<nstation; st++)
+    {
+        dist = 0.0;
+        for (ax=0; ax<3; ax++)
+        {
+            d     = pos[ax] - stnPt[3 * st + ax];
+            dist += d * d;
+        }
+        ttPt[st] = MAX(0, (int32_t) rint(srate * (sqrt(dist) / velPt[st])));
+    }
+}
+
+EXPORT void KERNEL(scan4d)(REAL *sigPt, double *geoPt, double *stnPt, double *velPt, double srate, REAL *mapPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int32_t nstation, int64_t nx, int64_t ny, int64_t nz, int64_t threads)
+{
+    REAL    *stnSig, *stkPt;
+    int32_t *ttPt;
+    int32_t tm, st;
+    int64_t cell, ncell = nx * ny * nz;
+
+    #pragma omp parallel private(cell,tm,st,stnSig,stkPt,ttPt) num_threads(threads)
+    {
+        ttPt = (int32_t *) malloc(nstation * sizeof(int32_t));
+
+        #pragma omp for
+        for (cell=0; cell<ncell; cell++)
+        {
+            KERNEL(analytic_index)(ttPt, cell, geoPt, stnPt, velPt, srate, nstation, ny, nz);
+            stkPt = &mapPt[cell * (int64_t) nsamp];
+            for(st=0; st<nstation; st++)
+            {
+                stnSig = &sigPt[st*(fsmp + lsmp + nsamp) + ttPt[st] + fsmp];
+                for(tm=0; tm<nsamp; tm++)
+                    stkPt[tm] += stnSig[tm];
+            }
+        }
+
+        free(ttPt);
+    }
+}
+
+EXPORT void KERNEL(scan4d_detect)(REAL *sigPt, double *geoPt, double *stnPt, double *velPt, double srate, REAL *snrPt, int64_t *ixPt, double *sumPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int32_t nstation, int64_t nx, int64_t ny, int64_t nz, int64_t threads)
+{
+    REAL    *stnSig, *stkPt, *mxPt;
+    double  *smPt;
+    int32_t *ttPt;
+    int32_t tm, st;
+    int64_t cell, *ixLoc, ncell = nx * ny * nz;
+
+    /* As scan4d_detect in QMigrate_kernels.h */
+    for (tm=0; tm<nsamp; tm++)
+    {
+        snrPt[tm] = 0.0;
+        ixPt[tm]  = 0;
+        sumPt[tm] = 0.0;
+    }
+
+    #pragma omp parallel private(cell,tm,st,stnSig,stkPt,ttPt,mxPt,smPt,ixLoc) num_threads(threads)
+    {
+        ttPt  = (int32_t *) malloc(nstation * sizeof(int32_t));
+        stkPt = (REAL *) malloc(nsamp * sizeof(REAL));
+        mxPt  = (REAL *) calloc(nsamp, sizeof(REAL));
+        smPt  = (double *) calloc(nsamp, sizeof(double));
+        ixLoc = (int64_t *) calloc(nsamp, sizeof(int64_t));
+
+        #pragma omp for schedule(static)
+        for (cell=0; cell<ncell; cell++)
+        {
+            KERNEL(analytic_index)(ttPt, cell, geoPt, stnPt, velPt, srate, nstation, ny, nz);
+            memset(stkPt, 0, nsamp * sizeof(REAL));
+            for(st=0; st<nstation; st++)
+            {
+                stnSig = &sigPt[st*(fsmp + lsmp + nsamp) + ttPt[st] + fsmp];
+                for(tm=0; tm<nsamp; tm++)
+                    stkPt[tm] += stnSig[tm];
+            }
+            for(tm=0; tm<nsamp; tm++)
+            {
+                smPt[tm] += stkPt[tm];
+                if (stkPt[tm] > mxPt[tm])
+                {
+                    mxPt[tm]  = stkPt[tm];
+                    ixLoc[tm] = cell;
+                }
+            }
+        }
+
+        /* Merge per-thread results; ties go to the lowest cell index. */
+        #pragma omp critical
+        {
+            for(tm=0; tm<nsamp; tm++)
+            {
+                sumPt[tm] += smPt[tm];
+                if (mxPt[tm] > snrPt[tm] ||
+                    (mxPt[tm] == snrPt[tm] && ixLoc[tm] < ixPt[tm]))
+                {
+                    snrPt[tm] = mxPt[tm];
+                    ixPt[tm]  = ixLoc[tm];
+                }
+            }
+        }
+
+        free(ttPt);
+        free(stkPt);
+        free(mxPt);
+        free(smPt);
+        free(ixLoc);
+    }
+}
@@ -0,0 +1,483 @@
+/*
+ * Migration and reduction kernels, written once for both precisions.
+ *
+ * This file is included by QMigrate.c with REAL defined as the floating point
+ * type of the onset functions and coalescence map, and KERNEL(name) defined
+ * to give the exported symbol name for that precision, e.g.:
+ *
+ *     REAL = double, KERNEL(scan4d) -> scan4d
+ *     REAL = float,  KERNEL(scan4d) -> scan4d_f32
+ *
+ * Sums over the whole grid (sumPt) are always accumulated in double.
+ *
+ * The migration kernels read the travel-time index either as a full int32
+ * table (indPt), or, if DELTA is defined, as a compact table of one int32
+ * base offset per cell (basePt) plus a DELTA (uint8 or uint16) offset per
+ * station (indPt). The compact table is built from the clamped (>= 0) travel
+ * times, so both give identical results. The kernels that only read the
+ * coalescence map are compiled for the full index only.
+ */
+
+#ifdef DELTA
+    #define INDEX_ARGS int32_t *basePt, DELTA *indPt
+    #define INDEX_T DELTA
+    #define CELL_BASE(cell) basePt[cell]
+#else
+    #define INDEX_ARGS int32_t *indPt
+    #define INDEX_T int32_t
+    #define CELL_BASE(cell) 0
+#endif
+#define TTIME(base, d) ((base) + MAX(0, (d)))
+
+EXPORT void KERNEL(scan4d)(REAL *sigPt, INDEX_ARGS, REAL *mapPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int32_t nstation, int64_t ncell, int64_t threads)
+{
+    REAL    *stnPt, *stkPt;
+    INDEX_T *ttpPt;
+    int32_t ttb;
+    int32_t ttp, tend;
+    int32_t to, tm, st;
+    int64_t cell;
+
+    /* omp_set_num_threads(threads); */
+
+    /* shared(mapPt) */
+    #pragma omp parallel for private(cell,tm,st,stnPt,stkPt,ttpPt,ttb,ttp,tend) num_threads(threads)
+    for (cell=0; cell<ncell; cell++)
+    {
+        stkPt = &mapPt[cell * (int64_t) nsamp];
+        ttpPt = &indPt[cell * (int64_t) nstation];
+        ttb   = CELL_BASE(cell);
+        for(st=0; st<nstation; st++)
+        {
+            ttp   = TTIME(ttb, ttpPt[st]);
+            stnPt = &sigPt[st*(fsmp + lsmp + nsamp) + ttp + fsmp];
+            for(tm=0; tm<nsamp; tm++)
+                stkPt[tm] += stnPt[tm];
+        }
+    }
+}
+
+
+EXPORT void KERNEL(scan4d_tiled)(REAL *sigPt, INDEX_ARGS, REAL *mapPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int32_t nstation, int64_t ncell, int64_t threads)
+{
+    REAL    *stnPt, *stkPt;
+    INDEX_T *ttpPt;
+    int32_t ttb;
+    int32_t ttp, t0, tn, s0, sn;
+    int32_t tm, st;
+    int64_t cb, c0, cn, cell, nblock;
+
+    nblock = (ncell + CELL_BLOCK - 1) / CELL_BLOCK;
+
+    /* Each (cell block, time block) pair owns a disjoint tile of mapPt. */
+    #pragma omp parallel for collapse(2) schedule(static) private(cb,c0,cn,t0,tn,s0,sn,cell,tm,st,stnPt,stkPt,ttpPt,ttb,ttp) num_threads(threads)
+    for (cb=0; cb<nblock; cb++)
+    {
+        for (t0=0; t0<nsamp; t0+=TIME_BLOCK)
+        {
+            c0 = cb * CELL_BLOCK;
+            cn = MIN(c0 + CELL_BLOCK, ncell);
+            tn = MIN(t0 + TIME_BLOCK, nsamp);
+            for (s0=0; s0<nstation; s0+=STN_BLOCK)
+            {
+                sn = MIN(s0 + STN_BLOCK, nstation);
+                for (cell=c0; cell<cn; cell++)
+                {
+                    stkPt = &mapPt[cell * (int64_t) nsamp];
+                    ttpPt = &indPt[cell * (int64_t) nstation];
+                    ttb   = CELL_BASE(cell);
+                    for (st=s0; st<sn; st++)
+                    {
+                        ttp   = TTIME(ttb, ttpPt[st]);
+                        stnPt = &sigPt[st*(fsmp + lsmp + nsamp) + ttp + fsmp];
+                        for (tm=t0; tm<tn; tm++)
+                            stkPt[tm] += stnPt[tm];
+                    }
+                }
+            }
+        }
+    }
+}
+
+
+#ifndef DELTA
+EXPORT void KERNEL(detect4d)(REAL *mapPt, REAL *snrPt, int64_t *indPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int64_t ncell, int64_t threads)
+{
+    REAL    mv, cv;
+    int32_t tm;
+    int64_t cell, ix;
+
+    /* omp_set_num_threads(threads); */
+
+    /* stack data.... */
+    /* shared(mapPt) */
+    #pragma omp parallel for private(cell,tm,mv,ix,cv) num_threads(threads)
+    for (tm=fsmp; tm<lsmp; tm++)
+    {
+        mv = 0.0;
+        ix = 0;
+        for (cell=0; cell<ncell; cell++)
+        {
+            cv = mapPt[cell * (int64_t) nsamp + (int64_t) tm];
+            if (cv > mv)
+            {
+                mv = cv;
+                ix = cell;
+            }
+        }
+        snrPt[tm] = mv;
+        indPt[tm] = ix;
+    }
+}
+
+
+EXPORT void KERNEL(detect4d_cellmajor)(REAL *mapPt, REAL *snrPt, int64_t *indPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int64_t ncell, int64_t threads)
+{
+    REAL    *mapRow, *mxPt;
+    int32_t tm, ntm;
+    int64_t cell, *ixLoc;
+
+    /* Same result as detect4d, but each thread reduces a contiguous block of
+       cells, reading whole (contiguous) time rows of mapPt into its own
+       running max/argmax arrays, instead of gathering one value per cell with
+       a stride of nsamp for every time sample. */
+    ntm = lsmp - fsmp;
+    for (tm=fsmp; tm<lsmp; tm++)
+    {
+        snrPt[tm] = 0.0;
+        indPt[tm] = 0;
+    }
+
+    #pragma omp parallel private(cell,tm,mapRow,mxPt,ixLoc) num_threads(threads)
+    {
+        mxPt  = (REAL *) calloc(ntm, sizeof(REAL));
+        ixLoc = (int64_t *) calloc(ntm, sizeof(int64_t));
+
+        #pragma omp for schedule(static)
+        for (cell=0; cell<ncell; cell++)
+        {
+            mapRow = &mapPt[cell * (int64_t) nsamp + fsmp];
+            for (tm=0; tm<ntm; tm++)
+            {
+                if (mapRow[tm] > mxPt[tm])
+                {
+                    mxPt[tm]  = mapRow[tm];
+                    ixLoc[tm] = cell;
+                }
+            }
+        }
+
+        /* Merge per-thread results; ties go to the lowest cell index. */
+        #pragma omp critical
+        {
+            for (tm=0; tm<ntm; tm++)
+            {
+                if (mxPt[tm] > snrPt[tm + fsmp] ||
+                    (mxPt[tm] == snrPt[tm + fsmp] && ixLoc[tm] < indPt[tm + fsmp]))
+                {
+                    snrPt[tm + fsmp] = mxPt[tm];
+                    indPt[tm + fsmp] = ixLoc[tm];
+                }
+            }
+        }
+
+        free(mxPt);
+        free(ixLoc);
+    }
+}
+
+
+#endif
+
+
+EXPORT void KERNEL(scan4d_detect)(REAL *sigPt, INDEX_ARGS, REAL *snrPt, int64_t *ixPt, double *sumPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int32_t nstation, int64_t ncell, int64_t threads)
+{
+    REAL    *stnPt, *stkPt, *mxPt;
+    double  *smPt;
+    INDEX_T *ttpPt;
+    int32_t ttb;
+    int32_t ttp;
+    int32_t tm, st;
+    int64_t cell, *ixLoc;
+
+    /* Migrate and reduce in a single pass: each thread stacks one cell at a
+       time into a scratch row and folds it into its own running max, argmax
+       and sum, so the 4-D coalescence map is never stored. */
+    for (tm=0; tm<nsamp; tm++)
+    {
+        snrPt[tm] = 0.0;
+        ixPt[tm]  = 0;
+        sumPt[tm] = 0.0;
+    }
+
+    #pragma omp parallel private(cell,tm,st,stnPt,stkPt,ttpPt,ttb,ttp,mxPt,smPt,ixLoc) num_threads(threads)
+    {
+        stkPt = (REAL *) malloc(nsamp * sizeof(REAL));
+        mxPt  = (REAL *) calloc(nsamp, sizeof(REAL));
+        smPt  = (double *) calloc(nsamp, sizeof(double));
+        ixLoc = (int64_t *) calloc(nsamp, sizeof(int64_t));
+
+        #pragma omp for schedule(static)
+        for (cell=0; cell<ncell; cell++)
+        {
+            memset(stkPt, 0, nsamp * sizeof(REAL));
+            ttpPt = &indPt[cell * (int64_t) nstation];
+            ttb   = CELL_BASE(cell);
+            for(st=0; st<nstation; st++)
+            {
+                ttp   = TTIME(ttb, ttpPt[st]);
+                stnPt = &sigPt[st*(fsmp + lsmp + nsamp) + ttp + fsmp];
+                for(tm=0; tm<nsamp; tm++)
+                    stkPt[tm] += stnPt[tm];
+            }
+            for(tm=0; tm<nsamp; tm++)
+            {
+                smPt[tm] += stkPt[tm];
+                if (stkPt[tm] > mxPt[tm])
+                {
+                    mxPt[tm]  = stkPt[tm];
+                    ixLoc[tm] = cell;
+                }
+            }
+        }
+
+        /* Merge per-thread results; ties go to the lowest cell index, as in
+           detect4d. */
+        #pragma omp critical
+        {
+            for(tm=0; tm<nsamp; tm++)
+            {
+                sumPt[tm] += smPt[tm];
+                if (mxPt[tm] > snrPt[tm] ||
+                    (mxPt[tm] == snrPt[tm] && ixLoc[tm] < ixPt[tm]))
+                {
+                    snrPt[tm] = mxPt[tm];
+                    ixPt[tm]  = ixLoc[tm];
+                }
+            }
+        }
+
+        free(stkPt);
+        free(mxPt);
+        free(smPt);
+        free(ixLoc);
+    }
+}
+
+
+/* Upper bound on the coalescence of a block of cells over a tile of time
+   samples, used to order and prune the blocks in scan4d_detect_pruned. */
+typedef struct
+{
+    REAL    bound;
+    int64_t block;
+} KERNEL(block_bound);
+
+
+/* Sort block bounds into descending order; ties in ascending block order. */
+static int KERNEL(cmp_block_bound)(const void *a, const void *b)
+{
+    const KERNEL(block_bound) *ba = (const KERNEL(block_bound) *) a;
+    const KERNEL(block_bound) *bb = (const KERNEL(block_bound) *) b;
+
+    if (ba->bound > bb->bound) return -1;
+    if (ba->bound < bb->bound) return 1;
+    return (ba->block > bb->block) - (ba->block < bb->block);
+}
+
+
+EXPORT void KERNEL(scan4d_detect_pruned)(REAL *sigPt, INDEX_ARGS, REAL *snrPt, int64_t *ixPt, double *sumPt, int32_t fsmp, int32_t lsmp, int32_t nsamp, int32_t nstation, int64_t nx, int64_t ny, int64_t nz, REAL thres, int64_t threads)
+{
+    KERNEL(block_bound) *bndPt;
+    REAL    *stnPt, *stkPt, *mxPt, bound, mv, lim;
+    double  *smPt;
+    INDEX_T *ttpPt;
+    int32_t *ttMin, *ttMax, *ttTop, ttp, ttb;
+    int32_t t0, tn, ntm, tm, st, tile, ntile;
+    int64_t *ixLoc, *hist, *histOff;
+    int64_t nbx, nby, nbz, nblock, b, blk, i, j, k, cell, k0, kn, nhist;
+    int64_t rowlen = (int64_t) fsmp + lsmp + nsamp;
+
+    /* Same max and argmax as scan4d_detect, but the grid is split into
+       cubes of PRUNE_BLOCK^3 cells and each tile of PRUNE_TIME samples is
+       reduced best-block-first. The coalescence of any cell in a block is at
+       most the sum over stations of the maximum onset value within the
+       block's travel-time range (floating point addition is monotonic, so
+       this holds exactly), and blocks whose bound is below both the lowest
+       running max in the tile and thres are skipped. Blocks that can only tie
+       the running max are still visited, so ties go to the lowest cell index.
+
+       The sum over all cells is computed without migrating every cell, by
+       correlating each onset function with the histogram of its travel-times
+       (in double precision). */
+    nbx = (nx + PRUNE_BLOCK - 1) / PRUNE_BLOCK;
+    nby = (ny + PRUNE_BLOCK - 1) / PRUNE_BLOCK;
+    nbz = (nz + PRUNE_BLOCK - 1) / PRUNE_BLOCK;
+    nblock = nbx * nby * nbz;
+    ntile = (nsamp + PRUNE_TIME - 1) / PRUNE_TIME;
+
+    ttMin = (int32_t *) malloc(nblock * nstation * sizeof(int32_t));
+    ttMax = (int32_t *) malloc(nblock * nstation * sizeof(int32_t));
+    ttTop = (int32_t *) calloc(nstation, sizeof(int32_t));
+    histOff = (int64_t *) malloc((nstation + 1) * sizeof(int64_t));
+
+    /* Travel-time range of each block from each station */
+    #pragma omp parallel for private(b,i,j,k,st,cell,ttpPt,ttb,ttp) num_threads(threads)
+    for (b=0; b<nblock; b++)
+    {
+        for (st=0; st<nstation; st++)
+        {
+            ttMin[b*nstation + st] = INT32_MAX;
+            ttMax[b*nstation + st] = 0;
+        }
+        for (i=(b / (nby*nbz))*PRUNE_BLOCK; i<MIN(nx, (b / (nby*nbz) + 1)*PRUNE_BLOCK); i++)
+        for (j=((b / nbz) % nby)*PRUNE_BLOCK; j<MIN(ny, ((b / nbz) % nby + 1)*PRUNE_BLOCK); j++)
+        for (k=(b % nbz)*PRUNE_BLOCK; k<MIN(nz, (b % nbz + 1)*PRUNE_BLOCK); k++)
+        {
+            cell  = (i*ny + j)*nz + k;
+            ttpPt = &indPt[cell * (int64_t) nstation];
+            ttb   = CELL_BASE(cell);
+            for (st=0; st<nstation; st++)
+            {
+                ttp = TTIME(ttb, ttpPt[st]);
+                ttMin[b*nstation + st] = MIN(ttMin[b*nstation + st], ttp);
+                ttMax[b*nstation + st] = MAX(ttMax[b*nstation + st], ttp);
+            }
+        }
+    }
+
+    /* Histogram of travel-times from each station */
+    for (b=0; b<nblock; b++)
+        for (st=0; st<nstation; st++)
+            ttTop[st] = MAX(ttTop[st], ttMax[b*nstation + st]);
+    histOff[0] = 0;
+    for (st=0; st<nstation; st++)
+        histOff[st + 1] = histOff[st] + ttTop[st] + 1;
+    nhist = histOff[nstation];
+    hist = (int64_t *) calloc(nhist, sizeof(int64_t));
+
+    #pragma omp parallel for private(st,cell) num_threads(threads)
+    for (st=0; st<nstation; st++)
+        for (cell=0; cell<nx*ny*nz; cell++)
+            hist[histOff[st] + TTIME(CELL_BASE(cell), indPt[cell * (int64_t) nstation + st])]++;
+
+    #pragma omp parallel private(bndPt,stkPt,mxPt,smPt,ixLoc,tile,t0,tn,ntm,tm,st,b,blk,i,j,k,cell,k0,kn,bound,mv,lim,stnPt,ttpPt,ttb,ttp) num_threads(threads)
+    {
+        bndPt = (KERNEL(block_bound) *) malloc(nblock * sizeof(KERNEL(block_bound)));
+        stkPt = (REAL *) malloc(PRUNE_TIME * sizeof(REAL));
+        mxPt  = (REAL *) malloc(PRUNE_TIME * sizeof(REAL));
+        smPt  = (double *) malloc(PRUNE_TIME * sizeof(double));
+        ixLoc = (int64_t *) malloc(PRUNE_TIME * sizeof(int64_t));
+
+        #pragma omp for schedule(dynamic)
+        for (tile=0; tile<ntile; tile++)
+        {
+            t0  = tile * PRUNE_TIME;
+            tn  = MIN(t0 + PRUNE_TIME, nsamp);
+            ntm = tn - t0;
+
+            /* Bound the coalescence of each block over the tile */
+            for (b=0; b<nblock; b++)
+            {
+                bound = 0.0;
+                for (st=0; st<nstation; st++)
+                {
+                    stnPt = &sigPt[st*rowlen + fsmp + t0];
+                    k0 = ttMin[b*nstation + st];
+                    kn = ttMax[b*nstation + st] + ntm;
+                    mv = stnPt[k0];
+                    for (k=k0+1; k<kn; k++)
+                        mv = MAX(mv, stnPt[k]);
+                    bound += mv;
+                }
+                bndPt[b].bound = bound;
+                bndPt[b].block = b;
+            }
+            qsort(bndPt, nblock, sizeof(KERNEL(block_bound)), KERNEL(cmp_block_bound));
+
+            for (tm=0; tm<ntm; tm++)
+            {
+                mxPt[tm]  = 0.0;
+                ixLoc[tm] = 0;
+            }
+            lim = MAX(thres, 0.0);
+
+            for (b=0; b<nblock; b++)
+            {
+                if (bndPt[b].bound < lim)
+                    break;
+                blk = bndPt[b].block;
+                for (i=(blk / (nby*nbz))*PRUNE_BLOCK; i<MIN(nx, (blk / (nby*nbz) + 1)*PRUNE_BLOCK); i++)
+                for (j=((blk / nbz) % nby)*PRUNE_BLOCK; j<MIN(ny, ((blk / nbz) % nby + 1)*PRUNE_BLOCK); j++)
+                for (k=(blk % nbz)*PRUNE_BLOCK; k<MIN(nz, (blk % nbz + 1)*PRUNE_BLOCK); k++)
+                {
+                    cell  = (i*ny + j)*nz + k;
+                    ttpPt = &indPt[cell * (int64_t) nstation];
+                    ttb   = CELL_BASE(cell);
+                    memset(stkPt, 0, ntm * sizeof(REAL));
+                    for (st=0; st<nstation; st++)
+                    {
+                        ttp   = TTIME(ttb, ttpPt[st]);
+                        stnPt = &sigPt[st*rowlen + ttp + fsmp + t0];
+                        for (tm=0; tm<ntm; tm++)
+                            stkPt[tm] += stnPt[tm];
+                    }
+                    for (tm=0; tm<ntm; tm++)
+                    {
+                        if (stkPt[tm] > mxPt[tm] ||
+                            (stkPt[tm] == mxPt[tm] && cell < ixLoc[tm]))
+                        {
+                            mxPt[tm]  = stkPt[tm];
+                            ixLoc[tm] = cell;
+                        }
+                    }
+                }
+
+                /* Lowest running max in the tile */
+                lim = mxPt[0];
+                for (tm=1; tm<ntm; tm++)
+                    lim = MIN(lim, mxPt[tm]);
+                lim = MAX(lim, thres);
+            }
+
+            /* Sum over all cells */
+            for (tm=0; tm<ntm; tm++)
+                smPt[tm] = 0.0;
+            for (st=0; st<nstation; st++)
+            {
+                stnPt = &sigPt[st*rowlen + fsmp + t0];
+                for (k=0; k<=ttTop[st]; k++)
+                {
+                    if (hist[histOff[st] + k] == 0)
+                        continue;
+                    for (tm=0; tm<ntm; tm++)
+                        smPt[tm] += (double) hist[histOff[st] + k] * stnPt[k + tm];
+                }
+            }
+
+            for (tm=0; tm<ntm; tm++)
+            {
+                snrPt[t0 + tm] = mxPt[tm];
+                ixPt[t0 + tm]  = ixLoc[tm];
+                sumPt[t0 + tm] = smPt[tm];
+            }
+        }
+
+        free(bndPt);
+        free(stkPt);
+        free(mxPt);
+        free(smPt);
+        free(ixLoc);
+    }
+
+    free(ttMin);
+    free(ttMax);
+    free(ttTop);
+    free(histOff);
+    free(hist);
+}
+
+#undef INDEX_ARGS
+#undef INDEX_T
+#undef CELL_BASE
+#undef TTIME
@@ -0,0 +1,169 @@
+/*
+ * Onset function kernels, written once for both precisions (see
+ * QMigrate_kernels.h for REAL and KERNEL).
+ *
+ * Each channel is processed in a single pass, as QMigrate.signal.scan.filter()
+ * followed by QMigrate.signal.scan.onset() (classic STA/LTA): if detrend is
+ * set, the least-squares line through the channel is removed first (as
+ * obspy's detrend("linear") does on reading), then the first sample is
+ * subtracted, the cosine taper tapPt applied, the band-pass filter sosPt
+ * (nsec second-order sections, as scipy.signal.sosfilt) run backward then
+ * forward, and the STA/LTA computed from cumulative sums and log-clipped.
+ * Intermediate results are rounded to REAL where the Python implementation
+ * stores them in the precision of the data.
+ */
+
+static void KERNEL(onset_channel)(REAL *sig, double *sosPt, int32_t nsec, double *tapPt, int32_t detrend, int32_t nsta, int32_t nlta, int32_t nsamp, REAL *fsig, double *csum, double *zi, REAL *rawPt, REAL *onsPt)
+{
+    double  x, y, sum, sta, lta, tmid, slope;
+    REAL    s0, r;
+    int32_t tm, sc;
+    double  *sos;
+
+    /* Least-squares line, about the middle sample */
+    if (detrend)
+    {
+        tmid = 0.5 * (nsamp - 1);
+        sum = 0.0;
+        slope = 0.0;
+        for (tm=0; tm<nsamp; tm++)
+        {
+            sum += sig[tm];
+            slope += (tm - tmid) * sig[tm];
+        }
+        sum /= nsamp;
+        slope = (nsamp > 1) ? slope * 12.0 / ((double) nsamp * ((double) nsamp * nsamp - 1.0)) : 0.0;
+        for (tm=0; tm<nsamp; tm++)
+            fsig[tm] = (REAL) (sig[tm] - (sum + slope * (tm - tmid)));
+    }
+    else
+        memcpy(fsig, sig, nsamp * sizeof(REAL));
+
+    s0 = fsig[0];
+    for (tm=0; tm<nsamp; tm++)
+        fsig[tm] = (REAL) ((double) (REAL) (fsig[tm] - s0) * tapPt[tm]);
+
+    /* Band-pass filter backward, then forward (direct form II transposed) */
+    memset(zi, 0, 2 * nsec * sizeof(double));
+    for (tm=nsamp-1; tm>=0; tm--)
+    {
+        x = fsig[tm];
+        for (sc=0; sc<nsec; sc++)
+        {
+            sos = &sosPt[6 * sc];
+            y = sos[0] * x + zi[2 * sc];
+            zi[2 * sc]     = sos[1] * x - sos[4] * y + zi[2 * sc + 1];
+            zi[2 * sc + 1] = sos[2] * x - sos[5] * y;
+            x = y;
+        }
+        fsig[tm] = (REAL) x;
+    }
+    memset(zi, 0, 2 * nsec * sizeof(double));
+    sum = 0.0;
+    for (tm=0; tm<nsamp; tm++)
+    {
+        x = fsig[tm];
+        for (sc=0; sc<nsec; sc++)
+        {
+            sos = &sosPt[6 * sc];
+            y = sos[0] * x + zi[2 * sc];
+            zi[2 * sc]     = sos[1] * x - sos[4] * y + zi[2 * sc + 1];
+            zi[2 * sc + 1] = sos[2] * x - sos[5] * y;
+            x = y;
+        }
+        fsig[tm] = (REAL) x;
+        sum += fsig[tm];
+    }
+
+    /* Channels with no data */
+    if (sum == 0.0)
+    {
+        memset(rawPt, 0, nsamp * sizeof(REAL));
+        memset(onsPt, 0, nsamp * sizeof(REAL));
+        return;
+    }
+
+    /* Classic STA/LTA from the cumulative sum of the squared signal */
+    sum = 0.0;
+    for (tm=0; tm<nsamp; tm++)
+    {
+        sum += (double) fsig[tm] * (double) fsig[tm];
+        csum[tm] = sum;
+    }
+    for (tm=0; tm<nsamp; tm++)
+    {
+        sta = (tm >= nsta) ? csum[tm] - csum[tm - nsta] : csum[tm];
+        sta /= nsta;
+        lta = (tm >= nlta) ? csum[tm] - csum[tm - nlta] : csum[tm];
+        lta /= nlta;
+        if (tm < nlta - 1)
+            sta = 0.0;
+        if (lta < DBL_MIN)
+            lta = DBL_MIN;
+
+        r = (REAL) (sta / lta);
+        rawPt[tm] = r;
+        r = r + (REAL) 1.0;
+        onsPt[tm] = (REAL) log((double) MAX(r, (REAL) 0.8));
+    }
+}
+
+EXPORT void KERNEL(onset_classic)(REAL *sigPt, double *sosPt, int32_t nsec, double *tapPt, int32_t detrend, int32_t nsta, int32_t nlta, REAL *onsPt, REAL *rawPt, int32_t ncomp, int32_t nchan, int32_t nsamp, int64_t threads)
+{
+    /* sigPt holds ncomp components of nchan channels. With more than one
+       component, the onset functions of the components are combined as
+       sqrt(mean(onset ** 2)), as QuakeScan._compute_s_onset() does. */
+    REAL    *fsig, *raw, *ons, *cRaw, *cOns;
+    double  *csum, *zi;
+    int32_t ch, cp, tm;
+
+    #pragma omp parallel private(ch,cp,tm,fsig,raw,ons,cRaw,cOns,csum,zi) num_threads(threads)
+    {
+        fsig = (REAL *) malloc(nsamp * sizeof(REAL));
+        cRaw = (REAL *) malloc(nsamp * sizeof(REAL));
+        cOns = (REAL *) malloc(nsamp * sizeof(REAL));
+        csum = (double *) malloc(nsamp * sizeof(double));
+        zi   = (double *) malloc(2 * nsec * sizeof(double));
+
+        #pragma omp for schedule(dynamic)
+        for (ch=0; ch<nchan; ch++)
+        {
+            raw = &rawPt[(int64_t) ch * nsamp];
+            ons = &onsPt[(int64_t) ch * nsamp];
+            if (ncomp == 1)
+            {
+                KERNEL(onset_channel)(&sigPt[(int64_t) ch * nsamp], sosPt, nsec, tapPt, detrend, nsta, nlta, nsamp, fsig, csum, zi, raw, ons);
+                continue;
+            }
+
+            for (cp=0; cp<ncomp; cp++)
+            {
+                KERNEL(onset_channel)(&sigPt[((int64_t) cp * nchan + ch) * nsamp], sosPt, nsec, tapPt, detrend, nsta, nlta, nsamp, fsig, csum, zi, cRaw, cOns);
+                for (tm=0; tm<nsamp; tm++)
+                {
+                    if (cp == 0)
+                    {
+                        raw[tm] = cRaw[tm] * cRaw[tm];
+                        ons[tm] = cOns[tm] * cOns[tm];
+                    }
+                    else
+                    {
+                        raw[tm] += cRaw[tm] * cRaw[tm];
+                        ons[tm] += cOns[tm] * cOns[tm];
+                    }
+                }
+            }
+            for (tm=0; tm<nsamp; tm++)
+            {
+                raw[tm] = (REAL) sqrt((double) (raw[tm] / (REAL) ncomp));
+                ons[tm] = (REAL) sqrt((double) (ons[tm] / (REAL) ncomp));
+            }
+        }
+
+        free(fsig);
+        free(cRaw);
+        free(cOns);
+        free(csum);
+        free(zi);
+    }
+}
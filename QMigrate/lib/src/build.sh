@@ -1,4 +1,8 @@
 #!/bin/bash
 
-gcc -shared -fPIC -std=gnu99 QMigrate.c -fopenmp -O0 -o ../QMigrate.so
-
+# Portable build, plus instruction-set specific builds (skipped if not
+# supported). QMigrate.core.QMigratelib loads the best variant at import.
+gcc -shared -fPIC -std=gnu99 QMigrate.c -fopenmp -ffp-contract=off -O2 -o ../QMigrate.so -lm
+gcc -shared -fPIC -std=gnu99 QMigrate.c -fopenmp -ffp-contract=off -O3 -msse4.2 -o ../QMigrate_sse42.so -lm
+gcc -shared -fPIC -std=gnu99 QMigrate.c -fopenmp -ffp-contract=off -O3 -mavx2 -mfma -o ../QMigrate_avx2.so -lm
+gcc -shared -fPIC -std=gnu99 QMigrate.c -fopenmp -ffp-contract=off -O3 -mavx512f -mavx512dq -mavx2 -mfma -o ../QMigrate_avx512.so -lm
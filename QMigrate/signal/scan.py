@@ -4,19 +4,23 @@ Module to perform core QuakeMigrate functions: detect() and locate().
 
 """
 
+from functools import lru_cache
+import hashlib
+import os
+import pathlib
 import warnings
 
 import numpy as np
 from obspy import UTCDateTime, Stream, Trace
 from obspy.signal.invsim import cosine_taper
-from obspy.signal.trigger import classic_sta_lta
 import pandas as pd
 from scipy.interpolate import Rbf
 from scipy.optimize import curve_fit
-from scipy.signal import butter, lfilter, fftconvolve
+from scipy.signal import butter, fftconvolve, sosfilt
 
-import QMigrate.core.model as qmod
+import QMigrate.core.backends as qback
 import QMigrate.core.QMigratelib as ilib
+import QMigrate.core.model as qmod
 import QMigrate.io.quakeio as qio
 import QMigrate.plot.quakeplot as qplot
 import QMigrate.util as util
@@ -32,16 +36,68 @@ warnings.filterwarnings("ignore", message=("File will be written with more" +
                                            " programs."))
 
 
+def sta_lta_classic(a, nsta, nlta):
+    """
+    Calculates the ratio of the average signal in a short-term (signal) window
+    to the average in a long-term (noise) window ending at the same sample,
+    along the last axis of a (i.e. for every channel of a block at once).
+    Equivalent to obspy's classic_sta_lta.
+
+    Parameters
+    ----------
+    a : array-like
+        Signal array, shape (..., nsamples)
+
+    nsta : int
+        Number of samples in short-term window
+
+    nlta : int
+        Number of samples in long-term window
+
+    Returns
+    -------
+    sta / lta : array-like, float64
+        Ratio of short term average to long term average. STA/LTA value is
+        assigned to the end of the STA & LTA windows; the first nlta - 1
+        samples are zero.
+
+    """
+
+    nsta = int(round(nsta))
+    nlta = int(round(nlta))
+
+    # Cumulative sum to calculate moving averages
+    lta = np.square(a, dtype=np.float64)
+    np.cumsum(lta, axis=-1, out=lta)
+
+    sta = np.empty_like(lta)
+    sta[..., :nsta] = lta[..., :nsta]
+    np.subtract(lta[..., nsta:], lta[..., :-nsta], out=sta[..., nsta:])
+    sta /= nsta
+
+    lta[..., nlta:] -= lta[..., :-nlta]
+    lta /= nlta
+
+    sta[..., :(nlta - 1)] = 0
+
+    # Avoid division by zero by setting zero values to tiny float
+    dtiny = np.finfo(0.0).tiny
+    lta[lta < dtiny] = dtiny
+
+    sta /= lta
+    return sta
+
+
 def sta_lta_centred(a, nsta, nlta):
     """
     Calculates the ratio of the average signal in a short-term (signal) window
     to a preceding long-term (noise) window. STA/LTA value is assigned to the
-    end of the LTA / start of the STA.
+    end of the LTA / start of the STA. Computed along the last axis of a.
 
     Parameters
     ----------
     a : array-like
-        Signal array
+        Signal array, shape (..., nsamples)
 
     nsta : int
         Number of samples in short-term window
@@ -62,20 +118,20 @@ def sta_lta_centred(a, nsta, nlta):
     nlta = int(round(nlta))
 
     # Cumulative sum to calculate moving average
-    sta = np.cumsum(a ** 2)
+    sta = np.cumsum(a ** 2, axis=-1)
     sta = np.require(sta, dtype=np.float)
     lta = sta.copy()
 
     # Compute the STA and the LTA
-    sta[nsta:] = sta[nsta:] - sta[:-nsta]
-    sta[nsta:-nsta] = sta[nsta*2:]
+    sta[..., nsta:] = sta[..., nsta:] - sta[..., :-nsta]
+    sta[..., nsta:-nsta] = sta[..., nsta*2:]
     sta /= nsta
 
-    lta[nlta:] = lta[nlta:] - lta[:-nlta]
+    lta[..., nlta:] = lta[..., nlta:] - lta[..., :-nlta]
     lta /= nlta
 
-    sta[:(nlta - 1)] = 0
-    sta[-nsta:] = 0
+    sta[..., :(nlta - 1)] = 0
+    sta[..., -nsta:] = 0
 
     # Avoid division by zero by setting zero values to tiny float
     dtiny = np.finfo(0.0).tiny
@@ -93,7 +149,8 @@ def onset(sig, stw, ltw, centred=False):
     Parameters
     ----------
     sig : array-like
-        Data signal used to generate an onset function
+        Data signal used to generate an onset function. The onset functions
+        are returned with the same floating point precision as sig.
 
     stw : int
         Short term window length (# of samples)
@@ -126,25 +183,48 @@ def onset(sig, stw, ltw, centred=False):
     stw = int(round(stw))
     ltw = int(round(ltw))
 
-    n_channels, n_samples = sig.shape
-    onset = np.copy(sig)
-    onset_raw = np.copy(sig)
-    for i in range(n_channels):
-        if np.sum(sig[i, :]) == 0.0:
-            onset[i, :] = 0.0
-            onset_raw[i, :] = onset[i, :]
+    # Compute the STA/LTA of all channels at once; channels with no data are
+    # set to zero afterwards
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if centred is True:
+            onset_raw = sta_lta_centred(sig, stw, ltw)
         else:
-            if centred is True:
-                onset[i, :] = sta_lta_centred(sig[i, :], stw, ltw)
-            else:
-                onset[i, :] = classic_sta_lta(sig[i, :], stw, ltw)
-            onset_raw[i, :] = onset[i, :]
-            np.clip(1 + onset[i, :], 0.8, np.inf, onset[i, :])
-            np.log(onset[i, :], onset[i, :])
+            onset_raw = sta_lta_classic(sig, stw, ltw)
+    onset_raw = onset_raw.astype(sig.dtype, copy=False)
+    onset_raw[np.sum(sig, axis=-1) == 0.0] = 0.0
+
+    onset = np.add(onset_raw, 1, dtype=sig.dtype)
+    np.clip(onset, 0.8, np.inf, onset)
+    np.log(onset, onset)
 
     return onset_raw, onset
 
 
+@lru_cache(maxsize=16)
+def _bandpass_sos(sampling_rate, lc, hc, order):
+    """
+    Design a Butterworth band-pass filter as second-order sections. Designs
+    are cached, as the same few filters are applied to every time step.
+
+    """
+
+    sos = butter(order, [2.0 * lc / sampling_rate,
+                         2.0 * hc / sampling_rate], btype="band", output="sos")
+    return sos
+
+
+@lru_cache(maxsize=16)
+def _taper(nsamp, p=0.1):
+    """
+    Return a (read-only) cosine taper, cached by length.
+
+    """
+
+    tap = cosine_taper(nsamp, p)
+    tap.flags.writeable = False
+    return tap
+
+
 def filter(sig, sampling_rate, lc, hc, order=2):
     """
     Apply zero phase-shift Butterworth band-pass filter to seismic data.
@@ -152,7 +232,8 @@ def filter(sig, sampling_rate, lc, hc, order=2):
     Parameters
     ----------
     sig : array-like
-        Data signal to be filtered
+        Data signal to be filtered. The filtered signal is returned with the
+        same floating point precision as sig.
 
     sampling_rate : int
         Number of samples per second, in Hz
@@ -175,22 +256,318 @@ def filter(sig, sampling_rate, lc, hc, order=2):
     """
 
     # Construct butterworth band-pass filter
-    b1, a1 = butter(order, [2.0 * lc / sampling_rate,
-                            2.0 * hc / sampling_rate], btype="band")
+    sos = _bandpass_sos(sampling_rate, lc, hc, order)
     nchan, nsamp = sig.shape
-    fsig = np.copy(sig)
 
-    # Apply cosine taper then apply band-pass filter in both directions
-    for ch in range(0, nchan):
-        fsig[ch, :] = fsig[ch, :] - fsig[ch, 0]
-        tap = cosine_taper(len(fsig[ch, :]), 0.1)
-        fsig[ch, :] = fsig[ch, :] * tap
-        fsig[ch, :] = lfilter(b1, a1, fsig[ch, ::-1])[::-1]
-        fsig[ch, :] = lfilter(b1, a1, fsig[ch, :])
+    # Apply cosine taper then apply band-pass filter in both directions, to
+    # all channels at once
+    fsig = sig - sig[:, :1]
+    fsig *= _taper(nsamp, 0.1)
+    fsig[:] = sosfilt(sos, fsig[:, ::-1], axis=-1)[:, ::-1]
+    fsig[:] = sosfilt(sos, fsig, axis=-1)
 
     return fsig
 
 
+class StreamingOnset(object):
+    """
+    Causal STA/LTA onset function computed block by block from a continuous
+    stream of data.
+
+    Each block of new samples is band-pass filtered (one pass, carrying the
+    filter state from the previous block) and its classic STA/LTA computed
+    from running sums carried over from the previous blocks (the last nlta
+    squared samples), so no samples are filtered or averaged twice. Fed in
+    consecutive blocks, the onset function of a stream is that of the whole
+    stream at once: a one-pass filter of the stream, de-meaned by its first
+    sample, followed by sta_lta_classic.
+
+    This is not the onset function computed by QuakeScan for each time step
+    (see onset and filter): the stream is neither detrended nor tapered, and
+    the filter is causal rather than zero-phase, so it delays the onsets,
+    and its transient is only at the start of the stream.
+
+    Attributes
+    ----------
+    sos : array-like
+        Butterworth band-pass filter, as second-order sections
+
+    nsta : int
+        Number of samples in short-term window
+
+    nlta : int
+        Number of samples in long-term window
+
+    Methods
+    -------
+    reset()
+        Start a new stream
+
+    """
+
+    def __init__(self, sampling_rate, bp_filter, onset_win):
+        """
+        Class initialisation method.
+
+        Parameters
+        ----------
+        sampling_rate : int
+            Number of samples per second, in Hz
+
+        bp_filter : array-like
+            Band-pass filter parameters [lowpass, highpass, order], as
+            QuakeScan.p_bp_filter
+
+        onset_win : array-like
+            Short- and long-term window lengths (in seconds), as
+            QuakeScan.p_onset_win
+
+        """
+
+        lc, hc, ord_ = bp_filter
+        self.sos = _bandpass_sos(sampling_rate, lc, hc, ord_)
+
+        stw, ltw = onset_win
+        self.nsta = int(stw * sampling_rate) + 1
+        self.nlta = int(ltw * sampling_rate) + 1
+
+        self.reset()
+
+    def reset(self):
+        """
+        Start a new stream: the next block is taken to start it.
+
+        """
+
+        self._offset = None
+        self._zi = None
+        self._history = None
+        self._count = 0
+
+    def __call__(self, sig):
+        """
+        Compute the onset function of the next block of the stream.
+
+        Parameters
+        ----------
+        sig : array-like
+            Next block of data, shape (nchannels, nsamples). The onset
+            functions are returned with the same floating point precision as
+            sig.
+
+        Returns
+        -------
+        onset_raw : array-like
+            Raw STA/LTA ratio onset function of the block
+
+        onset : array-like
+            log10(onset_raw) ; after clipping between -0.2 and infinity.
+
+        """
+
+        if self._zi is None:
+            self._offset = sig[:, :1].astype(np.float64)
+            self._zi = np.zeros((self.sos.shape[0], sig.shape[0], 2))
+            self._history = np.zeros((sig.shape[0], 0))
+
+        fsig, self._zi = sosfilt(self.sos, sig - self._offset, axis=-1,
+                                 zi=self._zi)
+
+        onset_raw = self._sta_lta(fsig).astype(sig.dtype, copy=False)
+        onset = np.add(onset_raw, 1, dtype=sig.dtype)
+        np.clip(onset, 0.8, np.inf, onset)
+        np.log(onset, onset)
+
+        return onset_raw, onset
+
+    def _sta_lta(self, fsig):
+        """
+        Classic STA/LTA of a block, continuing the running sums of the stream.
+
+        """
+
+        nhist = self._history.shape[-1]
+        nsamp = fsig.shape[-1]
+
+        squared = np.empty((fsig.shape[0], nhist + nsamp))
+        squared[:, :nhist] = self._history
+        np.square(fsig, out=squared[:, nhist:])
+
+        # csum[:, k] is the sum of the first k squared samples of the history
+        # and block; the window sums ending at each new sample are differences
+        csum = np.zeros((fsig.shape[0], nhist + nsamp + 1))
+        np.cumsum(squared, axis=-1, out=csum[:, 1:])
+
+        end = np.arange(nhist + 1, nhist + nsamp + 1)
+        total = csum[:, nhist + 1:]
+        sta = total - csum.take(np.maximum(end - self.nsta, 0), axis=-1)
+        sta /= self.nsta
+        lta = total - csum.take(np.maximum(end - self.nlta, 0), axis=-1)
+        lta /= self.nlta
+
+        # Zero the samples before the first full long-term window
+        sta[:, :max(0, self.nlta - 1 - self._count)] = 0
+
+        # Avoid division by zero by setting zero values to tiny float
+        dtiny = np.finfo(0.0).tiny
+        lta[lta < dtiny] = dtiny
+
+        # Keep the squared samples needed by the windows of the next block
+        self._history = squared[:, -self.nlta:].copy()
+        self._count += nsamp
+
+        sta /= lta
+        return sta
+
+
+class OnsetCache(object):
+    """
+    On-disk cache of the onset functions computed for each station and time
+    window, so that a re-scan with the same onset parameters (e.g. over a new
+    grid or with a different LUT decimation) does not need to read and
+    pre-process the waveform data again.
+
+    The onset functions of each station are stored as one .npy file per time
+    window -- P onset, S onset, raw P onset and raw S onset, shape
+    (4, nsamples) -- which is memory-mapped when read back, under
+
+        path/<key>/<station>/<year>/<julian day>/<HHMMSS.ffffff>_<nsamples>.npy
+
+    where <key> is a hash of the identity of the waveform archive (its path,
+    file naming format and station file) and of the onset parameters
+    (sampling rate, filter bands, onset windows, ...). Stations without data in a window are stored
+    as an empty array.
+
+    Attributes
+    ----------
+    path : pathlib Path object
+        Directory holding the onset functions computed with these parameters
+
+    Methods
+    -------
+    read(stations, start_time, nsamp)
+        Read the cached onset functions of a time window
+
+    write(stations, start_time, availability, onset, onset_raw)
+        Cache the onset functions of a time window
+
+    """
+
+    def __init__(self, path, key):
+        """
+        Class initialisation method.
+
+        Parameters
+        ----------
+        path : str
+            Root directory of the cache
+
+        key : tuple
+            Archive and parameters the onset functions depend on
+
+        """
+
+        tag = hashlib.md5(repr(key).encode()).hexdigest()[:16]
+        self.path = pathlib.Path(path) / tag
+
+    def _file(self, station, start_time, nsamp):
+        name = "{}_{}.npy".format(start_time.strftime("%H%M%S.%f"), nsamp)
+        return self.path / station / str(start_time.year) / \
+            "{:03d}".format(start_time.julday) / name
+
+    def read(self, stations, start_time, nsamp):
+        """
+        Read the cached onset functions of a time window.
+
+        Parameters
+        ----------
+        stations : array-like of str
+            Names of the stations, in order
+
+        start_time : UTCDateTime object
+            Time stamp of the first sample in the window
+
+        nsamp : int
+            Number of samples in the window
+
+        Returns
+        -------
+        onsets : tuple of array-like, or None
+            (onset, onset_raw, availability): the log-clipped P onset
+            functions of all stations followed by the S onset functions,
+            shape (2 * nstation, nsamp), the raw P and S onset functions and
+            the station availability during the window. None if the window
+            is not cached for all stations.
+
+        """
+
+        files = [self._file(stn, start_time, nsamp) for stn in stations]
+        if not all(f.is_file() for f in files):
+            return None
+
+        nstn = len(files)
+        onsets = None
+        availability = np.zeros(nstn)
+        try:
+            for i, f in enumerate(files):
+                data = np.load(str(f), mmap_mode="r")
+                if onsets is None:
+                    onsets = np.zeros((2, 2, nstn, nsamp), dtype=data.dtype)
+                if data.size:
+                    onsets[:, :, i] = data.reshape(2, 2, nsamp)
+                    availability[i] = 1
+        except (OSError, ValueError):
+            return None
+
+        return (onsets[0].reshape(2 * nstn, nsamp),
+                onsets[1].reshape(2 * nstn, nsamp), availability)
+
+    def write(self, stations, start_time, availability, onset, onset_raw):
+        """
+        Cache the onset functions of a time window.
+
+        Parameters
+        ----------
+        stations : array-like of str
+            Names of the stations, in order
+
+        start_time : UTCDateTime object
+            Time stamp of the first sample in the window
+
+        availability : array-like
+            Station availability during the window
+
+        onset : array-like
+            Log-clipped P onset functions of all stations followed by the S
+            onset functions, shape (2 * nstation, nsamples)
+
+        onset_raw : array-like
+            Raw P and S onset functions, as onset
+
+        """
+
+        nstn, nsamp = len(stations), onset.shape[-1]
+        onsets = np.stack((onset.reshape(2, nstn, nsamp),
+                           onset_raw.reshape(2, nstn, nsamp)))
+        empty = np.empty((4, 0), dtype=onsets.dtype)
+
+        try:
+            for i, stn in enumerate(stations):
+                fname = self._file(stn, start_time, nsamp)
+                fname.parent.mkdir(parents=True, exist_ok=True)
+                data = onsets[:, :, i].reshape(4, nsamp) \
+                    if availability[i] == 1 else empty
+
+                # Write to a temporary file first, so that an interrupted run
+                # cannot leave a truncated file in the cache
+                tmp = fname.with_name(fname.stem + ".tmp.npy")
+                np.save(str(tmp), data)
+                os.replace(str(tmp), str(fname))
+        except OSError as e:
+            msg = "Unable to cache onset functions - {}".format(e)
+            warnings.warn(msg)
+
+
 class DefaultQuakeScan(object):
     """
     Default parameter class for QuakeScan.
@@ -248,6 +625,100 @@ class DefaultQuakeScan(object):
             quality allows it. This is the default behaviour; override by
             setting this variable.
 
+        single_precision : bool, optional
+            Compute the onset functions and coalescence in single precision
+            (float32) rather than double precision (float64). This halves the
+            memory footprint and memory bandwidth of the migration, at the
+            cost of some precision in the coalescence values. Single precision
+            is used in detect() and double precision in locate() by default;
+            override by setting this variable.
+
+        backend : str, optional
+            Engine used to migrate the onset functions and reduce the
+            coalescence: "c" (C-compiled kernels), "numba" (requires numba) or
+            "numpy" (pure-numpy, slow but has no compiled dependencies). By
+            default, the first available of these is used.
+
+        prune : bool, optional
+            In detect(), skip blocks of grid cells whose coalescence is
+            bounded below the running maximum coalescence. The maximum
+            coalescence and its location are unchanged. Ignored by the numpy
+            backend, which always reduces over the whole grid
+            (default: False).
+
+        prune_threshold : float, optional
+            In detect() with prune = True, also skip blocks of grid cells
+            that cannot reach this coalescence value (on the scale of the COA
+            channel of the .scanmseed output). This makes detect() much
+            faster on quiet data, but coalescence values below the threshold
+            are then a lower bound rather than the maximum over the grid
+            (default: None).
+
+        detect_levels : list of array-like, optional
+            Coarse-to-fine grid search in detect(): decimation factors [x, y,
+            z] of the undecimated LUT, coarsest first, each coarser than
+            decimate. Coalescence is computed over the whole of the coarsest
+            grid; the neighbourhoods of its maximum coalescence cells (at
+            times where it exceeds detect_level_threshold) are then
+            re-migrated on each finer level in turn, down to the grid given
+            by decimate. The .scanmseed outputs -- including COA_N, which is
+            normalised by the mean coalescence over the same grid -- are those
+            of the finest level evaluated at each sample (default: None, i.e.
+            single-level).
+
+        detect_level_threshold : float, optional
+            Coalescence value (on the scale of the COA channel of the
+            .scanmseed output) above which the grid search is refined from
+            one level to the next: only samples that were refined to a level,
+            and where its maximum coalescence exceeds the threshold, are
+            refined to the level below. If None, the search is refined at all
+            times.
+
+        compact_index : bool, optional
+            Store the travel-time index table passed to the migration as one
+            int32 offset per cell plus a uint16 (or uint8) offset per station
+            and phase, rather than in full as int32. This halves (or
+            quarters) its memory footprint and bandwidth, without changing
+            the results (default: False).
+
+        persist_index : bool, optional
+            Save the travel-time index tables computed from the LUT next to
+            the LUT file, and reuse them in later runs (see
+            LUT.fetch_ps_index) (default: False).
+
+        streaming_onset : bool, optional
+            In detect(), compute causal onset functions (one-pass band-pass
+            filter and classic STA/LTA) as a continuous stream, carrying the
+            filter state and STA/LTA sums from one time step to the next
+            (see StreamingOnset), so that only the samples new to each time
+            step are processed. This changes the output of detect(): the
+            data are not detrended or tapered for each time step, and the
+            causal filter does not have the zero phase-shift of the default
+            filter, so the coalescence peaks later and differs in shape.
+            Requires onset_centred to be False (default: False).
+
+        native_onset : bool, optional
+            In detect(), compute the onset functions with the C-compiled
+            onset kernel (requires the C-library): each channel is
+            detrended, tapered, filtered and its classic STA/LTA computed in
+            a single pass, parallelised over stations, straight into the
+            array of onset functions passed to the migration. Results agree
+            with the Python implementation to rounding error (the linear
+            trend is removed after, rather than before, any resampling of
+            the data, which differs slightly). Ignored if onset_centred or
+            streaming_onset is True (default: False).
+
+        onset_cache : str, optional
+            Directory in which to cache the onset functions computed in
+            detect(), keyed by archive (path, format and station file),
+            station, time window, sampling rate, filter bands, onset windows,
+            onset_centred and precision (see OnsetCache). Time windows found in the cache are not read from
+            the archive, so re-scans over different grids or decimations only
+            cost the migration. The time windows depend on pre_pad and
+            post_pad -- the latter on the maximum travel time in the LUT -- so
+            set these explicitly to share the cache between LUTs. Cannot be
+            used with streaming_onset (default: None).
+
         pick_threshold : float (between 0 and 1)
             For use with picking_mode = 'Gaussian'. Picks will only be made if
             the onset function exceeds this percentile of the noise level
@@ -347,6 +818,34 @@ class DefaultQuakeScan(object):
         # automatically set in detect() and locate()
         self.onset_centred = None
 
+        # Single precision override -- None means it will be automatically set
+        # in detect() and locate()
+        self.single_precision = None
+
+        # Migration backend -- None means the fastest available is used
+        self.backend = None
+
+        # Branch-and-bound pruning of grid cells in detect()
+        self.prune = False
+        self.prune_threshold = None
+
+        # Coarse-to-fine grid search in detect()
+        self.detect_levels = None
+        self.detect_level_threshold = None
+
+        # Compact travel-time index tables
+        self.compact_index = False
+        self.persist_index = False
+
+        # Causal onset functions streamed between time steps in detect()
+        self.streaming_onset = False
+
+        # C-compiled onset functions in detect()
+        self.native_onset = False
+
+        # Directory of the on-disk cache of onset functions in detect()
+        self.onset_cache = None
+
         # Pick related parameters
         self.pick_threshold = 1.0
         self.picking_mode = "Gaussian"
@@ -450,6 +949,23 @@ class QuakeScan(DefaultQuakeScan):
         lut.load(lookup_table)
         self.lut = lut
 
+        # (LUT, first cell, decimation factor) of each grid searched in
+        # detect(), coarsest first, and the travel-time histogram of each --
+        # set in detect() if detect_levels is set
+        self._detect_grids = None
+        self._detect_hists = {}
+
+        # State of the streamed onset functions -- set in detect() if
+        # streaming_onset is True
+        self._onset_stream = None
+
+        # OnsetCache object -- set in detect() if onset_cache is set
+        self._onset_cache = None
+
+        # Floating point precision of the signal, onsets and coalescence --
+        # set in detect() and locate() from single_precision
+        self._dtype = np.float64
+
         if output_path is not None:
             self.output = qio.QuakeIO(output_path, run_name, log)
         else:
@@ -458,7 +974,7 @@ class QuakeScan(DefaultQuakeScan):
         # Define post-pad as a function of the maximum travel-time between a
         # station and a grid point plus the LTA (in case onset_centred is True)
         #  ---> applies to both detect() and locate()
-        ttmax = np.max(lut.fetch_map("TIME_S"))
+        ttmax = lut.max_traveltime("TIME_S")
         lta_max = max(self.p_onset_win[1], self.s_onset_win[1])
         self.post_pad = np.ceil(ttmax + 2 * lta_max)
 
@@ -500,6 +1016,17 @@ class QuakeScan(DefaultQuakeScan):
         out += "\n\tPicking mode\t\t:\t{}".format(self.picking_mode)
         out += "\n\tFraction ttime\t\t:\t{}".format(self.fraction_tt)
         out += "\n\n\tCentred onset\t\t:\t{}".format(self.onset_centred)
+        out += "\n\tSingle precision\t:\t{}".format(self.single_precision)
+        out += "\n\tBackend\t\t\t:\t{}".format(self.backend)
+        out += "\n\tPrune (threshold)\t:\t{} ({})".format(
+            self.prune, self.prune_threshold)
+        out += "\n\tDetect levels\t\t:\t{} ({})".format(
+            self.detect_levels, self.detect_level_threshold)
+        out += "\n\tCompact index\t\t:\t{}".format(self.compact_index)
+        out += "\n\tPersist index\t\t:\t{}".format(self.persist_index)
+        out += "\n\tStreaming onset\t\t:\t{}".format(self.streaming_onset)
+        out += "\n\tNative onset\t\t:\t{}".format(self.native_onset)
+        out += "\n\tOnset cache\t\t:\t{}".format(self.onset_cache)
         out += "\n\n\tNumber of CPUs\t\t:\t{}".format(self.n_cores)
 
         return out
@@ -527,13 +1054,54 @@ class QuakeScan(DefaultQuakeScan):
         start_time = UTCDateTime(start_time)
         end_time = UTCDateTime(end_time)
 
-        # Decimate LUT
-        self.lut = self.lut.decimate(self.decimate)
+        # Decimate LUT -- and set up the coarse grids, if any
+        if self.detect_levels:
+            self._detect_grids = [self._decimated_grid(ds)
+                                  for ds in self.detect_levels]
+            fine = self._decimated_grid(self.decimate)
+            self._detect_grids.append(fine)
+            self._detect_hists = {}
+            self.lut = fine[0]
+        else:
+            self.lut = self.lut.decimate(self.decimate)
 
         # Detect uses the non-centred onset by default
         if self.onset_centred is None:
             self.onset_centred = False
 
+        if self.streaming_onset and self.onset_centred:
+            msg = "Streaming onset functions require onset_centred = False."
+            raise ValueError(msg)
+
+        if self.native_onset and not ilib.available():
+            msg = "Native onset functions require the C-compiled library."
+            raise ValueError(msg)
+
+        if self.onset_cache is not None and self.streaming_onset:
+            msg = "The onset cache cannot be used with streaming onsets."
+            raise ValueError(msg)
+
+        # Detect is computed in single precision by default -- the default is
+        # resolved here so that a later locate() is not affected
+        if self.single_precision is None or self.single_precision:
+            self._dtype = np.float32
+        else:
+            self._dtype = np.float64
+
+        # Onset functions depend only on the archive they are read from, these
+        # parameters and the time window
+        if self.onset_cache is not None:
+            key = (str(self.data.archive_path.resolve()), self.data.format,
+                   str(self.data.station_file.resolve()),
+                   float(self.sampling_rate),
+                   tuple(float(x) for x in self.p_bp_filter),
+                   tuple(float(x) for x in self.s_bp_filter),
+                   tuple(float(x) for x in self.p_onset_win),
+                   tuple(float(x) for x in self.s_onset_win),
+                   bool(self.onset_centred), np.dtype(self._dtype).str,
+                   bool(self.data.resample), self.data.upfactor)
+            self._onset_cache = OnsetCache(self.onset_cache, key)
+
         # Define pre-pad as a function of the onset windows
         if self.pre_pad is None:
             self.pre_pad = max(self.p_onset_win[1],
@@ -619,6 +1187,9 @@ class QuakeScan(DefaultQuakeScan):
         if self.onset_centred is None:
             self.onset_centred = True
 
+        # Locate is computed in double precision by default
+        self._dtype = np.float32 if self.single_precision else np.float64
+
         self._locate_events(start_time, end_time)
 
     def _append_coastream(self, coastream, daten, max_coa, max_coa_norm, loc,
@@ -739,6 +1310,15 @@ class QuakeScan(DefaultQuakeScan):
         stn_ava_data = pd.DataFrame(index=np.arange(nsteps),
                                     columns=self.data.stations)
 
+        if self.streaming_onset:
+            self._onset_stream = {}
+        native = self.native_onset
+
+        # Streamed time steps are not detrended separately, and the native
+        # onset kernel detrends each channel itself
+        detrend = not self.streaming_onset and \
+            not (native and not self.onset_centred)
+
         for i in range(nsteps):
             timer = util.Stopwatch()
             w_beg = start_time + self.time_step * i - self.pre_pad
@@ -749,15 +1329,31 @@ class QuakeScan(DefaultQuakeScan):
             self.output.log(msg, self.log)
 
             try:
-                self.data.read_waveform_data(w_beg, w_end, self.sampling_rate)
-                daten, max_coa, max_coa_norm, loc, map_4d = self._compute(
-                                                          w_beg, w_end,
-                                                          self.data.signal,
-                                                          self.data.availability)
+                # Windows found in the onset cache are not read
+                onsets = None
+                if self._onset_cache is not None:
+                    nsamp = int(round((w_end - w_beg) * self.sampling_rate))
+                    nsamp += 1
+                    onsets = self._onset_cache.read(self.data.stations, w_beg,
+                                                    nsamp)
+                if onsets is None:
+                    self.data.read_waveform_data(
+                        w_beg, w_end, self.sampling_rate, dtype=self._dtype,
+                        detrend=detrend)
+                    signal = self.data.signal
+                else:
+                    signal = None
+                    self.data.availability = onsets[2]
+                daten, max_coa, max_coa_norm, loc, _ = self._compute(
+                                                     w_beg, w_end, signal,
+                                                     self.data.availability,
+                                                     return_map=False,
+                                                     native_onset=native,
+                                                     onsets=onsets)
                 stn_ava_data.loc[i] = self.data.availability
                 coord = self.lut.xyz2coord(loc)
 
-                del loc, map_4d
+                del loc
 
             except util.ArchiveEmptyException:
                 msg = "!" * 24 + " " * 16
@@ -766,6 +1362,7 @@ class QuakeScan(DefaultQuakeScan):
                 self.output.log(msg, self.log)
                 daten, max_coa, max_coa_norm, coord = self._empty(w_beg, w_end)
                 stn_ava_data.loc[i] = self.data.availability
+                self._reset_onset_stream()
 
             except util.DataGapException:
                 msg = "!" * 24 + " " * 9
@@ -777,6 +1374,7 @@ class QuakeScan(DefaultQuakeScan):
                 self.output.log(msg, self.log)
                 daten, max_coa, max_coa_norm, coord = self._empty(w_beg, w_end)
                 stn_ava_data.loc[i] = self.data.availability
+                self._reset_onset_stream()
 
             stn_ava_data.rename(index={i: str(w_beg + self.pre_pad)},
                                 inplace=True)
@@ -804,6 +1402,8 @@ class QuakeScan(DefaultQuakeScan):
         del coastream
 
         self.output.write_stn_availability(stn_ava_data)
+        self._onset_stream = None
+        self._onset_cache = None
 
         self.output.log("=" * 120, self.log)
 
@@ -1011,9 +1611,10 @@ class QuakeScan(DefaultQuakeScan):
                 post_pad = None
 
         self.data.read_waveform_data(w_beg, w_end, self.sampling_rate, pre_pad,
-                                     post_pad)
+                                     post_pad, dtype=self._dtype)
 
-    def _compute(self, w_beg, w_end, signal, station_availability):
+    def _compute(self, w_beg, w_end, signal, station_availability,
+                 return_map=True, native_onset=False, onsets=None):
         """
         Compute 3-D coalescence between two time stamps.
 
@@ -1027,11 +1628,27 @@ class QuakeScan(DefaultQuakeScan):
 
         signal : array-like
             Pre-processed continuous 3-component data stream for all available
-            stations -- linearly detrended, de-meaned, resampled if necessary
+            stations -- linearly detrended (unless the onset functions are
+            streamed), de-meaned, resampled if necessary
 
         station_availability : array-like
             List of available stations
 
+        return_map : bool, optional
+            If False, the coalescence is reduced to its maximum, location and
+            sum at each time sample as it is migrated, and the full 4-D
+            coalescence map is never allocated (used by detect()).
+
+        native_onset : bool, optional
+            Compute the onset functions with the C-compiled onset kernel,
+            straight into the array passed to the migration (see
+            _compute_native_onsets). The filtered signals are not kept.
+
+        onsets : tuple of array-like, optional
+            Onset functions read from the onset cache, as returned by
+            OnsetCache.read(); signal is not used if given. Otherwise, the
+            onset functions computed are written to the onset cache, if set.
+
         Returns
         -------
         daten : array-like
@@ -1047,31 +1664,49 @@ class QuakeScan(DefaultQuakeScan):
             Location of maximum coalescence through time
 
         map_4d : array-like
-            4-D coalescence map
+            4-D coalescence map (None if return_map is False)
 
         """
 
         avail_idx = np.where(station_availability == 1)[0]
-        sige = signal[0]
-        sign = signal[1]
-        sigz = signal[2]
-
-        p_onset_raw, p_onset = self._compute_p_onset(sigz,
-                                                     self.sampling_rate)
-        s_onset_raw, s_onset = self._compute_s_onset(sige, sign,
-                                                     self.sampling_rate)
+
+        ps_onset = None
+        if onsets is not None:
+            ps_onset, ps_onset_raw = onsets[0], onsets[1]
+            nstn = ps_onset.shape[0] // 2
+            p_onset, s_onset = ps_onset[:nstn], ps_onset[nstn:]
+            p_onset_raw, s_onset_raw = ps_onset_raw[:nstn], ps_onset_raw[nstn:]
+        elif self._onset_stream is not None:
+            p_onset_raw, p_onset, s_onset_raw, s_onset = \
+                self._stream_onsets(signal, station_availability)
+        elif native_onset and not self.onset_centred:
+            ps_onset, ps_onset_raw = self._compute_native_onsets(signal)
+            nstn = signal.shape[1]
+            p_onset, s_onset = ps_onset[:nstn], ps_onset[nstn:]
+            p_onset_raw, s_onset_raw = ps_onset_raw[:nstn], ps_onset_raw[nstn:]
+        else:
+            p_onset_raw, p_onset = self._compute_p_onset(signal[2],
+                                                         self.sampling_rate)
+            s_onset_raw, s_onset = self._compute_s_onset(signal[0], signal[1],
+                                                         self.sampling_rate)
         self.data.p_onset = p_onset
         self.data.s_onset = s_onset
         self.data.p_onset_raw = p_onset_raw
         self.data.s_onset_raw = s_onset_raw
 
-        ps_onset = np.concatenate((self.data.p_onset, self.data.s_onset))
+        if ps_onset is None:
+            ps_onset = np.concatenate((self.data.p_onset, self.data.s_onset))
+            ps_onset = ps_onset.astype(self._dtype, copy=False)
         ps_onset[np.isnan(ps_onset)] = 0
 
-        p_ttime = self.lut.fetch_index("TIME_P", self.sampling_rate)
-        s_ttime = self.lut.fetch_index("TIME_S", self.sampling_rate)
-        ttime = np.c_[p_ttime, s_ttime]
-        del p_ttime, s_ttime
+        if self._onset_cache is not None and onsets is None:
+            ps_onset_raw = np.concatenate((p_onset_raw, s_onset_raw))
+            self._onset_cache.write(self.data.stations, w_beg,
+                                    station_availability, ps_onset,
+                                    ps_onset_raw.astype(self._dtype,
+                                                        copy=False))
+
+        ttime = self._ttime(self.lut)
 
         nchan, tsamp = ps_onset.shape
 
@@ -1079,22 +1714,42 @@ class QuakeScan(DefaultQuakeScan):
         pos_smp = int(round(self.post_pad * int(self.sampling_rate)))
         nsamp = tsamp - pre_smp - pos_smp
 
-        # Prep empty 4-D coalescence map and run C-compiled ilib.migrate()
+        # Prep empty coa and loc arrays
         ncell = tuple(self.lut.cell_count)
-        map_4d = np.zeros(ncell + (nsamp,), dtype=np.float64)
-        ilib.migrate(ps_onset, ttime, pre_smp, pos_smp, nsamp, map_4d,
-                     self.n_cores)
-
-        # Prep empty coa and loc arrays and run C-compiled ilib.find_max_coa()
-        max_coa = np.zeros(nsamp, np.double)
+        max_coa = np.zeros(nsamp, ps_onset.dtype)
         grid_index = np.zeros(nsamp, np.int64)
-        ilib.find_max_coa(map_4d, max_coa, grid_index, 0, nsamp, self.n_cores)
+
+        backend = qback.get_backend(self.backend)
+
+        if return_map:
+            # Prep empty 4-D coalescence map and run backend.migrate() and
+            # backend.find_max_coa()
+            map_4d = np.zeros(ncell + (nsamp,), dtype=ps_onset.dtype)
+            backend.migrate(ps_onset, ttime, pre_smp, pos_smp, nsamp,
+                            map_4d, self.n_cores)
+            backend.find_max_coa(map_4d, max_coa, grid_index, 0, nsamp,
+                                 self.n_cores)
+            sum_coa = np.sum(map_4d, axis=(0, 1, 2))
+        else:
+            # Run backend.migrate_max_coa(), which reduces the coalescence
+            # on the fly without storing the 4-D map
+            map_4d = None
+            if self._detect_grids:
+                max_coa, grid_index, sum_coa, ncell = self._multilevel_max_coa(
+                    ps_onset, ttime, pre_smp, pos_smp, nsamp, len(avail_idx),
+                    backend)
+            else:
+                sum_coa = np.zeros(nsamp, np.double)
+                backend.migrate_max_coa(ps_onset, ttime, pre_smp, pos_smp,
+                                        nsamp, max_coa, grid_index, sum_coa,
+                                        self.n_cores, prune=self.prune,
+                                        threshold=self._raw_coa(
+                                            self.prune_threshold,
+                                            len(avail_idx)))
 
         # Get max_coa_norm
-        sum_coa = np.sum(map_4d, axis=(0, 1, 2))
         max_coa_norm = max_coa / sum_coa
-        max_coa_norm = max_coa_norm * map_4d.shape[0] * map_4d.shape[1] * \
-                       map_4d.shape[2]
+        max_coa_norm = max_coa_norm * ncell[0] * ncell[1] * ncell[2]
 
         tmp = np.arange(w_beg + self.pre_pad,
                         w_end - self.post_pad + (1 / self.sampling_rate),
@@ -1108,6 +1763,389 @@ class QuakeScan(DefaultQuakeScan):
 
         return daten, max_coa, max_coa_norm, loc, map_4d
 
+    def _decimated_grid(self, ds):
+        """
+        Decimate the (undecimated) LUT for the coarse-to-fine grid search.
+
+        Parameters
+        ----------
+        ds : array-like
+            Decimation factor in each dimension
+
+        Returns
+        -------
+        grid : tuple
+            (decimated LUT, index of its first cell in the undecimated grid,
+            decimation factor)
+
+        """
+
+        ds = np.array(ds, dtype=int)
+        cell_count = 1 + (self.lut.cell_count - 1) // ds
+        c1 = (self.lut.cell_count - ds * (cell_count - 1) - 1) // 2
+
+        return self.lut.decimate(ds), c1, ds
+
+    def _multilevel_max_coa(self, ps_onset, ttime, pre_smp, pos_smp, nsamp,
+                            n_avail, backend):
+        """
+        Coarse-to-fine search for the maximum coalescence at each time-step.
+        The coalescence is reduced over the whole of the coarsest grid. On
+        each finer grid in turn, the neighbourhoods of the maximum
+        coalescence cells of the level above are then re-migrated at the
+        candidate times: those evaluated on the level above where its maximum
+        coalescence exceeds detect_level_threshold, dilated by the change in
+        travel-time across one of its cells.
+
+        The maximum coalescence, its location and the sum of the coalescence
+        at each sample are all those of the finest level evaluated at that
+        sample. The sum over a finer grid is computed from the histogram of
+        its travel-times (see _grid_sum_coa), without migrating every cell.
+
+        Parameters
+        ----------
+        ps_onset : array-like
+            P and S onset functions
+
+        ttime : array-like or CompactIndex object
+            P and S travel-time indices for the finest grid (self.lut)
+
+        pre_smp : int
+            Number of samples of pre-pad
+
+        pos_smp : int
+            Number of samples of post-pad
+
+        nsamp : int
+            Number of samples to scan over
+
+        n_avail : int
+            Number of available stations
+
+        backend : module
+            Backend used to migrate the onset functions
+
+        Returns
+        -------
+        max_coa : array-like
+            Maximum (raw) coalescence, from the finest grid evaluated
+
+        grid_index : array-like
+            Index of the maximum coalescence cell in the finest grid
+
+        sum_coa : array-like
+            Sum of the coalescence over the finest grid evaluated, scaled to
+            the cell count of the finest grid (so that max_coa / sum_coa *
+            ncell is normalised by the mean over the grid evaluated)
+
+        ncell : array-like
+            Cell count of the finest grid
+
+        """
+
+        nchan, tsamp = ps_onset.shape
+        threshold = self._raw_coa(self.detect_level_threshold, n_avail)
+        ncell_fine = np.prod(self._detect_grids[-1][0].cell_count)
+
+        # Coarsest level: whole grid, all samples
+        lut, c1, ds = self._detect_grids[0]
+        tt = self._ttime(lut)
+        max_coa = np.zeros(nsamp, ps_onset.dtype)
+        grid_index = np.zeros(nsamp, np.int64)
+        sum_coa = np.zeros(nsamp, np.double)
+        backend.migrate_max_coa(ps_onset, tt, pre_smp, pos_smp, nsamp, max_coa,
+                                grid_index, sum_coa, self.n_cores,
+                                prune=self.prune,
+                                threshold=self._raw_coa(self.prune_threshold,
+                                                        n_avail))
+        sum_coa *= ncell_fine / np.prod(lut.cell_count)
+
+        # Position of the maximum in the undecimated grid
+        ijk = np.array(np.unravel_index(grid_index, lut.cell_count)).T * ds \
+            + c1
+
+        # Samples evaluated on the current level
+        evaluated = np.ones(nsamp, dtype=bool)
+
+        for level, (lut, c1, ds_f) in enumerate(self._detect_grids[1:], 1):
+            # Candidate times, dilated by the largest change in travel-time
+            # between neighbouring cells of the current level
+            if threshold is None:
+                cand = evaluated
+            else:
+                cand = evaluated & (max_coa >= threshold)
+                pad = self._level_pad(level - 1, tt)
+                cand = np.convolve(cand, np.ones(2 * pad + 1), "same") > 0
+                cand &= evaluated
+            edges = np.diff(np.r_[0, cand.astype(int), 0])
+            segments = list(zip(np.where(edges == 1)[0],
+                                np.where(edges == -1)[0]))
+
+            tt = ttime if lut is self.lut else self._ttime(lut)
+            cell_count = lut.cell_count
+
+            # Neighbourhood of one cell spacing of the level above about
+            # each maximum
+            r = np.ceil(ds / ds_f).astype(int)
+            offsets = np.stack(np.meshgrid(*[np.arange(-n, n + 1) for n in r],
+                                           indexing="ij"), -1).reshape(-1, 3)
+
+            for a, b in segments:
+                centres = np.unique(np.rint((ijk[a:b] - c1) / ds_f), axis=0)
+                cells = (centres[:, None, :] + offsets).reshape(-1, 3)
+                cells = np.clip(cells, 0, cell_count - 1).astype(int)
+                cells = np.unique(np.ravel_multi_index(cells.T, cell_count))
+
+                seg_max = np.zeros(b - a, ps_onset.dtype)
+                seg_index = np.zeros(b - a, np.int64)
+                seg_sum = np.zeros(b - a, np.double)
+                if isinstance(tt, np.ndarray):
+                    tt_cells = np.ascontiguousarray(
+                        tt.reshape(-1, nchan)[cells])
+                else:
+                    tt_cells = tt.take(cells)
+                backend.migrate_max_coa(ps_onset, tt_cells,
+                                        pre_smp + a, tsamp - pre_smp - b,
+                                        b - a, seg_max, seg_index, seg_sum,
+                                        self.n_cores)
+                max_coa[a:b] = seg_max
+                ijk[a:b] = np.array(np.unravel_index(cells[seg_index],
+                                                     cell_count)).T \
+                    * ds_f + c1
+                sum_coa[a:b] = self._grid_sum_coa(ps_onset, level, tt,
+                                                  pre_smp + a, b - a)
+                if lut is not self.lut:
+                    sum_coa[a:b] *= ncell_fine / np.prod(cell_count)
+
+            evaluated = cand
+            ds = ds_f
+
+        # Index of the maximum in the finest grid
+        lut, c1, ds = self._detect_grids[-1]
+        ijk = np.clip(np.rint((ijk - c1) / ds), 0, lut.cell_count - 1)
+        grid_index = np.ravel_multi_index(ijk.astype(int).T, lut.cell_count)
+
+        return max_coa, grid_index, sum_coa, lut.cell_count
+
+    def _level_hist(self, level, tt):
+        """
+        Histogram of the travel-time indices of a level of the coarse-to-fine
+        grid search from each station and phase, and the largest change in
+        travel-time between neighbouring cells. Memoised per level for the
+        duration of detect().
+
+        Returns
+        -------
+        hist : list of (int, array-like)
+            Smallest travel-time index and cell count per index, for each
+            column of tt
+
+        pad : int
+            Largest change in travel-time index between neighbouring cells
+
+        """
+
+        if level not in self._detect_hists:
+            if hasattr(tt, "expand"):
+                tt = tt.expand()
+            pad = max([np.abs(np.diff(tt, axis=i)).max(initial=0)
+                       for i in range(3)])
+            tt = np.maximum(tt.reshape(-1, tt.shape[-1]), 0)
+            hist = []
+            for col in tt.T:
+                t0 = col.min()
+                hist.append((t0, np.bincount(col - t0).astype(np.double)))
+            self._detect_hists[level] = (hist, int(pad))
+
+        return self._detect_hists[level]
+
+    def _level_pad(self, level, tt):
+        """Largest change in travel-time between neighbouring cells"""
+
+        return self._level_hist(level, tt)[1]
+
+    def _grid_sum_coa(self, ps_onset, level, tt, fsmp, nsamp):
+        """
+        Sum of the coalescence over all cells of a level of the coarse-to-fine
+        grid search, from the histogram of its travel-times: the onset
+        function of each station and phase is correlated with the number of
+        cells at each travel-time.
+
+        Parameters
+        ----------
+        ps_onset : array-like
+            P and S onset functions
+
+        level : int
+            Level of the grid search
+
+        tt : array-like, CompactIndex or AnalyticIndex object
+            P and S travel-time indices of the level
+
+        fsmp : int
+            First sample to compute the sum for
+
+        nsamp : int
+            Number of samples to compute the sum for
+
+        Returns
+        -------
+        sum_coa : array-like
+            Sum of the coalescence over the grid at each sample
+
+        """
+
+        hist, _ = self._level_hist(level, tt)
+        sum_coa = np.zeros(nsamp, np.double)
+        for onset, (t0, counts) in zip(ps_onset, hist):
+            seg = onset[fsmp + t0:fsmp + t0 + len(counts) - 1 + nsamp]
+            sum_coa += np.correlate(seg.astype(np.double), counts, "valid")
+
+        return sum_coa
+
+    def _ttime(self, lut):
+        """
+        Combined P and S travel-time index table for a LUT at the sampling
+        rate of the scan -- as a CompactIndex object if compact_index is set.
+        The table is memoised on the LUT.
+
+        """
+
+        return lut.fetch_ps_index(self.sampling_rate,
+                                  compact=self.compact_index,
+                                  persist=self.persist_index)
+
+    @staticmethod
+    def _raw_coa(coa, n_avail):
+        """
+        Convert a coalescence value (on the scale output to the .scanmseed
+        file) to raw coalescence (see _compute). Returns None if coa is None.
+
+        """
+
+        if coa is None:
+            return None
+
+        return (np.log(coa) + 1.0) * n_avail * 2
+
+    def _compute_native_onsets(self, signal):
+        """
+        Generates the P- and S-phase onset functions with the C-compiled onset
+        kernel (see QMigratelib.onset), written straight into a single array
+        with the P onsets of all stations followed by the S onsets. Each
+        channel is linearly detrended by the kernel.
+
+        Parameters
+        ----------
+        signal : array-like
+            Continuous 3-component data stream for all available stations,
+            read without detrending (see Archive.read_waveform_data)
+
+        Returns
+        -------
+        ps_onset : array-like
+            Log-clipped P and S onset functions, shape (2 * nstation, nsamp)
+
+        ps_onset_raw : array-like
+            Raw STA/LTA P and S onset functions, shape (2 * nstation, nsamp)
+
+        """
+
+        signal = np.ascontiguousarray(signal, dtype=self._dtype)
+        _, nstn, nsamp = signal.shape
+        ps_onset = np.empty((2 * nstn, nsamp), dtype=self._dtype)
+        ps_onset_raw = np.empty_like(ps_onset)
+
+        # Z for the P onsets; E and N combined for the S onsets
+        phases = [(signal[2], self.p_bp_filter, self.p_onset_win, 0),
+                  (signal[:2], self.s_bp_filter, self.s_onset_win, nstn)]
+        for sig, (lc, hc, ord_), (stw, ltw), row in phases:
+            stw = int(stw * self.sampling_rate) + 1
+            ltw = int(ltw * self.sampling_rate) + 1
+            ilib.onset(sig, _bandpass_sos(self.sampling_rate, lc, hc, ord_),
+                       _taper(nsamp, 0.1), stw, ltw,
+                       ps_onset[row:row + nstn],
+                       ps_onset_raw[row:row + nstn], self.n_cores,
+                       detrend=True)
+
+        return ps_onset, ps_onset_raw
+
+    def _reset_onset_stream(self):
+        """
+        Start the streamed onset functions afresh at the next time step (e.g.
+        after a time step with no usable data).
+
+        """
+
+        if self._onset_stream is not None:
+            self._onset_stream.clear()
+
+    def _stream_onsets(self, signal, station_availability):
+        """
+        Generates the P- and S-phase onset functions of a detect() time step
+        from the streamed onset functions (see StreamingOnset).
+
+        Consecutive time steps overlap by all but time_step of their samples,
+        so only the final time_step of samples is new: its onset functions
+        are computed, continuing the stream, and appended to the onset
+        functions of the overlap, kept from the previous time step. The time
+        steps are read without detrending (see read_waveform_data), so the
+        new samples continue those already streamed. The stream is restarted
+        if the stations or window length change.
+
+        Parameters
+        ----------
+        signal : array-like
+            Pre-processed continuous 3-component data stream for all
+            available stations
+
+        station_availability : array-like
+            List of available stations
+
+        Returns
+        -------
+        p_onset_raw, p_onset, s_onset_raw, s_onset : array-like
+            Onset functions, as returned by _compute_p_onset() and
+            _compute_s_onset()
+
+        """
+
+        stream = self._onset_stream
+        nsamp = signal.shape[-1]
+        step = int(round(self.time_step * self.sampling_rate))
+        overlap = nsamp - step
+
+        if stream.get("shape") != signal.shape or overlap <= 1 or \
+           not np.array_equal(stream["availability"], station_availability):
+            stream["ops"] = [
+                StreamingOnset(self.sampling_rate, self.s_bp_filter,
+                               self.s_onset_win),
+                StreamingOnset(self.sampling_rate, self.s_bp_filter,
+                               self.s_onset_win),
+                StreamingOnset(self.sampling_rate, self.p_bp_filter,
+                               self.p_onset_win)]
+            stream["onsets"] = None
+            new = signal
+        else:
+            new = signal[..., overlap:]
+
+        stream["shape"] = signal.shape
+        stream["availability"] = np.copy(station_availability)
+
+        # Onset functions of the new samples (E, N, Z)
+        (e_raw, e_onset), (n_raw, n_onset), (p_onset_raw, p_onset) = \
+            [op(sig) for op, sig in zip(stream["ops"], new)]
+        s_onset_raw = np.sqrt((e_raw ** 2 + n_raw ** 2) / 2.)
+        s_onset = np.sqrt((e_onset ** 2 + n_onset ** 2) / 2.)
+        onsets = [p_onset_raw, p_onset, s_onset_raw, s_onset]
+
+        if stream["onsets"] is not None:
+            onsets = [np.concatenate((prev_onset[..., step:], onset), axis=-1)
+                      for prev_onset, onset in zip(stream["onsets"], onsets)]
+        stream["onsets"] = onsets
+
+        return onsets
+
     def _compute_p_onset(self, sig_z, sampling_rate):
         """
         Generates an onset (characteristic) function for the P-phase from the
@@ -1192,8 +2230,17 @@ class QuakeScan(DefaultQuakeScan):
         self.onset_data["sige"] = s_e_onset
         self.onset_data["sign"] = s_n_onset
 
-        s_onset = np.sqrt((s_e_onset ** 2 + s_n_onset ** 2) / 2.)
-        s_onset_raw = np.sqrt((s_e_onset_raw ** 2 + s_n_onset_raw ** 2) / 2.)
+        # Combine the onset functions of the two components in place: the raw
+        # onsets are not kept, so their buffers are reused
+        s_onset_raw = np.square(s_e_onset_raw, out=s_e_onset_raw)
+        s_onset_raw += np.square(s_n_onset_raw, out=s_n_onset_raw)
+        s_onset_raw /= 2.
+        np.sqrt(s_onset_raw, out=s_onset_raw)
+
+        s_onset = np.square(s_e_onset)
+        s_onset += np.square(s_n_onset, out=s_n_onset_raw)
+        s_onset /= 2.
+        np.sqrt(s_onset, out=s_onset)
         self.onset_data["sigs"] = s_onset
 
         return s_onset_raw, s_onset
@@ -1456,8 +2503,9 @@ class QuakeScan(DefaultQuakeScan):
         event_xyz = np.array(self.lut.xyz2coord(event_crd,
                                                 inverse=True)).astype(int)[0]
 
-        p_ttime = self.lut.value_at("TIME_P", event_xyz)[0]
-        s_ttime = self.lut.value_at("TIME_S", event_xyz)[0]
+        ttime = self.lut.values_at(event_xyz, maps=["TIME_P", "TIME_S"])
+        p_ttime = ttime["TIME_P"][0]
+        s_ttime = ttime["TIME_S"][0]
 
         # Determining the stations that can be picked on and the phases
         picks = pd.DataFrame(index=np.arange(0, 2 * len(self.data.p_onset)),
@@ -1957,8 +3005,10 @@ class QuakeScan(DefaultQuakeScan):
 
         """
 
-        # MARGINALISE: Determining the 3-D coalescence map
-        self.coa_map = np.log(np.sum(np.exp(map_4d), axis=-1))
+        # MARGINALISE: Determining the 3-D coalescence map (always in double
+        # precision, as exp() of a single precision map overflows easily)
+        self.coa_map = np.log(np.sum(np.exp(map_4d, dtype=np.float64),
+                                     axis=-1))
 
         # Normalise
         self.coa_map = self.coa_map/np.max(self.coa_map)
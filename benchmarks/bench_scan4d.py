@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the C-compiled migration kernels: scan4d against the
+cache-blocked scan4d_tiled (QMigratelib.migrate(..., tiled=True)).
+
+Onset functions are random; travel times are those of a homogeneous medium
+(5 km/s P-wave velocity, Vp/Vs = 1.73) from stations scattered over the top
+of the grid, so the migration reads the onset functions with realistic
+offsets. Throughput is reported as cells x channels x samples per second
+(best of --repeat runs); the output of the two kernels is also checked to be
+identical.
+
+Usage:
+
+    python benchmarks/bench_scan4d.py [--threads N] [--repeat N]
+                                      [--precision {float64,float32}]
+                                      [--case NX NY NZ NSTATION NSAMP ...]
+
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import QMigrate.core.QMigratelib as ilib
+
+# (nx, ny, nz, stations, samples per time step) -- typical detect() grids
+# and time steps (e.g. 120 s at 50 Hz is 6000 samples)
+CASES = [(40, 40, 20, 30, 3000),
+         (60, 60, 30, 60, 1500),
+         (20, 20, 10, 40, 6000),
+         (15, 15, 10, 40, 30000),
+         (30, 30, 15, 20, 12000)]
+
+SAMPLING_RATE = 50.
+CELL_SIZE = 0.5
+VP, VPVS = 5.0, 1.73
+
+
+def _case(nx, ny, nz, nstn, nsamp, dtype, rng):
+    """
+    Return onset functions, travel-time index table and pads for one case.
+
+    """
+
+    stn = rng.uniform(0, [nx * CELL_SIZE, ny * CELL_SIZE, 0], (nstn, 3))
+    cells = np.stack(np.meshgrid(*[np.arange(n) * CELL_SIZE
+                                   for n in (nx, ny, nz)], indexing="ij"), -1)
+    dist = np.linalg.norm(cells[..., None, :] - stn, axis=-1)
+    ttp = np.rint(SAMPLING_RATE * dist / VP).astype(np.int32)
+    tts = np.rint(SAMPLING_RATE * dist * VPVS / VP).astype(np.int32)
+    tt = np.ascontiguousarray(np.concatenate((ttp, tts), axis=-1))
+
+    pre, post = 100, int(tt.max()) + 1
+    sig = rng.random((2 * nstn, pre + nsamp + post)).astype(dtype)
+
+    return sig, tt, pre, post
+
+
+def _time(sig, tt, pre, post, nsamp, threads, tiled, repeat):
+    """
+    Return the best run time and the coalescence map of one kernel.
+
+    """
+
+    best = np.inf
+    for _ in range(repeat):
+        map4d = np.zeros(tt.shape[:-1] + (nsamp,), dtype=sig.dtype)
+        t0 = time.perf_counter()
+        ilib.migrate(sig, tt, pre, post, nsamp, map4d, threads, tiled=tiled)
+        best = min(best, time.perf_counter() - t0)
+
+    return best, map4d
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--precision", default="float64",
+                        choices=["float64", "float32"])
+    parser.add_argument("--case", type=int, nargs=5, action="append",
+                        metavar=("NX", "NY", "NZ", "NSTATION", "NSAMP"))
+    args = parser.parse_args(args)
+
+    rng = np.random.default_rng(0)
+    dtype = np.dtype(args.precision)
+
+    print("C-library variant: {}, threads: {}, precision: {}".format(
+        ilib.kernel_variant(), args.threads, dtype))
+    print("{:>12}  {:>8}  {:>6}  {:>12}  {:>12}  {:>7}".format(
+        "grid", "channels", "nsamp", "scan4d", "scan4d_tiled", "speedup"))
+
+    for nx, ny, nz, nstn, nsamp in args.case or CASES:
+        sig, tt, pre, post = _case(nx, ny, nz, nstn, nsamp, dtype, rng)
+        work = nx * ny * nz * 2 * nstn * nsamp
+        t_ref, ref = _time(sig, tt, pre, post, nsamp, args.threads, False,
+                           args.repeat)
+        t_til, til = _time(sig, tt, pre, post, nsamp, args.threads, True,
+                           args.repeat)
+        if not np.array_equal(ref, til):
+            raise RuntimeError("scan4d and scan4d_tiled outputs differ")
+        del ref, til
+
+        print("{:>12}  {:>8}  {:>6}  {:>12.3e}  {:>12.3e}  {:>7.2f}".format(
+            "{}x{}x{}".format(nx, ny, nz), 2 * nstn, nsamp, work / t_ref,
+            work / t_til, t_ref / t_til))
+
+
+if __name__ == "__main__":
+    main()
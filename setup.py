@@ -10,6 +10,7 @@ import inspect
 import os
 import re
 from setuptools import setup
+import subprocess
 import sys
 import time
 
@@ -50,11 +51,54 @@ INSTALL_REQUIRES = [
     'pyzmq',
     'msgpack-python']
 
+EXTRAS_REQUIRE = {
+    'numba': ['numba']}
+
+# Variants of the C-library to build: (library suffix, compiler flags). The
+# portable build is always required; the instruction-set specific builds are
+# optional and skipped if the compiler / platform does not support them.
+# QMigrate.core.QMigratelib loads the best variant the running CPU supports.
+# NOTE: -ffast-math is deliberately not used, and floating point contraction
+# (FMA) is disabled, so all variants give identical results.
+C_LIB_VARIANTS = [
+    ("", ["-O2"]),
+    ("_sse42", ["-O3", "-msse4.2"]),
+    ("_avx2", ["-O3", "-mavx2", "-mfma"]),
+    ("_avx512", ["-O3", "-mavx512f", "-mavx512dq", "-mavx2", "-mfma"])]
+
+
+def build_c_library():
+    """
+    Compile the portable and instruction-set specific variants of the
+    C-library with OpenMP. If the C-library cannot be compiled, QuakeMigrate
+    falls back to the numba or numpy backends (see QMigrate.core.backends).
+
+    """
+
+    src = os.path.join(SETUP_DIRECTORY, "QMigrate", "lib", "src", "QMigrate.c")
+    for suffix, flags in C_LIB_VARIANTS:
+        lib = os.path.join(SETUP_DIRECTORY, "QMigrate", "lib",
+                           "QMigrate{}.so".format(suffix))
+        cmd = ["gcc", "-shared", "-fPIC", "-std=gnu99", src, "-fopenmp",
+               "-ffp-contract=off"] + flags + ["-o", lib, "-lm"]
+        try:
+            status = subprocess.call(cmd)
+        except OSError:
+            status = -1
+        if status != 0:
+            if not suffix:
+                print("Unable to compile the QMigrate C-library - the C "
+                      "backend will be unavailable")
+                return
+            msg = "Skipping QMigrate{}.so: not supported by compiler/platform"
+            print(msg.format(suffix))
+
+
 # Check if we are on RTD and don't build extensions if we are.
 READ_THE_DOCS = os.environ.get('READTHEDOCS', None) == 'True'
 if not READ_THE_DOCS:
     # Compile stage for C-library
-    os.system('gcc -shared -fPIC -std=gnu99 ./QMigrate/lib/src/QMigrate.c -fopenmp -O0 -o ./QMigrate/lib/QMigrate.so')
+    build_c_library()
 
 
 def read(*parts):
@@ -111,6 +155,7 @@ def setup_package():
         packages=find_packages(),
         zip_safe=False,
         install_requires=INSTALL_REQUIRES,
+        extras_require=EXTRAS_REQUIRE,
         include_package_data=True,
         include_dirs=INCLUDE_DIRS,
         package_data={"QMigrate": ["lib/*.so"]})
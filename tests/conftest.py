@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests: a small look-up table and waveform archive
+built from the icequake example (examples/icequakes), and factories for
+Archive objects that read it and QuakeScan objects that scan them.
+
+"""
+
+import pathlib
+
+import pytest
+
+import QMigrate.core.model as qmod
+import QMigrate.io.data as qdata
+import QMigrate.io.quakeio as qio
+import QMigrate.signal.scan as qscan
+
+EXAMPLE = pathlib.Path(__file__).parents[1] / "examples" / "icequakes" \
+    / "inputs"
+
+
+@pytest.fixture(scope="session")
+def icequake_lut(tmp_path_factory):
+    """Path to a coarse homogeneous look-up table for the icequake example."""
+
+    stations = qio.stations(str(EXAMPLE / "stations.txt"))
+    lut = qmod.LUT(stations, cell_count=[11, 11, 31], cell_size=[200, 200, 100])
+    lut.lonlat_centre(-17.224, 64.328)
+    lut.lcc_standard_parallels = (64.32, 64.335)
+    lut.projections(grid_proj_type="LCC")
+    lut.elevation = 1400
+    lut.compute_homogeneous_vmodel(3630, 1833)
+
+    path = tmp_path_factory.mktemp("lut") / "icequake.LUT"
+    lut.save(str(path))
+
+    return str(path)
+
+
+@pytest.fixture
+def icequake_archive():
+    """Factory for Archive objects over the icequake example archive."""
+
+    def make(**kwargs):
+        data = qdata.Archive(station_file=str(EXAMPLE / "stations.txt"),
+                             archive_path=str(EXAMPLE / "mSEED"))
+        data.path_structure(archive_format="YEAR/JD/*_STATION_*")
+        for key, value in kwargs.items():
+            setattr(data, key, value)
+
+        return data
+
+    return make
+
+
+@pytest.fixture
+def icequake_scan(icequake_archive, icequake_lut, tmp_path):
+    """Factory for QuakeScan objects over the icequake example archive."""
+
+    def make(run_name="run", **kwargs):
+        data = icequake_archive()
+        scan = qscan.QuakeScan(data, icequake_lut, output_path=str(tmp_path),
+                               run_name=run_name)
+        scan.sampling_rate = 500
+        scan.p_bp_filter = [10, 125, 4]
+        scan.s_bp_filter = [10, 125, 4]
+        scan.p_onset_win = [0.01, 0.25]
+        scan.s_onset_win = [0.05, 0.5]
+        scan.time_step = 0.75
+        scan.n_cores = 1
+        for key, value in kwargs.items():
+            setattr(scan, key, value)
+
+        return scan
+
+    return make
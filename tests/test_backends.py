@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Parity tests for the migration backends (see QMigrate.core.backends): every
+available backend must reproduce the output of the C-compiled kernels on
+random onset functions and travel-time index tables, in double and single
+precision.
+
+"""
+
+import numpy as np
+import pytest
+
+import QMigrate.core.backends as qback
+import QMigrate.core.model as qmod
+
+if "c" not in qback.available_backends():
+    pytest.skip("the C-compiled backend is unavailable",
+                allow_module_level=True)
+
+C = qback.get_backend("c")
+OTHERS = [b for b in qback.available_backends() if b != "c"]
+DTYPES = [np.float64, np.float32]
+
+NSTN = 6
+SHAPE = (9, 7, 5)
+PRE, POST, NSAMP = 20, 40, 150
+
+
+def _inputs(dtype, seed=0):
+    """Random onset functions and travel-time index table."""
+
+    rng = np.random.default_rng(seed)
+    sig = rng.random((2 * NSTN, PRE + NSAMP + POST)).astype(dtype)
+    tt = rng.integers(-2, POST, SHAPE + (2 * NSTN,)).astype(np.int32)
+    return sig, tt
+
+
+def _analytic(monkeypatch):
+    """
+    Travel-time index table of a homogeneous model, which may not be
+    expanded into the full table.
+
+    """
+
+    rng = np.random.default_rng(1)
+    geometry = np.r_[[[0., 0., 0.]], np.diag([150., 200., 100.])]
+    stations = rng.uniform(0, 1000, (2 * NSTN, 3))
+    velocity = np.r_[[3000.] * NSTN, [1700.] * NSTN]
+    tt = qmod.AnalyticIndex(geometry, stations, velocity, 20., SHAPE)
+
+    def expand(self):
+        raise AssertionError("the full index table was built")
+    monkeypatch.setattr(qmod.AnalyticIndex, "expand", expand)
+
+    return tt
+
+
+def _migrate_max_coa(backend, sig, tt, **kwargs):
+    max_coa = np.zeros(NSAMP, dtype=sig.dtype)
+    grid_index = np.zeros(NSAMP, dtype=np.int64)
+    sum_coa = np.zeros(NSAMP, dtype=np.float64)
+    qback.get_backend(backend).migrate_max_coa(sig, tt, PRE, POST, NSAMP,
+                                               max_coa, grid_index, sum_coa,
+                                               2, **kwargs)
+    return max_coa, grid_index, sum_coa
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("backend", OTHERS)
+def test_migrate(backend, dtype):
+    sig, tt = _inputs(dtype)
+    ref = np.zeros(SHAPE + (NSAMP,), dtype=dtype)
+    C.migrate(sig, tt, PRE, POST, NSAMP, ref, 2)
+
+    map4d = np.zeros_like(ref)
+    qback.get_backend(backend).migrate(sig, tt, PRE, POST, NSAMP, map4d, 2)
+
+    np.testing.assert_array_equal(map4d, ref)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("backend", OTHERS)
+def test_find_max_coa(backend, dtype):
+    sig, tt = _inputs(dtype)
+    map4d = np.zeros(SHAPE + (NSAMP,), dtype=dtype)
+    C.migrate(sig, tt, PRE, POST, NSAMP, map4d, 2)
+    # Ties, which must go to the lowest cell index
+    map4d[3, 2, 1, :10] = map4d[8, 6, 4, :10] = map4d.max() + 1
+
+    ref_coa = np.zeros(NSAMP, dtype=dtype)
+    ref_index = np.zeros(NSAMP, dtype=np.int64)
+    C.find_max_coa(map4d, ref_coa, ref_index, 0, NSAMP, 2)
+
+    max_coa = np.zeros(NSAMP, dtype=dtype)
+    grid_index = np.zeros(NSAMP, dtype=np.int64)
+    qback.get_backend(backend).find_max_coa(map4d, max_coa, grid_index, 0,
+                                            NSAMP, 2)
+
+    np.testing.assert_array_equal(max_coa, ref_coa)
+    np.testing.assert_array_equal(grid_index, ref_index)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("backend", OTHERS)
+def test_migrate_max_coa(backend, dtype):
+    sig, tt = _inputs(dtype)
+    ref = _migrate_max_coa("c", sig, tt)
+    out = _migrate_max_coa(backend, sig, tt)
+
+    np.testing.assert_array_equal(out[0], ref[0])
+    np.testing.assert_array_equal(out[1], ref[1])
+    np.testing.assert_allclose(out[2], ref[2], rtol=1e-5)
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+@pytest.mark.parametrize("threshold", [None, 4.0])
+@pytest.mark.parametrize("backend", OTHERS)
+def test_migrate_max_coa_pruned(backend, dtype, threshold):
+    sig, tt = _inputs(dtype)
+    # Low-amplitude noise with a few strong arrivals, so blocks are pruned
+    sig *= 0.1
+    sig[:, PRE + 60:PRE + 70] += 1
+
+    # The numpy backend ignores prune, and so threshold
+    ref = _migrate_max_coa("c", sig, tt, prune=backend != "numpy",
+                           threshold=threshold)
+    out = _migrate_max_coa(backend, sig, tt, prune=True, threshold=threshold)
+
+    np.testing.assert_array_equal(out[0], ref[0])
+    np.testing.assert_array_equal(out[1], ref[1])
+    np.testing.assert_allclose(out[2], ref[2], rtol=1e-5)
+
+    if threshold is None:
+        full = _migrate_max_coa("c", sig, tt)
+        np.testing.assert_array_equal(out[0], full[0])
+        np.testing.assert_array_equal(out[1], full[1])
+
+
+@pytest.mark.parametrize("backend", OTHERS)
+def test_precision_mismatch(backend):
+    sig, tt = _inputs(np.float64)
+    map4d = np.zeros(SHAPE + (NSAMP,), dtype=np.float32)
+    with pytest.raises(ValueError):
+        qback.get_backend(backend).migrate(sig, tt, PRE, POST, NSAMP, map4d,
+                                           1)
+
+
+@pytest.mark.parametrize("backend", OTHERS)
+def test_analytic_index(backend, monkeypatch):
+    sig, _ = _inputs(np.float64)
+    tt = _analytic(monkeypatch)
+    # Several chunks of cells
+    monkeypatch.setattr(qback.get_backend(backend), "CELL_CHUNK", 64)
+
+    ref = np.zeros(SHAPE + (NSAMP,))
+    C.migrate(sig, tt, PRE, POST, NSAMP, ref, 2)
+    map4d = np.zeros_like(ref)
+    qback.get_backend(backend).migrate(sig, tt, PRE, POST, NSAMP, map4d, 2)
+    np.testing.assert_array_equal(map4d, ref)
+
+    ref = _migrate_max_coa("c", sig, tt)
+    out = _migrate_max_coa(backend, sig, tt, prune=True)
+    np.testing.assert_array_equal(out[0], ref[0])
+    np.testing.assert_array_equal(out[1], ref[1])
+    np.testing.assert_allclose(out[2], ref[2], rtol=1e-5)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of reading waveform data from the icequake example archive with the
+raw data carried over between overlapping periods (see Archive.carry_over).
+
+"""
+
+import numpy as np
+import pytest
+from obspy import UTCDateTime
+
+
+@pytest.mark.parametrize("sampling_rate, upfactor", [(500, None),
+                                                     (250, None),
+                                                     (200, 2)])
+@pytest.mark.parametrize("detrend", [True, False])
+def test_carry_over_matches_full_read(icequake_archive, sampling_rate,
+                                      upfactor, detrend):
+    # Overlapping periods, as read by consecutive detect() time steps
+    start = UTCDateTime("2014-06-29T18:41:55.0")
+    periods = [(start + 0.75 * i, start + 0.75 * i + 3.1) for i in range(4)]
+
+    resample = upfactor is not None
+    ref = icequake_archive(resample=resample, upfactor=upfactor)
+    out = icequake_archive(resample=resample, upfactor=upfactor,
+                           carry_over=True)
+    for w_beg, w_end in periods:
+        for data in (ref, out):
+            data.read_waveform_data(w_beg, w_end, sampling_rate,
+                                    detrend=detrend)
+
+        # The carried raw data is detrended and resampled over each period
+        # as a whole, so the output is that of reading the period afresh
+        assert out.signal.dtype == ref.signal.dtype
+        np.testing.assert_array_equal(out.signal, ref.signal)
+        np.testing.assert_array_equal(out.availability, ref.availability)
+        assert len(out.raw_waveforms) == len(ref.raw_waveforms)
+        for tr_out, tr_ref in zip(sorted(out.raw_waveforms, key=str),
+                                  sorted(ref.raw_waveforms, key=str)):
+            assert tr_out.stats.starttime == tr_ref.stats.starttime
+            np.testing.assert_array_equal(tr_out.data, tr_ref.data)
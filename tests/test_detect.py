@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of detect() on the icequake example: the coarse-to-fine grid search
+(detect_levels) against a single-level scan of the finest grid, pruned
+against unpruned scans on each backend, the onset cache, and the raw data
+carried over between time steps.
+
+"""
+
+import shutil
+
+import numpy as np
+import pytest
+from obspy import read
+
+import QMigrate.core.backends as qback
+
+START, END = "2014-06-29T18:41:55.0", "2014-06-29T18:42:10.0"
+
+
+def _detect(scan, start=START, end=END):
+    """Run detect() and return the .scanmseed channels, unscaled."""
+
+    scan.detect(start, end)
+    st = read(str(scan.output.run / "*.scanmseed"))
+    factor = {"COA": 1e5, "COA_N": 1e5, "X": 1e6, "Y": 1e6, "Z": 1e3}
+    return {tr.stats.station: tr.data / factor[tr.stats.station]
+            for tr in st}
+
+
+@pytest.mark.parametrize("threshold", [None, 1.1])
+def test_multilevel_matches_finest(icequake_scan, threshold):
+    ref = _detect(icequake_scan("single"))
+    out = _detect(icequake_scan("multi", detect_levels=[[2, 2, 3]],
+                                detect_level_threshold=threshold))
+
+    # The finest grid contains the cells of every coarser level, so the
+    # maximum coalescence found can only be lower than that of the full scan
+    assert np.all(out["COA"] <= ref["COA"])
+
+    # Wherever the coarse-to-fine search refines to the same cell as the
+    # full scan, all channels -- including COA_N, normalised by the mean
+    # over the finest grid -- match
+    same = (out["COA"] == ref["COA"]) & (out["X"] == ref["X"]) \
+        & (out["Y"] == ref["Y"]) & (out["Z"] == ref["Z"])
+    if threshold is None:
+        assert same.mean() > 0.9
+    else:
+        same &= ref["COA"] >= threshold
+        assert same.sum() > 0
+    np.testing.assert_allclose(out["COA_N"][same], ref["COA_N"][same],
+                               rtol=1e-4, atol=1e-5)
+
+    # The event is found at the same time and place
+    peak = np.argmax(ref["COA"])
+    assert np.argmax(out["COA"]) == peak
+    for chan in ref:
+        assert out[chan][peak] == pytest.approx(ref[chan][peak], rel=1e-4)
+
+
+def test_onset_cache_keyed_by_archive(icequake_scan, tmp_path):
+    cache = tmp_path / "onsets"
+    archive = tmp_path / "archive"
+    shutil.copytree(str(icequake_scan().data.archive_path), str(archive))
+
+    scans = [icequake_scan("a", onset_cache=str(cache)),
+             icequake_scan("b", onset_cache=str(cache))]
+    scans[1].data.archive_path = archive
+    for scan in scans:
+        scan.detect(START, "2014-06-29T18:41:57.0")
+
+    # The same waveforms read from another archive are not taken from the
+    # cache of the first
+    assert len(list(cache.iterdir())) == 2
+
+
+@pytest.mark.parametrize("backend", qback.available_backends())
+def test_prune_matches_unpruned(icequake_scan, backend):
+    # Pruning only skips cells that cannot hold the maximum coalescence, on
+    # every backend (the numpy backend ignores it)
+    window = ("2014-06-29T18:42:06.0", "2014-06-29T18:42:10.0")
+    ref = _detect(icequake_scan("ref", backend=backend), *window)
+    out = _detect(icequake_scan("pruned", backend=backend, prune=True),
+                  *window)
+
+    for chan in ("COA", "X", "Y", "Z"):
+        np.testing.assert_array_equal(out[chan], ref[chan])
+    np.testing.assert_allclose(out["COA_N"], ref["COA_N"], rtol=1e-4)
+
+
+def test_carry_over_matches_full_read(icequake_scan):
+    window = ("2014-06-29T18:42:06.0", "2014-06-29T18:42:10.0")
+    ref = _detect(icequake_scan("ref"), *window)
+    scan = icequake_scan("carry")
+    scan.data.carry_over = True
+    out = _detect(scan, *window)
+
+    for chan in ref:
+        np.testing.assert_array_equal(out[chan], ref[chan])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the travel-time index tables persisted next to a LUT file (see
+LUT.fetch_ps_index).
+
+"""
+
+import glob
+import os
+import struct
+
+import numpy as np
+
+import QMigrate.core.model as qmod
+
+
+def _loaded(path):
+    lut = qmod.LUT()
+    lut.load(path)
+    return lut
+
+
+def test_persisted_index_tracks_maps(icequake_lut):
+    ref = _loaded(icequake_lut).fetch_ps_index(500, persist=True)
+    np.testing.assert_array_equal(
+        _loaded(icequake_lut).fetch_ps_index(500, persist=True), ref)
+
+    # A different Vp/Vs ratio must not reuse the persisted table
+    lut = _loaded(icequake_lut)
+    lut.set_vpvs(2.0)
+    ttime = lut.fetch_ps_index(500, persist=True)
+    nstn = ref.shape[-1] // 2
+    np.testing.assert_array_equal(ttime[..., :nstn], ref[..., :nstn])
+    np.testing.assert_array_equal(
+        ttime[..., nstn:],
+        np.rint(500 * 2.0 * lut.maps["TIME_P"]).astype(np.int32))
+
+    # Nor must replaced travel-time tables, which are not persisted
+    lut = _loaded(icequake_lut)
+    lut.maps = {k: v * 2 for k, v in lut.maps.items()}
+    files = glob.glob(icequake_lut + ".*.idx.npy")
+    ttime = lut.fetch_ps_index(500, persist=True)
+    np.testing.assert_array_equal(
+        ttime, np.rint(500 * np.c_[lut.maps["TIME_P"],
+                                   lut.maps["TIME_S"]]).astype(np.int32))
+    assert glob.glob(icequake_lut + ".*.idx.npy") == files
+
+
+def test_persisted_index_native_load_is_lazy(icequake_lut, tmp_path):
+    path = str(tmp_path / "icequake.qmlut")
+    _loaded(icequake_lut).save(path, fmt="native")
+    ref = _loaded(path).fetch_ps_index(500, persist=True)
+
+    # Overwrite the travel-time maps in the file, keeping its header and
+    # modification time: the persisted table is only identified from the
+    # header, so a second load must not read (or page in) the maps
+    stat = os.stat(path)
+    with open(path, "r+b") as f:
+        f.seek(len(qmod.LUT_MAGIC))
+        size, = struct.unpack("<Q", f.read(8))
+        start = -(-(16 + size) // qmod.LUT_ALIGN) * qmod.LUT_ALIGN
+        f.seek(start)
+        f.write(bytes(stat.st_size - start))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    np.testing.assert_array_equal(
+        _loaded(path).fetch_ps_index(500, persist=True), ref)
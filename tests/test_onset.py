@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the onset functions: the streamed onset functions (StreamingOnset)
+against the STA/LTA of the whole stream at once.
+
+"""
+
+import numpy as np
+import pytest
+from obspy import Trace, UTCDateTime
+from obspy.signal.trigger import classic_sta_lta
+from scipy.signal import sosfilt
+
+import QMigrate.core.QMigratelib as ilib
+import QMigrate.signal.scan as qscan
+
+
+def test_sta_lta_classic():
+    sig = np.random.default_rng(0).standard_normal((3, 2000))
+    ref = [classic_sta_lta(s, 21, 101) for s in sig]
+
+    np.testing.assert_allclose(qscan.sta_lta_classic(sig, 21, 101), ref,
+                               rtol=1e-8, atol=1e-12)
+
+
+@pytest.mark.parametrize("blocks", [[3000], [500] * 6, [1, 99, 1400, 1500]])
+def test_streaming_onset(blocks):
+    rng = np.random.default_rng(1)
+    sig = rng.standard_normal((2, sum(blocks))) + 100
+    stream = qscan.StreamingOnset(100, [2.0, 16.0, 2], [0.2, 1.0])
+
+    out = [stream(block) for block in np.split(sig, np.cumsum(blocks)[:-1],
+                                               axis=-1)]
+    onset_raw = np.hstack([raw for raw, _ in out])
+    onset = np.hstack([log for _, log in out])
+
+    fsig = sosfilt(stream.sos, sig - sig[:, :1], axis=-1)
+    ref = qscan.sta_lta_classic(fsig, stream.nsta, stream.nlta)
+    np.testing.assert_allclose(onset_raw, ref, rtol=1e-8, atol=1e-12)
+    np.testing.assert_allclose(
+        onset_raw, [classic_sta_lta(f, stream.nsta, stream.nlta)
+                    for f in fsig], rtol=1e-8, atol=1e-12)
+    np.testing.assert_allclose(onset, np.log(np.clip(ref + 1, 0.8, np.inf)),
+                               rtol=1e-8)
+
+    # A new stream starts afresh
+    stream.reset()
+    np.testing.assert_allclose(stream(sig)[0], ref, rtol=1e-8, atol=1e-12)
+
+
+def test_streamed_time_steps_overlap(icequake_scan):
+    # Streamed time steps are read without detrending, so the samples that
+    # overlap the previous time step are those already streamed
+    data = icequake_scan().data
+    start = UTCDateTime("2014-06-29T18:41:55.0")
+    data.read_waveform_data(start, start + 4, 500, detrend=False)
+    first = data.signal.copy()
+    data.read_waveform_data(start + 1, start + 5, 500, detrend=False)
+
+    np.testing.assert_array_equal(data.signal[..., :1501], first[..., 500:])
+    assert np.any(data.signal)
+
+
+@pytest.mark.skipif(not ilib.available(),
+                    reason="the C-compiled library is unavailable")
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_native_onset_detrend(dtype):
+    rng = np.random.default_rng(2)
+    t = np.arange(2000)
+    sig = rng.standard_normal((3, 2000)) + 0.01 * t + 50
+    stw, ltw = 6, 51
+    sos = qscan._bandpass_sos(100, 2.0, 16.0, 2)
+
+    # As read (linearly detrended and de-meaned by obspy), then as
+    # QuakeScan._compute_p_onset
+    ref = np.stack([Trace(s.copy()).detrend("linear").detrend("demean").data
+                    for s in sig]).astype(dtype)
+    ref = qscan.onset(qscan.filter(ref, 100, 2.0, 16.0, 2), stw, ltw)
+
+    out = np.empty((3, 2000), dtype), np.empty((3, 2000), dtype)
+    ilib.onset(sig.astype(dtype), sos, qscan._taper(2000, 0.1), stw, ltw,
+               out[1], out[0], 1, detrend=True)
+
+    rtol = 1e-3 if dtype == np.float32 else 1e-8
+    np.testing.assert_allclose(out[0], ref[0], rtol=rtol, atol=rtol)
+    np.testing.assert_allclose(out[1], ref[1], rtol=rtol, atol=rtol)